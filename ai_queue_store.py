@@ -0,0 +1,237 @@
+"""
+AIキュー共有ストア - SQLite版
+gunicorn の複数ワーカー間で同時処理数と待機キューを共有する（外部サービス不要）
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _pid_alive(pid):
+    """プロセスが生存しているか判定"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SQLiteQueueStore:
+    def __init__(self, db_path, lease_seconds=600, purge_interval=5):
+        self.db_path = str(db_path)
+        self.lease_seconds = lease_seconds      # これより古い行は異常終了の残骸とみなす
+        self.purge_interval = purge_interval    # 残骸掃除の間隔（秒）
+        self.pid = os.getpid()
+        self.last_purge = 0
+        self.local = threading.local()
+
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ai_slots (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ticket TEXT UNIQUE NOT NULL,
+                    pid INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ai_slots_state ON ai_slots (state, seq)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ai_settings (
+                    key TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                )
+            """)
+            self._purge_stale(conn)
+
+        print(f"[AI QUEUE] 🗄️ Shared store: {self.db_path} (pid: {self.pid})")
+
+    def _connect(self):
+        """スレッドごとの接続を取得"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """書き込みトランザクション（BEGIN IMMEDIATE で排他）"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _purge_stale(self, conn):
+        """終了したワーカーの行と期限切れの行を削除"""
+        now = time.time()
+        self.last_purge = now
+        pids = [row[0] for row in conn.execute("SELECT DISTINCT pid FROM ai_slots")]
+        dead = [pid for pid in pids if pid != self.pid and not _pid_alive(pid)]
+        for pid in dead:
+            conn.execute("DELETE FROM ai_slots WHERE pid = ?", (pid,))
+        cur = conn.execute("DELETE FROM ai_slots WHERE updated_at < ?", (now - self.lease_seconds,))
+        if dead or cur.rowcount:
+            self._bump_version(conn)
+            print(f"[AI QUEUE] 🧹 Purged stale slots (dead workers: {dead}, expired: {cur.rowcount})")
+
+    def _bump_version(self, conn):
+        """キューの状態が変わったことを記録（待機者は version を見るだけで変化を知れる）"""
+        conn.execute(
+            "INSERT INTO ai_settings (key, value) VALUES ('version', 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+        )
+
+    def get_version(self):
+        """キューの状態の version（登録・昇格・取り消し・解放のたびに増える）"""
+        return self.get_value('version', 0)
+
+    def _counts(self, conn):
+        active = conn.execute("SELECT COUNT(*) FROM ai_slots WHERE state = 'active'").fetchone()[0]
+        queued = conn.execute("SELECT COUNT(*) FROM ai_slots WHERE state = 'queued'").fetchone()[0]
+        return active, queued
+
+    def counts(self):
+        """(処理中の数, 待機中の数) を取得"""
+        return self._counts(self._connect())
+
+    def enqueue(self, ticket, max_concurrent):
+        """チケットを登録
+
+        Returns:
+            (即座に処理開始できるか, 待機順位)
+        """
+        with self._transaction() as conn:
+            if time.time() - self.last_purge > self.purge_interval:
+                self._purge_stale(conn)
+            active, queued = self._counts(conn)
+            state = 'active' if active < max_concurrent and queued == 0 else 'queued'
+            conn.execute(
+                "INSERT INTO ai_slots (ticket, pid, state, updated_at) VALUES (?, ?, ?, ?)",
+                (ticket, self.pid, state, time.time())
+            )
+            self._bump_version(conn)
+            if state == 'active':
+                return True, 0
+            return False, queued + 1
+
+    def _position(self, conn, ticket):
+        row = conn.execute("SELECT seq, state FROM ai_slots WHERE ticket = ?", (ticket,)).fetchone()
+        if row is None:
+            return None, 0
+        seq, state = row
+        if state != 'queued':
+            return state, 0
+        ahead = conn.execute(
+            "SELECT COUNT(*) FROM ai_slots WHERE state = 'queued' AND seq < ?", (seq,)
+        ).fetchone()[0]
+        return state, ahead + 1
+
+    def position(self, ticket):
+        """待機順位（1始まり）。待機中でなければ 0"""
+        return self._position(self._connect(), ticket)[1]
+
+    def promote(self, ticket, max_concurrent):
+        """順番が来ていれば待機中→処理中に昇格
+
+        空きスロット数より前に並んでいる人が少ない場合のみ昇格するので、
+        全ワーカーを通して受付順（FIFO）が保たれる。
+
+        Returns:
+            'active'（処理開始可） / 'queued'（待機継続） / 'missing'（チケット消失）
+        """
+        conn = self._connect()
+
+        # まずは読み取りだけで判定（待機中の大半はここで終わる）
+        state, position = self._position(conn, ticket)
+        if state != 'queued':
+            return state or 'missing'
+        active, _ = self._counts(conn)
+        stale = time.time() - self.last_purge > self.purge_interval
+        if position > max_concurrent - active and not stale:
+            return 'queued'
+
+        with self._transaction() as conn:
+            if stale:
+                self._purge_stale(conn)
+            state, position = self._position(conn, ticket)
+            if state != 'queued':
+                return state or 'missing'
+            active, _ = self._counts(conn)
+            if position > max_concurrent - active:
+                return 'queued'
+            conn.execute(
+                "UPDATE ai_slots SET state = 'active', updated_at = ? WHERE ticket = ?",
+                (time.time(), ticket)
+            )
+            self._bump_version(conn)
+            return 'active'
+
+    def cancel(self, ticket):
+        """待機中のチケットを取り消し"""
+        with self._transaction() as conn:
+            if conn.execute("DELETE FROM ai_slots WHERE ticket = ? AND state = 'queued'", (ticket,)).rowcount:
+                self._bump_version(conn)
+
+    def release(self, ticket):
+        """処理中のチケットを解放"""
+        with self._transaction() as conn:
+            if conn.execute("DELETE FROM ai_slots WHERE ticket = ?", (ticket,)).rowcount:
+                self._bump_version(conn)
+
+    def get_value(self, key, default):
+        """共有設定値（同時処理数の上限など）を取得"""
+        row = self._connect().execute("SELECT value FROM ai_settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def update_value(self, key, default, fn):
+        """共有設定値を fn(現在値) で原子的に更新し、新しい値を返す"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM ai_settings WHERE key = ?", (key,)).fetchone()
+            value = fn(row[0] if row else default)
+            conn.execute(
+                "INSERT INTO ai_settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value)
+            )
+            return value
+
+    def get_values(self, defaults):
+        """複数の共有設定値を取得（未設定のキーは defaults の値）"""
+        keys = list(defaults)
+        placeholders = ", ".join("?" for _ in keys)
+        rows = self._connect().execute(
+            f"SELECT key, value FROM ai_settings WHERE key IN ({placeholders})", keys
+        ).fetchall()
+        values = dict(defaults)
+        values.update(rows)
+        return values
+
+    def update_values(self, defaults, fn):
+        """複数の共有設定値を fn(現在値の dict) で原子的に更新"""
+        keys = list(defaults)
+        placeholders = ", ".join("?" for _ in keys)
+        with self._transaction() as conn:
+            rows = conn.execute(
+                f"SELECT key, value FROM ai_settings WHERE key IN ({placeholders})", keys
+            ).fetchall()
+            current = dict(defaults)
+            current.update(rows)
+            updated = fn(current)
+            conn.executemany(
+                "INSERT INTO ai_settings (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                list(updated.items())
+            )
+            return updated
@@ -0,0 +1,131 @@
+"""
+Gemini APIキーのプール
+複数のキーに呼び出しを振り分け、キーごとに利用枠と 429 / 403 のクールダウンを管理する
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from quota import TokenBucket, LocalQuotaState, QuotaGovernor
+
+# キーを一時的に外すエラーと、その秒数
+COOLDOWN_SECONDS = {
+    "rate_limited": 60,   # 429: 利用枠切れ。1分ほどで回復する
+    "forbidden": 600      # 403: 権限なし・無効化。すぐには回復しない
+}
+
+# 残り1本のキーが 429 になった場合の待ち時間（Retry-After の指定がないとき）
+# 最後のキーを1分止めると、その間すべての呼び出しが送られずに失敗するため短くする
+LAST_KEY_BACKOFF_SECONDS = 5
+
+
+class APIKey:
+    def __init__(self, index, value, rpm, rpd):
+        self.value = value
+        self.label = f"key{index + 1} ({value[:6]}...)"  # ログ用（キー全体は出さない）
+        self.quota = QuotaGovernor(
+            [TokenBucket('minute', rpm, 60), TokenBucket('day', rpd, 86400)],
+            LocalQuotaState(),
+            prefix=f"quota:{hashlib.sha256(value.encode()).hexdigest()[:12]}"  # キーそのものは保存しない
+        )
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.cooldowns = 0
+        self.cooldown_until = 0
+
+
+class APIKeyPool:
+    """空いている中で最も負荷の低いキーを選ぶ"""
+    def __init__(self, values, rpm=15, rpd=1500):
+        self.keys = [APIKey(i, value, rpm, rpd) for i, value in enumerate(values)]
+        self.lock = threading.Lock()
+
+        for key in self.keys:
+            if not key.value.startswith("AIza"):
+                print(f"[WARNING] API key format may be incorrect. Expected to start with 'AIza', got: {key.value[:4]}...")
+        print(f"[API KEYS] Initialized: {len(self.keys)} key(s), {rpm}/min, {rpd}/day each")
+
+    def share_quota(self, state):
+        """キーごとの利用枠を共有の状態置き場に移す（ワーカー間で同じ枠を数える）"""
+        for key in self.keys:
+            key.quota.state = state
+
+    def acquire(self):
+        """呼び出しに使うキーを1つ選んで枠を消費（使えるキーがなければ None）"""
+        now = time.monotonic()
+        with self.lock:
+            healthy = [key for key in self.keys if key.cooldown_until <= now]
+            healthy.sort(key=lambda key: (key.in_flight, -key.quota.get_stats()["minute"]["available"]))
+            for key in healthy:
+                ok, _ = key.quota.try_acquire()
+                if ok:
+                    key.in_flight += 1
+                    key.requests += 1
+                    return key
+        return None
+
+    def retry_after(self):
+        """使えるキーができるまでの秒数（クールダウンと利用枠の早い方）"""
+        now = time.monotonic()
+        with self.lock:
+            return min(
+                (max(key.cooldown_until - now, key.quota.eta()) for key in self.keys),
+                default=0
+            )
+
+    def release(self, key, error_kind, retry_after=None):
+        """呼び出し結果を記録（429 / 403 ならしばらくそのキーを使わない）
+
+        429 は retry_after（Retry-After の秒数）があればそれだけ待つ。
+        指定がなく他に使えるキーもなければ、短い待ち時間で済ませる。
+        """
+        with self.lock:
+            key.in_flight -= 1
+            if error_kind is None:
+                return
+            key.errors += 1
+            cooldown = COOLDOWN_SECONDS.get(error_kind)
+            if cooldown and error_kind == "rate_limited":
+                now = time.monotonic()
+                if retry_after is not None:
+                    cooldown = retry_after
+                elif not any(other is not key and other.cooldown_until <= now for other in self.keys):
+                    cooldown = LAST_KEY_BACKOFF_SECONDS
+            if cooldown:
+                key.cooldown_until = time.monotonic() + cooldown
+                key.cooldowns += 1
+                print(f"[API KEYS] 🧊 {key.label}: cooling down {cooldown}s ({error_kind})")
+
+    def get_stats(self):
+        now = time.monotonic()
+        with self.lock:
+            keys = []
+            for key in self.keys:
+                quota = key.quota.get_stats()
+                keys.append({
+                    "key": key.label,
+                    "in_flight": key.in_flight,
+                    "requests": key.requests,
+                    "errors": key.errors,
+                    "cooldowns": key.cooldowns,
+                    "cooldown_remaining": round(max(0, key.cooldown_until - now), 1),
+                    "minute_available": quota["minute"]["available"],
+                    "day_available": quota["day"]["available"]
+                })
+            return keys
+
+
+def _keys_from_env():
+    """GOOGLE_API_KEYS（カンマ区切り）、なければ GOOGLE_API_KEY"""
+    values = os.environ.get('GOOGLE_API_KEYS') or os.environ.get('GOOGLE_API_KEY') or ''
+    return [value.strip() for value in values.split(',') if value.strip()]
+
+
+gemini_keys = APIKeyPool(
+    _keys_from_env(),
+    rpm=int(os.environ.get('GEMINI_RPM', 15)),
+    rpd=int(os.environ.get('GEMINI_RPD', 1500))
+)
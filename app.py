@@ -1,9 +1,26 @@
-from flask import Flask, render_template, request, jsonify
-from chatgpt_api import suggest_outfit
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from chatgpt_api import suggest_outfit, suggest_outfits, gemini_retry_after, get_breaker_stats, prompt_metrics
 from datetime import datetime, timedelta
-from collections import deque
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import time
 import threading
+import uuid
+import json
+import os
+import sys
+import math
+import tempfile
+
+from ai_queue_store import SQLiteQueueStore
+from suggestion_cache import SuggestionCache, SingleFlight
+from suggestion_batch import SuggestionBatcher
+from http_client import gemini_http, github_http
+from model_chain import gemini_models
+from api_keys import gemini_keys
+from context_cache import gemini_context_cache
+from quota import TokenBucket, LocalQuotaState, QuotaGovernor
+from rate_limit import SlidingWindowCounter, StateSnapshotter
 
 # 掲示板モジュールをインポート
 from board_api import (
@@ -19,123 +36,407 @@ app = Flask(__name__)
 # ==========================================
 # AI リクエストキューシステム
 # ==========================================
+class QueueWaiter:
+    """キュー待機者（1リクエストにつき1つ）"""
+    def __init__(self):
+        self.ticket = uuid.uuid4().hex
+        self.event = threading.Event()
+        self.granted = False  # スロットが譲渡されたか
+
+class AdaptiveConcurrencyLimit:
+    """Gemini の応答状況に応じた同時処理数の自動調整（AIMD）
+    
+    応答が速く成功が続く間は1ずつ増やし、429・5xx・タイムアウトで半減させる。
+    """
+    OVERLOAD_KINDS = ("rate_limited", "server_error", "timeout")
+    
+    def __init__(self, initial=10, min_limit=2, max_limit=20):
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = 20.0   # これより速い成功のみ増加の根拠にする（秒）
+        self.decrease_factor = 0.5   # 過負荷時の縮小率
+        self.decrease_cooldown = 10  # 同じ障害で連続して縮小しないための間隔（秒）
+        self.success_streak = 0
+        self.last_decrease = 0
+        self.lock = threading.Lock()
+    
+    def update(self, limit, latency, error_kind):
+        """1回の Gemini 呼び出し結果から新しい上限を計算"""
+        with self.lock:
+            if error_kind in self.OVERLOAD_KINDS:
+                self.success_streak = 0
+                now = time.monotonic()
+                if now - self.last_decrease >= self.decrease_cooldown:
+                    self.last_decrease = now
+                    limit = max(self.min_limit, limit * self.decrease_factor)
+            elif error_kind is None and latency <= self.latency_target:
+                # 現在の上限ぶん成功したら +1（おおむね1巡ごとに1増える）
+                self.success_streak += 1
+                if self.success_streak >= int(limit):
+                    self.success_streak = 0
+                    limit = min(self.max_limit, limit + 1)
+            elif error_kind is None:
+                # 遅い成功は増やさない
+                self.success_streak = 0
+            return limit
+
 class AIRequestQueue:
     def __init__(self):
-        self.max_concurrent = 10  # 同時処理数
-        self.max_queue = 20       # 待機キュー
+        self.limiter = AdaptiveConcurrencyLimit(initial=10, min_limit=2, max_limit=20)
+        self.queue_ratio = 2      # 待機キュー = 同時処理数 × queue_ratio
+        self.limit = float(self.limiter.initial)
+        self.max_concurrent = self.limiter.initial               # 同時処理数（Gemini の応答状況で自動調整）
+        self.max_queue = self.max_concurrent * self.queue_ratio  # 待機キュー
+        self.wait_timeout = 120   # 待機タイムアウト（秒）
         self.active_count = 0     # 現在処理中の数
         self.queue_count = 0      # 現在待機中の数
+        self.waiters = deque()    # 待機者（FIFO）
+        self.version = 0          # 状態が変わるたびに増える
         self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
         
         print("[AI QUEUE] ==========================================")
-        print(f"[AI QUEUE] Initialized: Max concurrent={self.max_concurrent}, Max queue={self.max_queue}")
+        print(f"[AI QUEUE] Initialized: Max concurrent={self.max_concurrent} (adaptive {self.limiter.min_limit}-{self.limiter.max_limit}), Max queue={self.max_queue}, Wait timeout={self.wait_timeout}s")
         print("[AI QUEUE] ==========================================")
     
+    def counts(self):
+        """(処理中の数, 待機中の数) を取得"""
+        with self.lock:
+            return self.active_count, self.queue_count
+    
     def get_status(self):
         """現在の処理状況を取得"""
-        with self.lock:
-            return {
-                "active": self.active_count,
-                "queue": self.queue_count,
-                "total": self.active_count + self.queue_count
-            }
+        active, queue = self.counts()
+        return {
+            "active": active,
+            "queue": queue,
+            "total": active + queue,
+            "limit": self.max_concurrent,
+            "max_queue": self.max_queue
+        }
     
     def can_accept(self):
         """リクエストを受け入れ可能か判定"""
-        with self.lock:
-            total = self.active_count + self.queue_count
-            if total >= (self.max_concurrent + self.max_queue):
-                return False, f"混雑しています（処理中{self.active_count}人、待機中{self.queue_count}人）。しばらく待ってから再試行してください。"
-            return True, ""
+        active, queue = self.counts()
+        if active + queue >= (self.max_concurrent + self.max_queue):
+            return False, f"混雑しています（処理中{active}人、待機中{queue}人）。しばらく待ってから再試行してください。"
+        return True, ""
     
     def acquire(self):
-        """処理スロットを取得（待機が必要な場合はキューに入れる）"""
+        """処理スロットを取得（待機が必要な場合はキューに入れる）
+        
+        Returns:
+            (即座に取得できたか, 待機順位, 待機者)
+            待機者は release() に渡す
+        """
+        waiter = QueueWaiter()
         with self.lock:
-            if self.active_count < self.max_concurrent:
+            # 先に並んでいる人がいる場合は追い越さない
+            if self.active_count < self.max_concurrent and not self.waiters:
                 # 即座に処理開始
                 self.active_count += 1
+                waiter.granted = True
+                self._notify_locked()
                 print(f"[AI QUEUE] ✅ Slot acquired (active: {self.active_count}/{self.max_concurrent})")
-                return True, 0  # 待機なし
+                return True, 0, waiter  # 待機なし
             else:
                 # キューに入る
+                self.waiters.append(waiter)
                 self.queue_count += 1
                 position = self.queue_count
+                self._notify_locked()
                 print(f"[AI QUEUE] ⏳ Queued (position: {position}, queue: {self.queue_count}/{self.max_queue})")
-                return False, position  # 待機あり
+                return False, position, waiter  # 待機あり
     
-    def wait_for_slot(self):
-        """キューから処理スロットが空くまで待機"""
-        while True:
-            with self.lock:
-                if self.active_count < self.max_concurrent:
-                    self.active_count += 1
-                    self.queue_count -= 1
-                    print(f"[AI QUEUE] ✅ Slot acquired from queue (active: {self.active_count}/{self.max_concurrent}, queue: {self.queue_count})")
-                    return True
-            time.sleep(1)  # 1秒ごとにチェック
+    def wait_for_slot(self, waiter, timeout=None):
+        """キューから処理スロットが譲渡されるまで待機
+        
+        release() が最も古い待機者を直接起こすため、ポーリングは行わない。
+        タイムアウトした場合は False を返す（スロットは取得していない）。
+        """
+        if timeout is None:
+            timeout = self.wait_timeout
+        
+        if waiter.event.wait(timeout):
+            return True
+        
+        with self.lock:
+            # タイムアウト直前に譲渡されていた場合はそのまま処理する
+            if waiter.granted:
+                return True
+            try:
+                self.waiters.remove(waiter)
+                self.queue_count -= 1
+                self._notify_locked()
+            except ValueError:
+                pass
+            print(f"[AI QUEUE] ⌛ Wait timeout after {timeout}s (queue: {self.queue_count})")
+            return False
+    
+    def queue_position(self, waiter):
+        """待機者の現在の順位（1始まり）を取得。待機中でなければ 0"""
+        with self.lock:
+            try:
+                return self.waiters.index(waiter) + 1
+            except ValueError:
+                return 0
+    
+    def _apply_limit(self, limit):
+        """上限を反映し、変わったかどうかを返す"""
+        previous = self.max_concurrent
+        self.limit = limit
+        self.max_concurrent = int(limit)
+        self.max_queue = self.max_concurrent * self.queue_ratio
+        if self.max_concurrent != previous:
+            print(f"[AI QUEUE] 📐 Concurrency limit {previous} → {self.max_concurrent} (max queue: {self.max_queue})")
+            return True
+        return False
+    
+    def record_outcome(self, latency, error_kind):
+        """Gemini 呼び出しの結果（所要時間・エラー分類）から上限を調整"""
+        with self.lock:
+            if self._apply_limit(self.limiter.update(self.limit, latency, error_kind)):
+                # 上限が増えた場合は待機者にすぐ譲渡
+                self._dispatch_locked()
+                self._notify_locked()
+    
+    def _notify_locked(self):
+        """状態変化を通知（lock保持中に呼ぶ）"""
+        self.version += 1
+        self.changed.notify_all()
+    
+    def notify_change(self):
+        """状態変化を通知（ジョブ完了時など外部から）"""
+        with self.lock:
+            self._notify_locked()
+    
+    def wait_for_change(self, version, timeout):
+        """version から状態が変わるまで最大 timeout 秒待機し、現在の version を返す"""
+        with self.lock:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+    
+    def _dispatch_locked(self):
+        """空きスロットを古い待機者から順に譲渡（lock保持中に呼ぶ）"""
+        while self.waiters and self.active_count < self.max_concurrent:
+            waiter = self.waiters.popleft()
+            self.queue_count -= 1
+            self.active_count += 1
+            waiter.granted = True
+            waiter.event.set()
+            print(f"[AI QUEUE] ✅ Slot handed off from queue (active: {self.active_count}/{self.max_concurrent}, queue: {self.queue_count})")
     
-    def release(self):
-        """処理スロットを解放"""
+    def release(self, waiter):
+        """処理スロットを解放（待機者がいれば即座に譲渡）"""
         with self.lock:
             self.active_count = max(0, self.active_count - 1)
             print(f"[AI QUEUE] 🔓 Slot released (active: {self.active_count}/{self.max_concurrent})")
+            self._dispatch_locked()
+            self._notify_locked()
+
+class SharedAIRequestQueue(AIRequestQueue):
+    """AIキュー（ワーカー間共有版）
+    
+    処理中・待機中のチケットを SQLite に置き、全ワーカー合計で
+    max_concurrent / max_queue を守る。同一プロセス内の待機者は release() で
+    即座に起こし、他ワーカーの解放は poll_interval ごとの確認で拾う。
+    """
+    def __init__(self, store):
+        self.store = store
+        self.poll_interval = 0.25  # 他ワーカーの解放を確認する間隔（秒）
+        super().__init__()
+    
+    def _refresh_limit(self):
+        """他ワーカーが更新した上限を取り込む"""
+        self._apply_limit(self.store.get_value('limit', self.limiter.initial))
+    
+    def counts(self):
+        self._refresh_limit()
+        return self.store.counts()
+    
+    def record_outcome(self, latency, error_kind):
+        limit = self.store.update_value(
+            'limit', self.limiter.initial,
+            lambda current: self.limiter.update(current, latency, error_kind)
+        )
+        if self._apply_limit(limit):
+            with self.lock:
+                for local_waiter in self.waiters:
+                    local_waiter.event.set()
+                self._notify_locked()
+    
+    def acquire(self):
+        waiter = QueueWaiter()
+        self._refresh_limit()
+        immediate, position = self.store.enqueue(waiter.ticket, self.max_concurrent)
+        self.notify_change()
+        if immediate:
+            waiter.granted = True
+            print(f"[AI QUEUE] ✅ Slot acquired (shared, ticket: {waiter.ticket[:8]})")
+            return True, 0, waiter
+        
+        print(f"[AI QUEUE] ⏳ Queued (shared, position: {position}, ticket: {waiter.ticket[:8]})")
+        return False, position, waiter
+    
+    def wait_for_slot(self, waiter, timeout=None):
+        if timeout is None:
+            timeout = self.wait_timeout
+        deadline = time.monotonic() + timeout
+        
+        with self.lock:
+            self.waiters.append(waiter)
+        try:
+            while True:
+                self._refresh_limit()
+                state = self.store.promote(waiter.ticket, self.max_concurrent)
+                if state == 'active':
+                    waiter.granted = True
+                    self.notify_change()
+                    print(f"[AI QUEUE] ✅ Slot acquired from queue (shared, ticket: {waiter.ticket[:8]})")
+                    return True
+                if state == 'missing':
+                    print(f"[AI QUEUE] ⚠️ Ticket vanished from shared queue: {waiter.ticket[:8]}")
+                    return False
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # 昇格は本人しか行わないので、ここで取り消せば競合しない
+                    self.store.cancel(waiter.ticket)
+                    self.notify_change()
+                    print(f"[AI QUEUE] ⌛ Wait timeout after {timeout}s (shared, ticket: {waiter.ticket[:8]})")
+                    return False
+                
+                waiter.event.wait(min(self.poll_interval, remaining))
+                waiter.event.clear()
+        finally:
+            with self.lock:
+                self.waiters.remove(waiter)
+    
+    def queue_position(self, waiter):
+        return self.store.position(waiter.ticket)
+    
+    def release(self, waiter):
+        self.store.release(waiter.ticket)
+        print(f"[AI QUEUE] 🔓 Slot released (shared, ticket: {waiter.ticket[:8]})")
+        # 同一プロセスの待機者には即座に再確認させる
+        with self.lock:
+            for local_waiter in self.waiters:
+                local_waiter.event.set()
+            self._notify_locked()
+    
+    def wait_for_change(self, version, timeout):
+        """version は (プロセス内の version, 共有ストアの version)
 
-ai_queue = AIRequestQueue()
+        他ワーカーでの変化は通知されないため、poll_interval ごとに共有ストアの version だけを確認する
+        （どちらかが変わるまで戻らない）。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            current = (self.version, self.store.get_version())
+            remaining = deadline - time.monotonic()
+            if current != version or remaining <= 0:
+                return current
+            with self.lock:
+                self.changed.wait_for(lambda: self.version != current[0], min(self.poll_interval, remaining))
+
+def create_ai_queue():
+    """AI_QUEUE_BACKEND に応じてキューを生成（sqlite: ワーカー間共有 / local: プロセス内）"""
+    backend = os.environ.get('AI_QUEUE_BACKEND', 'sqlite').lower()
+    if backend == 'local':
+        return AIRequestQueue()
+    
+    db_path = os.environ.get('AI_QUEUE_DB') or os.path.join(tempfile.gettempdir(), 'weather_app_ai_queue.db')
+    try:
+        return SharedAIRequestQueue(SQLiteQueueStore(db_path))
+    except Exception as e:
+        print(f"[AI QUEUE] ❌ Shared store unavailable ({e}), falling back to per-process queue")
+        return AIRequestQueue()
+
+ai_queue = create_ai_queue()
+
+# ==========================================
+# Gemini 利用枠（無料枠: 15リクエスト/分, 1500リクエスト/日 × APIキー数）
+# ==========================================
+def create_gemini_quota():
+    """共有キューを使う場合は利用枠もワーカー間で共有する"""
+    key_count = max(1, len(gemini_keys.keys))
+    buckets = [
+        TokenBucket('minute', int(os.environ.get('GEMINI_RPM', 15)) * key_count, 60),
+        TokenBucket('day', int(os.environ.get('GEMINI_RPD', 1500)) * key_count, 86400)
+    ]
+    state = ai_queue.store if isinstance(ai_queue, SharedAIRequestQueue) else LocalQuotaState()
+    gemini_keys.share_quota(state)
+    return QuotaGovernor(buckets, state)
+
+gemini_quota = create_gemini_quota()
 
 # ==========================================
 # レート制限システム（デバイスID対応）
 # ==========================================
 class RateLimiter:
-    def __init__(self):
-        self.last_request = {}
+    def __init__(self, idle_ttl=86400, max_devices=10000, sweep_interval=60):
+        self.last_request = OrderedDict()   # 最終リクエスト時刻（古い順に並ぶ）
         self.wait_time = {}
-        self.request_history = {}
         self.initial_wait = 300
         self.max_requests_per_hour = 50
-        self.history_duration = 3600
+        self.hourly = SlidingWindowCounter(self.max_requests_per_hour, 3600)   # 1時間あたりの回数
+        self.idle_ttl = idle_ttl              # これだけ利用がないデバイスは記録を捨てる（待機時間の延長もリセット）
+        self.max_devices = max_devices        # 記録するデバイス数の上限（超えたら古い順に捨てる）
+        self.sweep_interval = sweep_interval  # 期限切れの掃除間隔（秒）
+        self.last_sweep = 0
+        self.evicted_idle = 0
+        self.evicted_overflow = 0
+        self.lock = threading.Lock()
     
-    def clean_old_history(self, device_id):
-        if device_id not in self.request_history:
-            self.request_history[device_id] = deque()
-        
-        now = time.time()
-        while self.request_history[device_id] and now - self.request_history[device_id][0] > self.history_duration:
-            self.request_history[device_id].popleft()
+    def _forget(self, device_id):
+        self.last_request.pop(device_id, None)
+        self.wait_time.pop(device_id, None)
+        self.hourly.forget(device_id)
+    
+    def _sweep_locked(self, now):
+        """期限切れのデバイスを削除（last_request は古い順なので先頭から見るだけでよい）"""
+        self.last_sweep = now
+        while self.last_request:
+            device_id, last = next(iter(self.last_request.items()))
+            if now - last < self.idle_ttl:
+                break
+            self._forget(device_id)
+            self.evicted_idle += 1
+    
+    def _maybe_sweep_locked(self, now):
+        if now - self.last_sweep >= self.sweep_interval:
+            self._sweep_locked(now)
     
     def check_hourly_limit(self, device_id):
-        self.clean_old_history(device_id)
-        
-        if device_id not in self.request_history:
-            return True, 0
-        
-        count = len(self.request_history[device_id])
-        if count >= self.max_requests_per_hour:
-            return False, count
-        
-        return True, count
+        allowed, _, count = self.hourly.check(device_id)
+        return allowed, int(count)
     
     def check_rate_limit(self, device_id):
         now = time.time()
         
-        allowed, count = self.check_hourly_limit(device_id)
-        if not allowed:
-            return False, 0, f"リクエスト上限に達しました。過去1時間に{count}件のリクエストが送信されています。1時間後に再試行してください。"
-        
-        if device_id in self.last_request:
-            elapsed = now - self.last_request[device_id]
-            required_wait = self.wait_time.get(device_id, self.initial_wait)
+        with self.lock:
+            self._maybe_sweep_locked(now)
             
-            if elapsed < required_wait:
-                remaining = int(required_wait - elapsed)
-                minutes = remaining // 60
-                seconds = remaining % 60
-                
-                if minutes > 0:
-                    time_str = f"{minutes}分{seconds}秒"
-                else:
-                    time_str = f"{seconds}秒"
+            allowed, count = self.check_hourly_limit(device_id)
+            if not allowed:
+                return False, 0, f"リクエスト上限に達しました。過去1時間に{count}件のリクエストが送信されています。1時間後に再試行してください。"
+            
+            if device_id in self.last_request:
+                elapsed = now - self.last_request[device_id]
+                required_wait = self.wait_time.get(device_id, self.initial_wait)
                 
-                return False, remaining, f"前回のリクエストから{time_str}経過する必要があります。しばらくお待ちください。"
+                if elapsed < required_wait:
+                    remaining = int(required_wait - elapsed)
+                    minutes = remaining // 60
+                    seconds = remaining % 60
+                    
+                    if minutes > 0:
+                        time_str = f"{minutes}分{seconds}秒"
+                    else:
+                        time_str = f"{seconds}秒"
+                    
+                    return False, remaining, f"前回のリクエストから{time_str}経過する必要があります。しばらくお待ちください。"
         
         return True, 0, ""
     
@@ -147,62 +448,346 @@ class RateLimiter:
         
         now = time.time()
         
-        if device_id not in self.request_history:
-            self.request_history[device_id] = deque()
-        self.request_history[device_id].append(now)
-        
-        self.last_request[device_id] = now
-        
-        if device_id in self.wait_time:
-            self.wait_time[device_id] = min(self.wait_time[device_id] * 2, 3600)
-        else:
-            self.wait_time[device_id] = self.initial_wait
+        with self.lock:
+            self._maybe_sweep_locked(now)
+            
+            self.hourly.record(device_id, now)
+            
+            self.last_request[device_id] = now
+            self.last_request.move_to_end(device_id)
+            
+            if device_id in self.wait_time:
+                self.wait_time[device_id] = min(self.wait_time[device_id] * 2, 3600)
+            else:
+                self.wait_time[device_id] = self.initial_wait
+            next_wait = self.wait_time[device_id]
+            
+            # 上限を超えたら最も長く使われていないデバイスから捨てる
+            while len(self.last_request) > self.max_devices:
+                oldest = next(iter(self.last_request))
+                self._forget(oldest)
+                self.evicted_overflow += 1
         
-        print(f"[RATE LIMIT] ✅ Success recorded for device: {device_id[:16]}... - Next wait time: {self.wait_time[device_id]}秒")
+        print(f"[RATE LIMIT] ✅ Success recorded for device: {device_id[:16]}... - Next wait time: {next_wait}秒")
     
     def get_stats(self, device_id):
-        self.clean_old_history(device_id)
-        
-        count = len(self.request_history.get(device_id, []))
-        next_wait = self.wait_time.get(device_id, self.initial_wait)
+        with self.lock:
+            count = int(self.hourly.count(device_id))
+            next_wait = self.wait_time.get(device_id, self.initial_wait)
         
         return {
             "requests_in_last_hour": count,
             "next_wait_time_seconds": next_wait,
             "max_requests_per_hour": self.max_requests_per_hour
         }
+    
+    def export_state(self):
+        """保存用の状態（デバイスごとに [最終リクエスト時刻, 次の待機時間]）"""
+        with self.lock:
+            return {
+                "devices": {
+                    device_id: [last, self.wait_time.get(device_id, self.initial_wait)]
+                    for device_id, last in self.last_request.items()
+                },
+                "hourly": self.hourly.export_state()
+            }
+    
+    def load_state(self, data):
+        """保存された状態を読み込む（期限切れは捨て、手元にもあるデバイスは新しい方を残す）"""
+        now = time.time()
+        with self.lock:
+            for device_id, (last, wait) in data.get("devices", {}).items():
+                if now - last >= self.idle_ttl:
+                    continue
+                if self.last_request.get(device_id, 0) < last:
+                    self.last_request[device_id] = last
+                    self.wait_time[device_id] = wait
+            self.hourly.load_state(data.get("hourly", {}), now)
+            
+            # 古い順に並べ直し、上限を超えた分は古い方から捨てる
+            self.last_request = OrderedDict(sorted(self.last_request.items(), key=lambda item: item[1]))
+            while len(self.last_request) > self.max_devices:
+                self._forget(next(iter(self.last_request)))
+                self.evicted_overflow += 1
+    
+    def get_memory_stats(self):
+        """記録しているデバイス数と概算メモリ使用量"""
+        with self.lock:
+            self._sweep_locked(time.time())
+            hourly_keys = len(self.hourly)
+            approx_bytes = (
+                sys.getsizeof(self.last_request)
+                + sys.getsizeof(self.wait_time)
+                + sys.getsizeof(self.hourly.windows)
+                + sum(sys.getsizeof(device_id) for device_id in self.last_request)
+                + 24 * (len(self.last_request) + len(self.wait_time))  # float 1個 ≒ 24バイト
+                + 120 * hourly_keys                                   # [番号, 回数, 回数] のリスト1個 ≒ 120バイト
+            )
+            return {
+                "tracked_devices": len(self.last_request),
+                "max_devices": self.max_devices,
+                "hourly_windows": hourly_keys,
+                "approx_bytes": approx_bytes,
+                "evicted_idle": self.evicted_idle,
+                "evicted_overflow": self.evicted_overflow,
+                "idle_ttl_seconds": self.idle_ttl
+            }
+
+rate_limiter = RateLimiter(
+    idle_ttl=int(os.environ.get('RATE_LIMIT_IDLE_TTL', 86400)),
+    max_devices=int(os.environ.get('RATE_LIMIT_MAX_DEVICES', 10000))
+)
+
+def create_rate_limit_snapshot():
+    """レート制限の状態をファイルに定期保存（再起動・ワーカー入れ替え後も制限を引き継ぐ）
+
+    デプロイをまたいで残すには RATE_LIMIT_STATE_FILE を永続ディスク上のパスにする。
+    RATE_LIMIT_SNAPSHOT_INTERVAL=0 で無効。
+    """
+    interval = float(os.environ.get('RATE_LIMIT_SNAPSHOT_INTERVAL', 30))
+    if interval <= 0:
+        return None
+    path = os.environ.get('RATE_LIMIT_STATE_FILE') or os.path.join(tempfile.gettempdir(), 'weather_app_rate_limits.json')
+    return StateSnapshotter("RATE LIMIT", rate_limiter, path, interval).start()
 
-rate_limiter = RateLimiter()
+rate_limit_snapshot = create_rate_limit_snapshot()
 
 # ==========================================
-# Routes
+# AI ジョブ管理（非同期実行）
 # ==========================================
-@app.route('/')
-def index():
-    return render_template('index.html')
+class AIJob:
+    def __init__(self, device_id, stream=False):
+        self.job_id = uuid.uuid4().hex
+        self.device_id = device_id
+        self.stream = stream      # 生成途中の提案文を配信するか
+        self.partial = ""         # 生成途中の提案文
+        self.state = "queued"     # queued / running / done
+        self.waiter = None        # キューのチケット
+        self.result = None
+        self.status_code = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
 
-@app.route('/api/ai_queue_status', methods=['GET'])
-def ai_queue_status():
-    """AIキューの状態を取得（10秒ごとにポーリング用）"""
-    status = ai_queue.get_status()
-    return jsonify(status)
-
-@app.route('/api/suggest_outfit', methods=['POST'])
-def suggest_outfit_api():
-    # 🔧 修正: JSONを一度だけ読み込む
-    data = request.get_json()
+class AIJobManager:
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self.job_ttl = 600        # 完了ジョブの保持時間（秒）
+        self.max_poll_wait = 25   # ロングポーリングの最大待機（秒）
+        self.jobs = {}            # job_id -> AIJob
+        self.device_jobs = {}     # device_id -> 未完了の job_id
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ai-job")
+        
+        print(f"[AI JOB] Initialized: Workers={self.max_workers}, Job TTL={self.job_ttl}s")
     
-    # デバイスIDを取得（フロントエンドから送信）
-    device_id = data.get('device_id')
-    if not device_id:
-        print("[AI] ⚠️ No device_id provided, rejecting request")
-        return jsonify({
-            "error": "invalid_request",
-            "message": "デバイスIDが送信されていません。ページを再読み込みしてください。"
-        }), 400
+    def _purge_locked(self):
+        """期限切れの完了ジョブを削除（lock保持中に呼ぶ）"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.job_ttl
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
     
-    print(f"[AI] 📱 Request from device: {device_id[:16]}...")
+    def submit(self, device_id, weather, options, stream=False):
+        """ジョブを登録してバックグラウンドで実行
+        
+        同じデバイスの未完了ジョブがあれば新規登録せずにそれを返す。
+        
+        Returns:
+            (AIJob, 新規登録したか)
+        """
+        with self.lock:
+            self._purge_locked()
+            existing = self.jobs.get(self.device_jobs.get(device_id))
+            if existing and not existing.done.is_set():
+                return existing, False
+            
+            job = AIJob(device_id, stream=stream)
+            self.jobs[job.job_id] = job
+            self.device_jobs[device_id] = job.job_id
+        
+        flight = None
+        reserved = False
+        try:
+            flight, leader = ai_flights.begin(weather, options)
+            if not leader:
+                # 同一内容の実行中リクエストに相乗り（スロットは使わない）
+                job.state = "running"
+                self.executor.submit(self._follow, job, flight)
+                print(f"[AI JOB] 🔗 Submitted {job.job_id[:8]} (coalesced) - Device: {device_id[:16]}...")
+                return job, True
+            
+            # 利用枠はキューに並ぶ前に確保する（空いていなければスロットを取らずに待ち時間を返す）
+            rejected = reserve_gemini_quota(device_id)
+            if rejected:
+                ai_flights.finish(flight, rejected, 429)
+                self._finish(job, rejected, 429)
+                return job, True
+            reserved = True
+            
+            # 受付順を保つため、キューへの登録はリクエストスレッドで行う
+            immediate, position, waiter = ai_queue.acquire()
+            job.waiter = waiter
+            if immediate:
+                job.state = "running"
+            
+            self.executor.submit(self._run, job, flight, immediate, weather, options)
+            print(f"[AI JOB] 📥 Submitted {job.job_id[:8]} (state: {job.state}) - Device: {device_id[:16]}...")
+            return job, True
+        
+        except Exception as e:
+            # 登録済みのジョブを終わらせないと、同じデバイスの以降の受付と相乗りの後続が止まる
+            print(f"[AI JOB] ❌ Submit failed {job.job_id[:8]} - Device: {device_id[:16]}... - {e}")
+            self._abandon(job, reserved)
+            result = {
+                "type": "error",
+                "suggestions": {
+                    "suggestion": f"❌ システムエラーが発生しました。\n\nエラー: {str(e)[:100]}"
+                }
+            }
+            if flight is not None:
+                ai_flights.finish(flight, result, 500)
+            self._finish(job, result, 500)
+            return job, True
+    
+    def _abandon(self, job, reserved):
+        """実行に渡せなかったジョブのスロット・利用枠を返す"""
+        try:
+            if job.waiter is not None and ai_queue.wait_for_slot(job.waiter, 0):
+                ai_queue.release(job.waiter)
+            if reserved:
+                gemini_quota.refund()
+        except Exception as e:
+            print(f"[AI JOB] ⚠️ Could not clean up {job.job_id[:8]}: {e}")
+    
+    def _run(self, job, flight, immediate, weather, options):
+        """ワーカースレッドでの処理本体"""
+        result = None
+        try:
+            if immediate or ai_queue.wait_for_slot(job.waiter):
+                job.state = "running"
+                on_partial = (lambda text: self._update_partial(job, text)) if job.stream else None
+                try:
+                    result, status_code = run_suggestion(job.device_id, weather, options, on_partial)
+                finally:
+                    # 必ずスロットを解放
+                    ai_queue.release(job.waiter)
+            else:
+                gemini_quota.refund()
+                print(f"[AI JOB] ⌛ {job.job_id[:8]} gave up waiting - Device: {job.device_id[:16]}...")
+        finally:
+            if result is None:
+                result, status_code = queue_timeout_body(), 503
+            ai_flights.finish(flight, result, status_code)
+        
+        self._finish(job, result, status_code)
+    
+    def _update_partial(self, job, text):
+        job.partial = text
+        ai_queue.notify_change()
+    
+    def _follow(self, job, flight):
+        result, status_code = follow_flight(job.device_id, flight)
+        self._finish(job, result, status_code)
+    
+    def _finish(self, job, result, status_code):
+        with self.lock:
+            job.result = result
+            job.status_code = status_code
+            job.state = "done"
+            job.finished_at = time.time()
+            if self.device_jobs.get(job.device_id) == job.job_id:
+                del self.device_jobs[job.device_id]
+        job.done.set()
+        ai_queue.notify_change()
+        print(f"[AI JOB] 📤 Finished {job.job_id[:8]} (status: {status_code}, took {job.finished_at - job.created_at:.1f}s)")
+    
+    def get(self, job_id, device_id):
+        """ジョブを取得（他デバイスのジョブは見えない）"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None or job.device_id != device_id:
+            return None
+        return job
+    
+    def wait(self, job, timeout):
+        """ジョブ完了まで最大 timeout 秒待機（ロングポーリング用）"""
+        timeout = max(0, min(timeout, self.max_poll_wait))
+        return job.done.wait(timeout)
     
+    def result_body(self, job):
+        """完了ジョブのレスポンス本体"""
+        body = dict(job.result)
+        body["job_id"] = job.job_id
+        body["job_status"] = "done"
+        return body
+    
+    def pending_body(self, job):
+        """未完了ジョブのレスポンス本体"""
+        position = ai_queue.queue_position(job.waiter) if job.state == "queued" else 0
+        return {
+            "job_id": job.job_id,
+            "job_status": job.state,
+            "position": position,
+            "queue_status": ai_queue.get_status()
+        }
+
+ai_jobs = AIJobManager(max_workers=ai_queue.limiter.max_limit * (1 + ai_queue.queue_ratio))
+
+# 同一条件の提案キャッシュ（ヒット時はキュー・Gemini を経由しない）
+suggestion_cache = SuggestionCache()
+
+# 同一条件の同時リクエストを1回の呼び出しにまとめる
+ai_flights = SingleFlight()
+
+# ==========================================
+# AI 一括リクエスト（AI_BATCH_SIZE が2以上で有効）
+# ==========================================
+def send_suggestion_batch(items):
+    """まとめたリクエストを1回の Gemini 呼び出しで処理（利用枠も1回分）"""
+    # 利用枠は受付時に1件ずつ確保済みなので、まとめた分は返す
+    gemini_quota.refund(len(items) - 1)
+    
+    reserve_call = lambda: gemini_quota.try_acquire()[0]
+    if len(items) == 1:
+        weather, options = items[0]
+        results = [suggest_outfit(weather, options, reserve_call=reserve_call)]
+    else:
+        results = suggest_outfits(items, reserve_call=reserve_call)
+    refund_if_not_sent(results[0])
+    return results
+
+def create_ai_batcher():
+    """一括リクエストは途中経過を配信できないため、既定では無効"""
+    max_size = int(os.environ.get('AI_BATCH_SIZE', 1))
+    if max_size < 2:
+        return None
+    return SuggestionBatcher(
+        send_suggestion_batch,
+        max_size=max_size,
+        window_seconds=float(os.environ.get('AI_BATCH_WINDOW', 0.5))
+    )
+
+ai_batcher = create_ai_batcher()
+
+# ==========================================
+# AI 服装提案の共通処理
+# ==========================================
+def parse_suggest_options(data):
+    """リクエストから提案オプションを取り出す"""
+    return {
+        "mode": data.get('mode', 'simple'),
+        "scene": data.get('scene', ''),
+        "gender": data.get('gender', 'unspecified'),
+        "preference": data.get('preference', ''),
+        "wardrobe": data.get('wardrobe', '')
+    }
+
+def check_admission(device_id):
+    """キュー受付とレート制限をチェック（問題なければ None）"""
     # キュー受付チェック
     can_accept, error_msg = ai_queue.can_accept()
     if not can_accept:
@@ -213,6 +798,12 @@ def suggest_outfit_api():
             "status": ai_queue.get_status()
         }), 503  # Service Unavailable
     
+    # Gemini 障害チェック（サーキットブレーカーが全モデル遮断中ならスロットを取らずに返す）
+    retry_after = gemini_retry_after()
+    if retry_after > 0:
+        print(f"[CIRCUIT] ❌ Gemini unavailable ({retry_after:.1f}s) - Rejected device: {device_id[:16]}...")
+        return jsonify(ai_unavailable_body(retry_after)), 503
+    
     # レート制限チェック
     allowed, remaining_time, error_msg = rate_limiter.check_rate_limit(device_id)
     
@@ -224,56 +815,369 @@ def suggest_outfit_api():
             "remaining_time": remaining_time
         }), 429
     
-    # スロット取得（即座 or キュー待ち）
-    immediate, position = ai_queue.acquire()
+    return None
+
+def reserve_gemini_quota(device_id):
+    """キューに並ぶ前に Gemini の利用枠を1回分確保（問題なければ None）
+
+    空いていなければスロットを取らずに、空くまでの秒数付きの本体を返す（429）。
+    キューで待ちきれなかった場合は gemini_quota.refund() で返す。
+    """
+    ok, wait = gemini_quota.try_acquire()
+    if ok:
+        return None
+    print(f"[QUOTA] ❌ Quota exhausted (ETA {int(wait)}s) - Rejected device: {device_id[:16]}...")
+    return quota_exhausted_body(wait)
+
+def format_wait(seconds):
+    """待ち時間を「N分N秒」形式にする"""
+    seconds = int(math.ceil(seconds))
+    minutes = seconds // 60
+    if minutes > 0:
+        return f"{minutes}分{seconds % 60}秒"
+    return f"{seconds}秒"
+
+def quota_exhausted_body(wait):
+    return {
+        "error": "quota_exhausted",
+        "message": f"AIの利用枠が上限に達しています。{format_wait(wait)}後に再試行してください。",
+        "remaining_time": int(math.ceil(wait))
+    }
+
+def ai_unavailable_body(retry_after):
+    return {
+        "error": "ai_unavailable",
+        "message": f"AIサービスで障害が発生しているため、一時的に利用を停止しています。{format_wait(retry_after)}後に再試行してください。",
+        "remaining_time": int(math.ceil(retry_after)),
+        "status": ai_queue.get_status()
+    }
+
+def queue_timeout_body():
+    return {
+        "error": "queue_timeout",
+        "message": "待機時間が長すぎるため処理を中止しました。しばらく待ってから再試行してください。",
+        "status": ai_queue.get_status()
+    }
+
+def follow_flight(device_id, flight):
+    """同一内容で実行中のリクエストの結果を待って共有する"""
+    print(f"[AI FLIGHT] 🔗 Coalesced with in-flight request - Device: {device_id[:16]}...")
+    if not ai_flights.wait(flight):
+        print(f"[AI FLIGHT] ⌛ Gave up waiting for in-flight request - Device: {device_id[:16]}...")
+        return queue_timeout_body(), 503
     
-    if not immediate:
-        # キュー待ち
-        print(f"[AI QUEUE] ⏳ Waiting in queue (position: {position}) - Device: {device_id[:16]}...")
-        ai_queue.wait_for_slot()
+    # 成功時のみレート制限を記録（通常のリクエストと同じ扱い）
+    if flight.status_code == 200:
+        rate_limiter.record_request(device_id, success=True)
+    return flight.result, flight.status_code
+
+# Gemini に送らずに終わった結果（遮断中・使えるAPIキーなし・設定不備）
+NOT_SENT_ERRORS = ("circuit_open", "keys_exhausted", "config")
+
+def refund_if_not_sent(result):
+    """1回目の呼び出しを送らずに終わった場合、受付時に確保した利用枠を返す"""
+    if result.get("error_kind") in NOT_SENT_ERRORS:
+        gemini_quota.refund()
+
+def call_gemini(weather, options, on_partial=None):
+    """Gemini で1件生成（1回目の呼び出しの利用枠は受付時に確保済み）"""
+    # ヘッジ・フォールバックで追加の呼び出しをする分も利用枠から差し引く
+    result = suggest_outfit(
+        weather, options,
+        on_partial=on_partial,
+        reserve_call=lambda: gemini_quota.try_acquire()[0]
+    )
+    refund_if_not_sent(result)
+    return result
+
+def run_suggestion(device_id, weather, options, on_partial=None):
+    """Gemini で提案を生成（利用枠とスロットを取得済みで呼ぶ）
     
+    on_partial を渡すとストリーミングで生成し、途中経過を通知する。
+    一括リクエストが有効な場合は他のリクエストとまとめて生成する（途中経過なし）。
+    
+    Returns:
+        (レスポンス本体, ステータスコード)
+    """
     try:
-        weather = data.get('weather_data')
-        
-        options = {
-            "mode": data.get('mode', 'simple'),
-            "scene": data.get('scene', ''),
-            "gender": data.get('gender', 'unspecified'),
-            "preference": data.get('preference', ''),
-            "wardrobe": data.get('wardrobe', '')
-        }
-        
-        if not weather:
-            return jsonify({"error": "No weather data provided"}), 400
-        
         print(f"[AI REQUEST] 🚀 Processing - Device: {device_id[:16]}...")
-        result = suggest_outfit(weather, options)
+        started = time.monotonic()
+        if ai_batcher is not None:
+            result = ai_batcher.submit(weather, options)
+        else:
+            result = call_gemini(weather, options, on_partial)
+        
+        if result.get("error_kind") == "circuit_open":
+            print(f"[AI ERROR] 🔌 Device: {device_id[:16]}... - Gemini circuit open")
+            # 受付後に遮断された・試行中だった場合も「0秒後」とは案内しない
+            return ai_unavailable_body(max(1, gemini_retry_after())), 503
+        if result.get("error_kind") == "keys_exhausted":
+            # Gemini には送っていないので、同時処理数の調整には数えない
+            wait = result["remaining_time"]
+            print(f"[API KEYS] ❌ No key available (ETA {int(wait)}s) - Device: {device_id[:16]}...")
+            return quota_exhausted_body(wait), 429
+        ai_queue.record_outcome(time.monotonic() - started, result.get("error_kind"))
         
         # 成功時のみレート制限を記録
         if result.get("type") == "success":
             rate_limiter.record_request(device_id, success=True)
+            suggestion_cache.put(weather, options, result)
             print(f"[AI SUCCESS] ✅ Device: {device_id[:16]}...")
-            status_code = 200
-        else:
-            # エラー時はレート制限を記録しない
-            print(f"[AI ERROR] ❌ Device: {device_id[:16]}... - Error occurred, NOT recording rate limit")
-            status_code = 500
+            return result, 200
         
-        return jsonify(result), status_code
+        # エラー時はレート制限を記録しない
+        print(f"[AI ERROR] ❌ Device: {device_id[:16]}... - Error occurred, NOT recording rate limit")
+        return result, 500
         
     except Exception as e:
         print(f"[AI EXCEPTION] ❌ Device: {device_id[:16]}... - Exception: {e}")
         # 例外時もレート制限を記録しない
-        return jsonify({
+        return {
             "type": "error",
             "suggestions": {
                 "suggestion": f"❌ システムエラーが発生しました。\n\nエラー: {str(e)[:100]}"
             }
-        }), 500
+        }, 500
+
+# ==========================================
+# Routes
+# ==========================================
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.route('/api/ai_queue_status', methods=['GET'])
+def ai_queue_status():
+    """AIキューの状態を取得（ジョブの進捗は /api/suggest_outfit/stream で配信）"""
+    status = ai_queue.get_status()
+    status["cache"] = suggestion_cache.get_stats()
+    status["coalescing"] = ai_flights.get_stats()
+    status["quota"] = gemini_quota.get_stats()
+    status["models"] = gemini_models.get_stats()
+    status["circuit"] = get_breaker_stats()
+    status["api_keys"] = gemini_keys.get_stats()
+    status["batching"] = ai_batcher.get_stats() if ai_batcher else {"enabled": False}
+    status["prompt"] = prompt_metrics.get_stats()
+    status["rate_limiter"] = rate_limiter.get_memory_stats()
+    status["rate_limiter"]["snapshot"] = rate_limit_snapshot.get_stats() if rate_limit_snapshot else {"enabled": False}
+    status["context_cache"] = gemini_context_cache.get_stats()
+    status["http"] = {
+        "gemini": gemini_http.get_stats(),
+        "github": github_http.get_stats()
+    }
+    return jsonify(status)
+
+@app.route('/api/suggest_outfit', methods=['POST'])
+def suggest_outfit_api():
+    """服装提案（同期版：結果が出るまでリクエストを保持）"""
+    # 🔧 修正: JSONを一度だけ読み込む
+    data = request.get_json()
+    
+    # デバイスIDを取得（フロントエンドから送信）
+    device_id = data.get('device_id')
+    if not device_id:
+        print("[AI] ⚠️ No device_id provided, rejecting request")
+        return jsonify({
+            "error": "invalid_request",
+            "message": "デバイスIDが送信されていません。ページを再読み込みしてください。"
+        }), 400
+    
+    print(f"[AI] 📱 Request from device: {device_id[:16]}...")
+    
+    weather = data.get('weather_data')
+    if not weather:
+        return jsonify({"error": "No weather data provided"}), 400
+    
+    options = parse_suggest_options(data)
+    cached = suggestion_cache.get(weather, options)
+    if cached is not None:
+        print(f"[AI CACHE] ⚡ Cache hit - Device: {device_id[:16]}...")
+        return jsonify(cached), 200
+    
+    rejected = check_admission(device_id)
+    if rejected:
+        return rejected
+    
+    # 同一内容の実行中リクエストがあれば相乗り（スロットは使わない）
+    flight, leader = ai_flights.begin(weather, options)
+    if not leader:
+        result, status_code = follow_flight(device_id, flight)
+        return jsonify(result), status_code
+    
+    result = None
+    try:
+        # 利用枠の確保（空いていなければスロットを取らずに返す）
+        rejected = reserve_gemini_quota(device_id)
+        if rejected:
+            result, status_code = rejected, 429
+            return jsonify(result), status_code
+        
+        # スロット取得（即座 or キュー待ち）
+        immediate, position, waiter = ai_queue.acquire()
         
+        if not immediate:
+            # キュー待ち
+            print(f"[AI QUEUE] ⏳ Waiting in queue (position: {position}) - Device: {device_id[:16]}...")
+            if not ai_queue.wait_for_slot(waiter):
+                gemini_quota.refund()
+                print(f"[AI QUEUE] ❌ Gave up waiting - Device: {device_id[:16]}...")
+                result, status_code = queue_timeout_body(), 503
+                return jsonify(result), status_code
+        
+        try:
+            result, status_code = run_suggestion(device_id, weather, options)
+            return jsonify(result), status_code
+            
+        finally:
+            # 必ずスロットを解放
+            ai_queue.release(waiter)
+    
     finally:
-        # 必ずスロットを解放
-        ai_queue.release()
+        # 相乗りしている後続に結果を配る
+        if result is None:
+            result, status_code = queue_timeout_body(), 503
+        ai_flights.finish(flight, result, status_code)
+
+@app.route('/api/suggest_outfit/submit', methods=['POST'])
+def suggest_outfit_submit():
+    """服装提案ジョブを登録（即座に job_id を返す）"""
+    data = request.get_json()
+    
+    device_id = data.get('device_id')
+    if not device_id:
+        print("[AI] ⚠️ No device_id provided, rejecting request")
+        return jsonify({
+            "error": "invalid_request",
+            "message": "デバイスIDが送信されていません。ページを再読み込みしてください。"
+        }), 400
+    
+    print(f"[AI] 📱 Job request from device: {device_id[:16]}...")
+    
+    weather = data.get('weather_data')
+    if not weather:
+        return jsonify({"error": "No weather data provided"}), 400
+    
+    options = parse_suggest_options(data)
+    cached = suggestion_cache.get(weather, options)
+    if cached is not None:
+        print(f"[AI CACHE] ⚡ Cache hit - Device: {device_id[:16]}...")
+        return jsonify(cached), 200
+    
+    rejected = check_admission(device_id)
+    if rejected:
+        return rejected
+    
+    job, created = ai_jobs.submit(device_id, weather, options, stream=bool(data.get('stream')))
+    if not created:
+        print(f"[AI JOB] ♻️ Returning existing job {job.job_id[:8]} - Device: {device_id[:16]}...")
+    
+    # 利用枠切れなどで受付時点で終わったジョブは結果をそのまま返す
+    if job.done.is_set():
+        return jsonify(ai_jobs.result_body(job)), job.status_code
+    
+    return jsonify(ai_jobs.pending_body(job)), 202  # Accepted
+
+@app.route('/api/suggest_outfit/result', methods=['POST'])
+def suggest_outfit_result():
+    """服装提案ジョブの結果を取得（wait 秒までロングポーリング）"""
+    data = request.get_json()
+    device_id = data.get('device_id')
+    job_id = data.get('job_id')
+    
+    job = ai_jobs.get(job_id, device_id) if device_id and job_id else None
+    if job is None:
+        return jsonify({
+            "error": "job_not_found",
+            "message": "提案ジョブが見つかりません。もう一度お試しください。"
+        }), 404
+    
+    try:
+        wait = float(data.get('wait', 0))
+    except (TypeError, ValueError):
+        wait = 0
+    
+    if not ai_jobs.wait(job, wait):
+        return jsonify(ai_jobs.pending_body(job)), 202
+    
+    return jsonify(ai_jobs.result_body(job)), job.status_code
+
+# 1ワーカーで同時に配信する進捗ストリームの上限（gunicorn のスレッド数より十分小さくする）
+sse_streams = threading.BoundedSemaphore(int(os.environ.get('AI_MAX_STREAMS', 6)))
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/suggest_outfit/stream', methods=['GET'])
+def suggest_outfit_stream():
+    """服装提案ジョブの進捗を Server-Sent Events で配信
+    
+    待機順位・処理状況が変わるたびに status イベントを、
+    ストリーミング生成中は提案文が伸びるたびに partial イベントを送り、
+    完了したら result イベントを送って接続を閉じる。
+    """
+    device_id = request.args.get('device_id')
+    job_id = request.args.get('job_id')
+    
+    job = ai_jobs.get(job_id, device_id) if device_id and job_id else None
+    if job is None:
+        return jsonify({
+            "error": "job_not_found",
+            "message": "提案ジョブが見つかりません。もう一度お試しください。"
+        }), 404
+    
+    # 配信中はスレッドを1つ占有するため、同時配信数を超えた分はロングポーリングに回す（503 でクライアントが切り替える）
+    if not sse_streams.acquire(blocking=False):
+        print(f"[AI JOB] 🚦 Too many streams, falling back to long polling - Device: {device_id[:16]}...")
+        return jsonify({
+            "error": "stream_unavailable",
+            "message": "進捗の配信が混み合っています。結果は /api/suggest_outfit/result で取得してください。"
+        }), 503
+    
+    heartbeat_interval = 15  # 接続維持用コメントの送信間隔（秒）
+    
+    def generate():
+        last_sent = None
+        last_checked = None
+        last_partial = ""
+        last_write = time.monotonic()
+        version = ai_queue.wait_for_change(-1, 0)
+        
+        while not job.done.is_set():
+            # キューの状態かジョブの状態が変わったときだけ順位・人数を取り直す
+            if (version, job.state) != last_checked:
+                last_checked = (version, job.state)
+                body = ai_jobs.pending_body(job)
+                snapshot = (body["job_status"], body["position"], body["queue_status"]["active"], body["queue_status"]["queue"])
+                if snapshot != last_sent:
+                    last_sent = snapshot
+                    last_write = time.monotonic()
+                    yield sse_event("status", body)
+            if job.partial != last_partial:
+                last_partial = job.partial
+                last_write = time.monotonic()
+                yield sse_event("partial", {"text": last_partial})
+            if time.monotonic() - last_write > heartbeat_interval:
+                last_write = time.monotonic()
+                yield ": keep-alive\n\n"
+            
+            version = ai_queue.wait_for_change(version, heartbeat_interval)
+        
+        yield sse_event("result", {
+            "status_code": job.status_code,
+            "body": ai_jobs.result_body(job)
+        })
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+    # 配信が終わった・切断されたときに枠を返す（ジェネレーターが始まらなかった場合も呼ばれる）
+    response.call_on_close(sse_streams.release)
+    return response
 
 @app.route('/api/rate_limit_stats', methods=['POST'])  # 🔧 修正: GET → POST
 def rate_limit_stats():
@@ -0,0 +1,192 @@
+"""
+AI服装提案の負荷試験
+ローカルの Gemini 代替サーバー（mock_gemini.py）に向けて /api/suggest_outfit を並列に呼び出し、
+スループット・キュー待ち時間・応答時間の分布を表示する（実際の API 利用枠は使わない）
+
+使い方:
+    python benchmark.py --requests 200 --concurrency 40 --latency lognormal:1.5,0.5 --error-429 0.03
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from mock_gemini import MockGeminiServer, add_config_arguments, config_from_args
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(values):
+    return {
+        "p50": round(percentile(values, 0.5), 3),
+        "p90": round(percentile(values, 0.9), 3),
+        "p99": round(percentile(values, 0.99), 3),
+        "max": round(max(values), 3) if values else 0.0
+    }
+
+
+def sample_weather(i):
+    """リクエストごとに少しずつ違う天気（キャッシュに当たらないように）"""
+    return {
+        "temp": 10 + (i % 200) / 10,
+        "temp_max": 18,
+        "temp_min": 6,
+        "weather": "晴れ",
+        "humidity": 55,
+        "precipitation": 0,
+        "pressure": 1013,
+        "hourly_forecast": [
+            {"time": f"{hour}時", "temperature": 12 + hour % 5, "precipitation": 0,
+             "precipitation_probability": 10 * (hour % 4), "weather": "晴れ"}
+            for hour in range(12)
+        ]
+    }
+
+
+def instrument_queue(ai_queue, queue_waits):
+    """キューのスロット取得までの待ち時間を記録する（計測用のラッパー）"""
+    local = threading.local()
+    acquire = ai_queue.acquire
+    wait_for_slot = ai_queue.wait_for_slot
+
+    def timed_acquire():
+        local.started = time.monotonic()
+        immediate, position, waiter = acquire()
+        if immediate:
+            queue_waits.append(0.0)
+        return immediate, position, waiter
+
+    def timed_wait_for_slot(waiter, timeout=None):
+        granted = wait_for_slot(waiter, timeout)
+        if granted:
+            queue_waits.append(time.monotonic() - local.started)
+        return granted
+
+    ai_queue.acquire = timed_acquire
+    ai_queue.wait_for_slot = timed_wait_for_slot
+
+
+def benchmark_parser(chatgpt_api, iterations):
+    """応答パーサー単体の処理時間（通常 / MAX_TOKENS の途中切れ）"""
+    from mock_gemini import SAMPLE_SUGGESTION
+    complete = json.dumps({"suggestion": SAMPLE_SUGGESTION}, ensure_ascii=False)
+    truncated = complete[:len(complete) // 2]
+
+    results = {}
+    for label, content, finish_reason in (("complete", complete, "STOP"), ("truncated", truncated, "MAX_TOKENS")):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            chatgpt_api.parse_suggestion(content, finish_reason)
+        elapsed = time.perf_counter() - started
+        results[label] = {"us_per_call": round(elapsed / iterations * 1e6, 1)}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI服装提案の負荷試験（ローカルの Gemini 代替サーバーを使用）")
+    parser.add_argument("--requests", type=int, default=100, help="総リクエスト数")
+    parser.add_argument("--concurrency", type=int, default=20, help="同時に送るリクエスト数")
+    parser.add_argument("--devices", type=int, default=0, help="デバイス数（0ならリクエストごとに別デバイス。少なくするとレート制限に当たる）")
+    parser.add_argument("--distinct-weather", type=int, default=0, help="天気のバリエーション数（0ならすべて別。少なくするとキャッシュ・相乗りが効く）")
+    parser.add_argument("--mode", choices=["simple", "detailed"], default="simple")
+    parser.add_argument("--base-url", help="起動済みの代替サーバーを使う場合の URL")
+    parser.add_argument("--parser-iterations", type=int, default=2000)
+    parser.add_argument("--verbose", action="store_true", help="アプリのログも表示する")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    mock = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        mock = MockGeminiServer(config_from_args(args)).start()
+        base_url = mock.base_url
+
+    # app を読み込む前に接続先と利用枠を設定する（利用枠で待たされないよう十分大きくする）
+    os.environ["GEMINI_BASE_URL"] = base_url
+    os.environ.setdefault("GOOGLE_API_KEY", "AIzaBenchmarkDummyKey")
+    os.environ.setdefault("AI_QUEUE_BACKEND", "local")
+    os.environ.setdefault("GEMINI_RPM", "100000")
+    os.environ.setdefault("GEMINI_RPD", "10000000")
+    # 仮のデバイスの制限状態を本番と同じファイルに読み書きしない
+    os.environ.setdefault("RATE_LIMIT_SNAPSHOT_INTERVAL", "0")
+
+    # アプリのログは大量に出るので、既定では計測中は捨てる
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with quiet:
+        report = run(args, base_url)
+    if mock:
+        report["upstream"] = mock.get_stats()
+        mock.stop()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def run(args, base_url):
+    import app as app_module
+    import chatgpt_api
+
+    queue_waits = []
+    instrument_queue(app_module.ai_queue, queue_waits)
+
+    latencies = []
+    statuses = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+    devices = args.devices or args.requests
+    variants = args.distinct_weather or args.requests
+
+    def one(i):
+        client = app_module.app.test_client()
+        started = time.monotonic()
+        response = client.post("/api/suggest_outfit", json={
+            "device_id": f"benchmark-device-{i % devices:06d}",
+            "weather_data": sample_weather(i % variants),
+            "mode": args.mode
+        })
+        elapsed = time.monotonic() - started
+        body = response.get_json(silent=True) or {}
+        with lock:
+            latencies.append(elapsed)
+            statuses[response.status_code] += 1
+            if response.status_code != 200:
+                errors[body.get("error") or body.get("error_kind") or "unknown"] += 1
+
+    print(f"[BENCHMARK] {args.requests} requests, concurrency {args.concurrency}, upstream {base_url}", file=sys.stderr)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(one, range(args.requests)))
+    elapsed = time.monotonic() - started
+
+    report = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(args.requests / elapsed, 2),
+        "status_codes": dict(statuses),
+        "errors": dict(errors),
+        "latency_seconds": summarize(latencies),
+        "queue_wait_seconds": summarize(queue_waits),
+        "queue": app_module.ai_queue.get_status(),
+        "cache": app_module.suggestion_cache.get_stats(),
+        "coalescing": app_module.ai_flights.get_stats(),
+        "models": app_module.gemini_models.get_stats(),
+        "parser": benchmark_parser(chatgpt_api, args.parser_iterations)
+    }
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+掲示板の保存先の負荷試験
+投稿数を増やしながら、返信先の確認・通報・名前の重複確認・投稿の1回あたりの処理時間を測る
+（以前の全件走査の処理も同じデータで測って並べる）
+
+使い方:
+    python benchmark_board.py --posts 1000 10000 20000 --backend memory
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from board_store import MemoryBoardStorage, SQLiteBoardStorage
+
+
+# ==========================================
+# 以前の処理（リストと辞書の全件走査）
+# ==========================================
+def scan_parent_exists(posts, parent_id):
+    return any(post['id'] == parent_id for post in posts)
+
+
+def scan_reported_posts(posts, reports, author_device_id):
+    return len([
+        pid for pid, reporters in reports.items()
+        if len(reporters) >= 2 and any(p['id'] == pid and p['device_id'] == author_device_id for p in posts)
+    ])
+
+
+def scan_username_taken(users, username):
+    return username in users.values()
+
+
+def time_per_call(fn, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return round((time.perf_counter() - started) / iterations * 1e6, 1)
+
+
+def sample_data(count):
+    """count 件の投稿・ユーザー・通報（投稿の約1割に2件の通報）"""
+    base = datetime.now() - timedelta(hours=1)
+    posts = [{
+        'id': i,
+        'content': f'投稿 {i}',
+        'username': f'user{i % 500}',
+        'device_id': f'device-{i % 500:04d}',
+        'timestamp': (base + timedelta(milliseconds=i)).isoformat(),
+        'parent_id': i - 1 if i % 3 == 0 and i > 1 else None,
+        'is_suspicious': False,
+        'is_hidden': False,
+        'report_count': 2 if i % 10 == 0 else 0
+    } for i in range(1, count + 1)]
+    users = {f'device-{i:04d}': f'user{i}' for i in range(max(500, count // 10))}
+    reports = {i: ['reporter-a', 'reporter-b'] for i in range(10, count + 1, 10)}
+    return {'posts': posts, 'next_post_id': count + 1, 'users': users, 'reports': reports, 'bans': {}}
+
+
+def create_storage(backend, workdir, data):
+    if backend == 'memory':
+        storage = MemoryBoardStorage(Path(workdir), threading.RLock(), (10, 3600))
+    else:
+        db_path = os.path.join(workdir, f'board-{len(data["posts"])}.db')
+        storage = SQLiteBoardStorage(db_path, (10, 3600))
+    storage.import_data(data)
+    return storage
+
+
+def run(count, backend, iterations, workdir):
+    data = sample_data(count)
+    storage = create_storage(backend, workdir, data)
+    posts, reports, users = data['posts'], data['reports'], data['users']
+    cutoff = (datetime.now() - timedelta(days=3)).isoformat()
+
+    def new_post(i):
+        storage.add_post({
+            'content': 'new', 'username': 'bench', 'device_id': f'device-{i % 500:04d}',
+            'timestamp': datetime.now().isoformat(), 'parent_id': None,
+            'is_suspicious': False, 'is_hidden': False, 'report_count': 0
+        })
+        storage.prune_posts(cutoff, count)
+
+    result = {
+        "posts": count,
+        "parent_lookup_us": {
+            "scan": time_per_call(lambda i: scan_parent_exists(posts, count - i % count), iterations),
+            "indexed": time_per_call(lambda i: storage.get_post(count - i % count), iterations)
+        },
+        "author_reports_us": {
+            "scan": time_per_call(lambda i: scan_reported_posts(posts, reports, f'device-{i % 500:04d}'), 1),  # 遅いので1回だけ
+            "indexed": time_per_call(lambda i: storage.count_reported_posts(f'device-{i % 500:04d}', 2), iterations)
+        },
+        "username_taken_us": {
+            "scan": time_per_call(lambda i: scan_username_taken(users, f'missing{i}'), iterations),
+            "indexed": time_per_call(lambda i: storage.username_taken(f'missing{i}'), iterations)
+        },
+        "add_post_and_prune_us": time_per_call(new_post, iterations)
+    }
+    if backend == 'memory':
+        storage.writer.flush()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="掲示板の保存先の負荷試験")
+    parser.add_argument("--posts", type=int, nargs="+", default=[1000, 10000, 20000], help="投稿数（複数指定で比較）")
+    parser.add_argument("--backend", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"[BENCHMARK] backend={args.backend}, posts={args.posts}", file=sys.stderr)
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(io.StringIO()):
+        results = [run(count, args.backend, args.iterations, workdir) for count in args.posts]
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@
 デバイスID対応版（2026年1月）
 """
 
-from flask import jsonify, request
+from flask import jsonify, request, Response
 from datetime import datetime, timedelta
 import hashlib
 import re
@@ -12,11 +12,14 @@ import html
 import json
 import os
 from pathlib import Path
-import requests
 import base64
 import time
 import threading
 
+from http_client import github_http
+from rate_limit import SlidingWindowCounter
+from board_store import create_board_storage
+
 class BoardModule:
     def __init__(self):
         # データ保存用ディレクトリとファイルパス
@@ -63,13 +66,15 @@ class BoardModule:
         
         self.data_dir.mkdir(exist_ok=True)
         
-        # データ構造
-        self.posts = []
-        self.users = {}
-        self.post_count = {}
-        self.reports = {}
-        self.banned_devices = {}
-        self.next_post_id = 1
+        # データの保存先（BOARD_BACKEND: sqlite / memory）
+        self.post_limit = (10, 3600)   # 投稿回数（1時間に10件まで）
+        self.lock = threading.RLock()  # 確認と変更をひと続きで行う処理の排他
+        self.storage = create_board_storage(self.data_dir, self.lock, self.post_limit)
+        
+        # 投稿一覧のキャッシュ（閲覧者によらない部分をJSONにしたもの）
+        self.snapshot = (None, '[]')   # (ETag, 投稿一覧のJSON)
+        self.clean_interval = 60       # 一覧取得時に古い投稿を掃除する間隔（秒）
+        self.last_clean = 0
         
         # データを読み込み
         self.load_data()
@@ -87,7 +92,7 @@ class BoardModule:
         }
         
         try:
-            response = requests.get(url, headers=headers, timeout=10)
+            response = github_http.get(url, headers=headers, timeout=10)
             if response.status_code == 200:
                 data = response.json()
                 branch = data.get('default_branch', 'main')
@@ -115,7 +120,7 @@ class BoardModule:
         params = {'ref': self.github_branch}
         
         try:
-            response = requests.get(url, headers=headers, params=params, timeout=10)
+            response = github_http.get(url, headers=headers, params=params, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -165,7 +170,7 @@ class BoardModule:
                 else:
                     print(f"[BOARD] Creating new file")
                 
-                response = requests.put(url, json=data, headers=headers, timeout=15)
+                response = github_http.put(url, json=data, headers=headers, timeout=15)
                 
                 if response.status_code in [200, 201]:
                     print(f"[BOARD] ✅ GitHub backup success: {filepath}")
@@ -249,40 +254,43 @@ class BoardModule:
             print("[BOARD] ==========================================")
             print("[BOARD] 🚀 Executing GitHub Backup")
             backup_time = datetime.now()
+            data = self.storage.export_data()
             
             # posts.json をバックアップ
             posts_content = json.dumps({
-                'posts': self.posts,
-                'next_post_id': self.next_post_id
+                'posts': data['posts'],
+                'next_post_id': data['next_post_id']
             }, ensure_ascii=False, indent=2)
             
             success = self.github_update_file(
                 'board_data/posts.json',
                 posts_content,
-                f'Auto backup: {len(self.posts)} posts at {backup_time.strftime("%Y-%m-%d %H:%M")}'
+                f'Auto backup: {len(data["posts"])} posts at {backup_time.strftime("%Y-%m-%d %H:%M")}'
             )
             
             if success:
                 # 他のファイルもバックアップ
                 self.github_update_file(
                     'board_data/users.json',
-                    json.dumps(self.users, ensure_ascii=False, indent=2),
-                    f'Auto backup: {len(self.users)} users'
+                    json.dumps(data['users'], ensure_ascii=False, indent=2),
+                    f'Auto backup: {len(data["users"])} users'
                 )
                 
                 self.github_update_file(
                     'board_data/reports.json',
-                    json.dumps({str(k): v for k, v in self.reports.items()}, ensure_ascii=False, indent=2),
-                    f'Auto backup: {len(self.reports)} reports'
+                    json.dumps({str(k): v for k, v in data['reports'].items()}, ensure_ascii=False, indent=2),
+                    f'Auto backup: {len(data["reports"])} reports'
                 )
                 
                 self.github_update_file(
                     'board_data/bans.json',
-                    json.dumps({device_id: ts.isoformat() for device_id, ts in self.banned_devices.items()}, ensure_ascii=False, indent=2),
-                    f'Auto backup: {len(self.banned_devices)} bans'
+                    json.dumps({device_id: ts.isoformat() for device_id, ts in data['bans'].items()}, ensure_ascii=False, indent=2),
+                    f'Auto backup: {len(data["bans"])} bans'
                 )
                 
                 print(f"[BOARD] ✅ Backup completed at {backup_time.strftime('%Y-%m-%d %H:%M:%S')}")
+                http_stats = github_http.get_stats()
+                print(f"[BOARD] 🔌 GitHub connections: {http_stats['new_connections']} new, {http_stats['reused_connections']} reused")
                 print("[BOARD] 🔄 Render will auto-deploy from GitHub")
                 
                 # タイマーと最初の変更時刻をリセット
@@ -300,11 +308,18 @@ class BoardModule:
             traceback.print_exc()
     
     def load_data(self):
-        """保存されたデータを読み込み（Github優先、ローカルフォールバック）"""
+        """保存されたデータを読み込み（共有ストアに既にあればそれを使う。なければGithub優先、ローカルフォールバック）"""
         try:
             print("[BOARD] ------------------------------------------")
             print("[BOARD] Loading data...")
             
+            if not self.storage.is_empty():
+                # 他のワーカー（または前回の起動）が読み込み済み
+                print(f"[BOARD] ✅ Using existing {self.storage.backend} store")
+                self.clean_old_posts()
+                return
+            
+            data = {}
             loaded_from_github = False
             
             # 起動時のみGitHubから読み込み
@@ -313,81 +328,59 @@ class BoardModule:
                 
                 sha, content = self.github_get_file('board_data/posts.json')
                 if content:
-                    data = json.loads(content)
-                    self.posts = data.get('posts', [])
-                    self.next_post_id = data.get('next_post_id', 1)
+                    posts_data = json.loads(content)
+                    data['posts'] = posts_data.get('posts', [])
+                    data['next_post_id'] = posts_data.get('next_post_id', 1)
                     loaded_from_github = True
                 
                 sha, content = self.github_get_file('board_data/users.json')
                 if content:
-                    self.users = json.loads(content)
+                    data['users'] = json.loads(content)
                 
                 sha, content = self.github_get_file('board_data/reports.json')
                 if content:
-                    data = json.loads(content)
-                    self.reports = {int(k): v for k, v in data.items()}
+                    data['reports'] = {int(k): v for k, v in json.loads(content).items()}
                 
                 sha, content = self.github_get_file('board_data/bans.json')
                 if content:
-                    data = json.loads(content)
-                    now = datetime.now()
-                    self.banned_devices = {
-                        device_id: datetime.fromisoformat(timestamp)
-                        for device_id, timestamp in data.items()
-                        if datetime.fromisoformat(timestamp) > now
-                    }
+                    data['bans'] = self._active_bans(json.loads(content))
                 
                 if loaded_from_github:
-                    print(f"[BOARD] ✅ Loaded from GitHub: {len(self.posts)} posts, {len(self.users)} users")
+                    print(f"[BOARD] ✅ Loaded from GitHub: {len(data['posts'])} posts, {len(data.get('users', {}))} users")
             
             if not loaded_from_github:
                 print("[BOARD] 📁 Loading from local files...")
                 
                 if self.posts_file.exists():
                     with open(self.posts_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        self.posts = data.get('posts', [])
-                        self.next_post_id = data.get('next_post_id', 1)
+                        posts_data = json.load(f)
+                        data['posts'] = posts_data.get('posts', [])
+                        data['next_post_id'] = posts_data.get('next_post_id', 1)
                 
                 if self.users_file.exists():
                     with open(self.users_file, 'r', encoding='utf-8') as f:
-                        self.users = json.load(f)
+                        data['users'] = json.load(f)
                 
                 if self.reports_file.exists():
                     with open(self.reports_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        self.reports = {int(k): v for k, v in data.items()}
+                        data['reports'] = {int(k): v for k, v in json.load(f).items()}
                 
                 if self.bans_file.exists():
                     with open(self.bans_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        now = datetime.now()
-                        self.banned_devices = {
-                            device_id: datetime.fromisoformat(timestamp)
-                            for device_id, timestamp in data.items()
-                            if datetime.fromisoformat(timestamp) > now
-                        }
+                        data['bans'] = self._active_bans(json.load(f))
                 
                 if self.rate_limit_file.exists():
                     with open(self.rate_limit_file, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        now = datetime.now()
-                        one_hour_ago = now - timedelta(hours=1)
-                        self.post_count = {}
-                        for device_id, timestamps in data.items():
-                            recent = [
-                                datetime.fromisoformat(ts)
-                                for ts in timestamps
-                                if datetime.fromisoformat(ts) > one_hour_ago
-                            ]
-                            if recent:
-                                self.post_count[device_id] = recent
+                        data['rate_limits'] = self._post_limit_windows(json.load(f))
                 
-                print(f"[BOARD] ✅ Loaded from local: {len(self.posts)} posts, {len(self.users)} users")
+                print(f"[BOARD] ✅ Loaded from local: {len(data.get('posts', []))} posts, {len(data.get('users', {}))} users")
+            
+            if not self.storage.import_data(data):
+                print("[BOARD] ℹ️ Store was filled by another worker, using it")
             
             self.clean_old_posts()
             
-            print(f"[BOARD] 📊 Final state: {len(self.posts)} posts, {len(self.users)} users, {len(self.banned_devices)} active bans")
+            print(f"[BOARD] 📊 Final state: {len(self.storage.list_posts())} posts, {len(data.get('users', {}))} users, {self.storage.count_bans()} active bans")
             print("[BOARD] ------------------------------------------")
             
         except Exception as e:
@@ -395,28 +388,31 @@ class BoardModule:
             import traceback
             traceback.print_exc()
     
-    def save_data(self):
-        """データをローカルに保存"""
-        try:
-            with open(self.posts_file, 'w', encoding='utf-8') as f:
-                json.dump({'posts': self.posts, 'next_post_id': self.next_post_id}, f, ensure_ascii=False, indent=2)
-            
-            with open(self.users_file, 'w', encoding='utf-8') as f:
-                json.dump(self.users, f, ensure_ascii=False, indent=2)
-            
-            with open(self.reports_file, 'w', encoding='utf-8') as f:
-                json.dump({str(k): v for k, v in self.reports.items()}, f, ensure_ascii=False, indent=2)
-            
-            with open(self.bans_file, 'w', encoding='utf-8') as f:
-                json.dump({device_id: timestamp.isoformat() for device_id, timestamp in self.banned_devices.items()}, f, ensure_ascii=False, indent=2)
-            
-            with open(self.rate_limit_file, 'w', encoding='utf-8') as f:
-                json.dump({device_id: [ts.isoformat() for ts in timestamps] for device_id, timestamps in self.post_count.items()}, f, ensure_ascii=False, indent=2)
-            
-        except Exception as e:
-            print(f"[BOARD] ❌ Error saving data: {e}")
-            import traceback
-            traceback.print_exc()
+    def _active_bans(self, data):
+        """{device_id: ISO形式} から期限内のBANだけを取り出す"""
+        now = datetime.now()
+        return {
+            device_id: datetime.fromisoformat(timestamp)
+            for device_id, timestamp in data.items()
+            if datetime.fromisoformat(timestamp) > now
+        }
+    
+    def _post_limit_windows(self, data):
+        """rate_limits.json の内容を投稿回数の状態に変換"""
+        counter = SlidingWindowCounter(*self.post_limit)
+        one_hour_ago = datetime.now() - timedelta(hours=1)
+        windows = {}
+        for device_id, state in data.items():
+            if state and isinstance(state[0], str):
+                # 旧形式（投稿時刻のリスト）
+                for ts in state:
+                    posted_at = datetime.fromisoformat(ts)
+                    if posted_at > one_hour_ago:
+                        counter.record(device_id, posted_at.timestamp())
+            else:
+                windows[device_id] = state
+        counter.load_state(windows)
+        return counter.export_state()
 
     def sanitize_text(self, text):
         """XSS対策：HTMLエスケープ処理"""
@@ -424,32 +420,20 @@ class BoardModule:
     
     def is_banned(self, device_id):
         """BANチェック"""
-        if device_id in self.banned_devices:
-            ban_until = self.banned_devices[device_id]
+        ban_until = self.storage.get_ban(device_id)
+        if ban_until is not None:
             if datetime.now() < ban_until:
                 remaining = (ban_until - datetime.now()).total_seconds()
                 return True, remaining
             else:
-                del self.banned_devices[device_id]
-                self.save_data()
+                self.storage.delete_ban(device_id)
         return False, 0
-    
+        
     def check_rate_limit(self, device_id):
         """投稿回数制限チェック（1時間に10件まで）"""
-        now = datetime.now()
-        one_hour_ago = now - timedelta(hours=1)
-        
-        if device_id in self.post_count:
-            self.post_count[device_id] = [
-                timestamp for timestamp in self.post_count[device_id]
-                if timestamp > one_hour_ago
-            ]
-        else:
-            self.post_count[device_id] = []
+        allowed, remaining, _ = self.storage.check_post_limit(device_id)
         
-        if len(self.post_count[device_id]) >= 10:
-            oldest = min(self.post_count[device_id])
-            remaining = (oldest + timedelta(hours=1) - now).total_seconds()
+        if not allowed:
             return False, f"1時間に10件までしか投稿できません。残り待機時間: {int(remaining//60)}分{int(remaining%60)}秒"
         
         return True, ""
@@ -475,174 +459,192 @@ class BoardModule:
         """古い投稿を削除（3日経過または100件超過）"""
         three_days_ago = datetime.now() - timedelta(days=3)
         
-        old_count = len(self.posts)
-        self.posts = [
-            post for post in self.posts
-            if datetime.fromisoformat(post['timestamp']) > three_days_ago
-        ]
-        
-        if len(self.posts) > 100:
-            self.posts = sorted(self.posts, key=lambda x: x['timestamp'], reverse=True)[:100]
-        
-        if len(self.posts) < old_count:
-            cleaned = old_count - len(self.posts)
+        cleaned = self.storage.prune_posts(three_days_ago.isoformat(), 100)
+        if cleaned:
             print(f"[BOARD] 🧹 Cleaned {cleaned} old posts")
+        
+        # 1時間以上投稿のないデバイスの回数記録も捨てる
+        self.storage.purge_post_limits()
     
     def register_username(self, username, device_id):
         """ユーザー名登録"""
-        if device_id in self.users:
-            return False, "既に名前が登録されています。"
-        
-        username = username.strip()
-        
-        if not username or len(username) == 0:
-            return False, "名前を入力してください。"
-        
-        if len(username) > 20:
-            return False, "名前は20文字以内にしてください。"
-        
-        if re.search(r'[<>\"\'`]', username):
-            return False, "使用できない文字が含まれています。"
-        
-        if username in self.users.values():
-            return False, "その名前は既に使用されています。"
-        
-        safe_username = self.sanitize_text(username)
-        self.users[device_id] = safe_username
-        
-        self.save_data()
-        self.schedule_backup()
+        with self.lock:
+            if self.storage.get_username(device_id):
+                return False, "既に名前が登録されています。"
+            
+            username = username.strip()
+            
+            if not username or len(username) == 0:
+                return False, "名前を入力してください。"
+            
+            if len(username) > 20:
+                return False, "名前は20文字以内にしてください。"
+            
+            if re.search(r'[<>\"\'`]', username):
+                return False, "使用できない文字が含まれています。"
+            
+            if self.storage.username_taken(username):
+                return False, "その名前は既に使用されています。"
+            
+            safe_username = self.sanitize_text(username)
+            if not self.storage.add_user(device_id, safe_username):
+                # 他のワーカーで同時に登録された
+                return False, "その名前は既に使用されています。"
+            
+            self.schedule_backup()
+            
+            print(f"[BOARD] 👤 New user registered: {safe_username} (device: {device_id[:16]}...)")
+            return True, "名前を登録しました。"
         
-        print(f"[BOARD] 👤 New user registered: {safe_username} (device: {device_id[:16]}...)")
-        return True, "名前を登録しました。"
-    
     def get_username(self, device_id):
         """ユーザー名取得"""
-        return self.users.get(device_id, None)
+        return self.storage.get_username(device_id)
     
     def create_post(self, content, device_id, parent_id=None):
         """投稿作成"""
-        is_banned, remaining = self.is_banned(device_id)
-        if is_banned:
-            hours = int(remaining // 3600)
-            minutes = int((remaining % 3600) // 60)
-            return False, f"通報により{hours}時間{minutes}分間投稿が制限されています。"
-        
-        allowed, message = self.check_rate_limit(device_id)
-        if not allowed:
-            return False, message
-        
-        content = content.strip()
-        
-        if not content or len(content) == 0:
-            return False, "投稿内容を入力してください。"
-        
-        if len(content) > 300:
-            return False, "投稿は300文字以内にしてください。"
-        
-        if parent_id:
-            parent_exists = any(post['id'] == parent_id for post in self.posts)
-            if not parent_exists:
-                return False, "返信先の投稿が見つかりません。"
-            
-            username = self.get_username(device_id)
-            if not username:
-                return False, "返信するには名前を登録してください。"
-        
-        is_suspicious = self.contains_suspicious_link(content)
-        safe_content = self.sanitize_text(content)
-        
-        post = {
-            'id': self.next_post_id,
-            'content': safe_content,
-            'username': self.get_username(device_id) or "名無しさん",
-            'device_id': device_id,
-            'timestamp': datetime.now().isoformat(),
-            'parent_id': parent_id,
-            'is_suspicious': is_suspicious,
-            'is_hidden': False,
-            'report_count': 0
-        }
-        
-        self.posts.append(post)
-        self.next_post_id += 1
-        
-        # post_count初期化を確実に
-        if device_id not in self.post_count:
-            self.post_count[device_id] = []
-        self.post_count[device_id].append(datetime.now())
-        
-        self.clean_old_posts()
-        self.save_data()
-        self.schedule_backup()
-        
-        print(f"[BOARD] 📝 New post: ID={post['id']}, User={post['username']}, Device={device_id[:16]}..., Suspicious={is_suspicious}")
+        with self.lock:
+            is_banned, remaining = self.is_banned(device_id)
+            if is_banned:
+                hours = int(remaining // 3600)
+                minutes = int((remaining % 3600) // 60)
+                return False, f"通報により{hours}時間{minutes}分間投稿が制限されています。"
+            
+            allowed, message = self.check_rate_limit(device_id)
+            if not allowed:
+                return False, message
+            
+            content = content.strip()
+            
+            if not content or len(content) == 0:
+                return False, "投稿内容を入力してください。"
+            
+            if len(content) > 300:
+                return False, "投稿は300文字以内にしてください。"
+            
+            if parent_id:
+                if self.storage.get_post(parent_id) is None:
+                    return False, "返信先の投稿が見つかりません。"
+                
+                username = self.get_username(device_id)
+                if not username:
+                    return False, "返信するには名前を登録してください。"
+            
+            is_suspicious = self.contains_suspicious_link(content)
+            safe_content = self.sanitize_text(content)
+            
+            post = {
+                'content': safe_content,
+                'username': self.get_username(device_id) or "名無しさん",
+                'device_id': device_id,
+                'timestamp': datetime.now().isoformat(),
+                'parent_id': parent_id,
+                'is_suspicious': is_suspicious,
+                'is_hidden': False,
+                'report_count': 0
+            }
+            
+            post = self.storage.add_post(post)
+            self.storage.record_post(device_id)
+            
+            self.clean_old_posts()
+            self.schedule_backup()
+            
+            print(f"[BOARD] 📝 New post: ID={post['id']}, User={post['username']}, Device={device_id[:16]}..., Suspicious={is_suspicious}")
+            
+            return True, post
         
-        return True, post
-    
     def report_post(self, post_id, reporter_device_id):
         """投稿を通報"""
-        post = next((p for p in self.posts if p['id'] == post_id), None)
-        if not post:
-            return False, "投稿が見つかりません。"
-        
-        if post['device_id'] == reporter_device_id:
-            return False, "自分の投稿は通報できません。"
-        
-        if post_id not in self.reports:
-            self.reports[post_id] = []
-        
-        if reporter_device_id in self.reports[post_id]:
-            return False, "既に通報済みです。"
-        
-        self.reports[post_id].append(reporter_device_id)
-        post['report_count'] = len(self.reports[post_id])
-        
-        if post['report_count'] >= 3:
-            post['is_hidden'] = True
-            print(f"[BOARD] 🚫 Post {post_id} hidden (reports: {post['report_count']})")
-        
-        author_device_id = post['device_id']
-        author_reported_posts = [
-            pid for pid, reporters in self.reports.items()
-            if len(reporters) >= 2 and any(p['id'] == pid and p['device_id'] == author_device_id for p in self.posts)
-        ]
-        
-        if len(author_reported_posts) >= 1:
-            self.banned_devices[author_device_id] = datetime.now() + timedelta(hours=24)
-            print(f"[BOARD] ⛔ User banned (24h): {author_device_id[:16]}...")
-        
-        self.save_data()
-        self.schedule_backup()
-        
-        return True, f"通報しました。"
-    
-    def get_posts(self, device_id):
-        """投稿一覧取得"""
-        self.clean_old_posts()
-        
-        filtered_posts = []
-        for post in self.posts:
-            post_data = post.copy()
+        with self.lock:
+            post = self.storage.get_post(post_id)
+            if not post:
+                return False, "投稿が見つかりません。"
+            
+            if post['device_id'] == reporter_device_id:
+                return False, "自分の投稿は通報できません。"
             
-            if post_data['is_hidden']:
-                post_data['content_hidden'] = True
-                post_data['original_content'] = post_data['content']
-                post_data['content'] = "この投稿は多数の報告によって非表示になっています"
-            elif post_data['is_suspicious']:
-                post_data['content_hidden'] = True
-                post_data['original_content'] = post_data['content']
-                post_data['content'] = "この投稿にはリンクが含まれる可能性があります"
+            report_count = self.storage.add_report(post_id, reporter_device_id, hide_at=3)
+            if report_count is None:
+                return False, "既に通報済みです。"
             
-            post_data['is_own'] = post_data['device_id'] == device_id
-            del post_data['device_id']
-            del post_data['report_count']
+            if report_count >= 3:
+                print(f"[BOARD] 🚫 Post {post_id} hidden (reports: {report_count})")
             
-            filtered_posts.append(post_data)
+            author_device_id = post['device_id']
+            if self.storage.count_reported_posts(author_device_id, 2) >= 1:
+                self.storage.set_ban(author_device_id, datetime.now() + timedelta(hours=24))
+                print(f"[BOARD] ⛔ User banned (24h): {author_device_id[:16]}...")
+            
+            self.schedule_backup()
+            
+            return True, f"通報しました。"
+        
+    def posts_etag(self):
+        """投稿一覧の ETag（投稿一覧が変わるたびに変わる）"""
+        if time.time() - self.last_clean > self.clean_interval:
+            self.last_clean = time.time()
+            self.clean_old_posts()
+        epoch, version = self.storage.get_version()
+        return f"{epoch}-{version}"
+    
+    def _public_post(self, post_data):
+        """閲覧者に返す形にする（非表示の内容を差し替え、デバイスIDと通報数を除く）"""
+        if post_data['is_hidden']:
+            post_data['content_hidden'] = True
+            post_data['original_content'] = post_data['content']
+            post_data['content'] = "この投稿は多数の報告によって非表示になっています"
+        elif post_data['is_suspicious']:
+            post_data['content_hidden'] = True
+            post_data['original_content'] = post_data['content']
+            post_data['content'] = "この投稿にはリンクが含まれる可能性があります"
+        
+        del post_data['device_id']
+        del post_data['report_count']
+        
+        return post_data
+    
+    def _build_snapshot(self, etag):
+        """閲覧者によらない投稿一覧を作ってJSONにする"""
+        filtered_posts = [self._public_post(post_data) for post_data in self.storage.list_posts()]
         
         filtered_posts.sort(key=lambda x: x['timestamp'], reverse=True)
         
-        return filtered_posts
+        return etag, json.dumps(filtered_posts, ensure_ascii=False, separators=(',', ':'))
+    
+    def get_posts(self, device_id):
+        """投稿一覧取得
+
+        Returns:
+            (ETag, 投稿一覧のJSON, 自分の投稿IDのリスト)
+            投稿一覧のJSONは変更があったときだけ作り直す（自分の投稿かどうかは ID のリストで返す）
+        """
+        etag = self.posts_etag()
+        snapshot = self.snapshot
+        if snapshot[0] != etag:
+            # ETag を先に取ってから一覧を読むので、途中で変更があっても次回作り直される
+            snapshot = self._build_snapshot(etag)
+            self.snapshot = snapshot
+        
+        return snapshot[0], snapshot[1], self.storage.own_post_ids(device_id)
+    
+    def get_changes(self, device_id, since):
+        """前回取得した位置（ETag と同じ "epoch-version"）からの差分
+
+        Returns:
+            (新しい位置, 追加・更新された投稿, 削除された投稿ID, 自分の投稿IDのリスト)
+            保存先が作り直された・履歴が残っていないなど差分を作れないときは None（全件を取り直す）
+        """
+        etag = self.posts_etag()
+        epoch, _, version = str(since).rpartition('-')
+        if epoch != etag.rpartition('-')[0] or not version.isdigit():
+            return None
+        
+        changes = self.storage.changes_since(int(version))
+        if changes is None:
+            return None
+        
+        changed, deleted = changes
+        return etag, [self._public_post(post_data) for post_data in changed], deleted, self.storage.own_post_ids(device_id)
 
 # ==========================================
 # グローバルインスタンスの初期化
@@ -716,20 +718,49 @@ def board_create_post():
         }), 400
 
 def board_get_posts():
-    """投稿一覧取得API"""
+    """投稿一覧取得API
+
+    since（前回の cursor）を送ると、それ以降に追加・更新された投稿と削除された投稿IDだけを返す（delta: true）。
+    差分を作れないときは全件を返す（delta: false）。
+    """
     data = request.get_json()
     device_id = data.get('device_id')
+    since = data.get('since')
     
     if not device_id:
         return jsonify({
             'posts': []
         })
     
-    posts = board.get_posts(device_id)
+    # 前回から変わっていなければ一覧を作らずに 304 を返す
+    etag = board.posts_etag()
+    if since == etag or request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
     
-    return jsonify({
-        'posts': posts
-    })
+    changes = board.get_changes(device_id, since) if since else None
+    if changes is not None:
+        cursor, posts, deleted_ids, own_post_ids = changes
+        response = jsonify({
+            'posts': posts,
+            'deleted_ids': deleted_ids,
+            'own_post_ids': own_post_ids,
+            'cursor': cursor,
+            'delta': True
+        })
+        response.set_etag(cursor)
+        return response
+    
+    etag, posts_json, own_post_ids = board.get_posts(device_id)
+    
+    response = Response(
+        f'{{"posts":{posts_json},"own_post_ids":{json.dumps(own_post_ids)},'
+        f'"cursor":{json.dumps(etag)},"delta":false}}',
+        mimetype='application/json'
+    )
+    response.set_etag(etag)
+    return response
 
 def board_report_post():
     """通報API"""
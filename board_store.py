@@ -0,0 +1,734 @@
+"""
+掲示板データの保存先
+- memory: プロセス内に保持し、JSONファイルへ遅延書き込み（ワーカー1つ向け）
+- sqlite: SQLite（WALモード）に保存し、gunicorn の全ワーカーで同じデータを参照する
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+from rate_limit import SlidingWindowCounter
+
+POST_FIELDS = ('id', 'content', 'username', 'device_id', 'timestamp', 'parent_id',
+               'is_suspicious', 'is_hidden', 'report_count')
+
+
+class WriteBehindWriter:
+    """変更のあったデータを遅延書き込みする
+
+    collections は {名前: (ファイルパス, 保存する内容を返す関数)}。
+    mark_dirty() された名前を覚えておき、flush_delay 秒の間に続いた変更はまとめて1回で書く。
+    変更が続いても最初の変更から max_delay 秒以内には必ず書き出す（失われうるのはこの間の変更だけ）。
+    書き込みは一時ファイルに書いてから置き換えるので、途中で落ちても前回の内容が残る。
+    """
+    def __init__(self, collections, lock, flush_delay=1.0, max_delay=5.0):
+        self.collections = collections
+        self.data_lock = lock               # 保存する内容を取り出す間、データの変更を止めるロック
+        self.flush_delay = flush_delay      # 最後の変更からこの秒数待ってから書く
+        self.max_delay = max_delay          # 最初の変更からこの秒数以内には書く
+        self.dirty = set()
+        self.first_dirty_at = None
+        self.last_dirty_at = None
+        self.marks = 0
+        self.commits = 0
+        self.writes = {name: 0 for name in collections}
+        self.failures = 0
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+        print(f"[BOARD STORE] Write-behind: delay={self.flush_delay}s, max delay={self.max_delay}s")
+
+    def mark_dirty(self, *names):
+        """保存が必要なデータを登録（すぐに戻る）"""
+        now = time.monotonic()
+        with self.condition:
+            self.dirty.update(names or self.collections)
+            self.marks += 1
+            if self.first_dirty_at is None:
+                self.first_dirty_at = now
+            self.last_dirty_at = now
+            self.condition.notify()
+
+    def _due_in(self, now):
+        """書き出しまでの秒数（0 以下なら今すぐ）"""
+        return min(self.last_dirty_at + self.flush_delay, self.first_dirty_at + self.max_delay) - now
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    if not self.dirty:
+                        # 空になった（flush() が直接呼ばれた場合も含む）
+                        self.condition.wait()
+                        continue
+                    wait = self._due_in(time.monotonic())
+                    if wait <= 0:
+                        break
+                    self.condition.wait(wait)
+            self.flush()
+
+    def flush(self):
+        """変更のあったデータを今すぐ書き出す"""
+        with self.flush_lock:
+            with self.condition:
+                names = self.dirty
+                self.dirty = set()
+                self.first_dirty_at = None
+                self.last_dirty_at = None
+            if not names:
+                return
+
+            # 内容の取り出しだけロック中に行い、ファイルへの書き込みはロックの外で行う
+            with self.data_lock:
+                contents = {
+                    name: json.dumps(self.collections[name][1](), ensure_ascii=False, separators=(',', ':'))
+                    for name in names
+                }
+
+            failed = []
+            for name, content in contents.items():
+                path = self.collections[name][0]
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                try:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.write(content)
+                    os.replace(tmp_path, path)
+                    self.writes[name] += 1
+                except Exception as e:
+                    failed.append(name)
+                    print(f"[BOARD STORE] ❌ Error saving {path}: {e}")
+
+            with self.condition:
+                self.commits += 1
+                if failed:
+                    # 次の書き出しで再試行
+                    self.failures += 1
+                    self.dirty.update(failed)
+                    now = time.monotonic()
+                    self.first_dirty_at = self.first_dirty_at or now
+                    self.last_dirty_at = now
+                    self.condition.notify()
+
+    def get_stats(self):
+        with self.condition:
+            return {
+                "pending": sorted(self.dirty),
+                "marks": self.marks,
+                "commits": self.commits,
+                "writes": dict(self.writes),
+                "failures": self.failures
+            }
+
+
+# ==========================================
+# 保存先の共通形式
+# ==========================================
+# import_data / export_data で受け渡すデータ:
+#   {
+#       'posts': 投稿のリスト, 'next_post_id': 次の投稿ID,
+#       'users': {device_id: 名前}, 'reports': {投稿ID: [通報者の device_id, ...]},
+#       'bans': {device_id: 解除日時（datetime）}, 'rate_limits': SlidingWindowCounter.export_state() の形式
+#   }
+#
+# 投稿一覧が変わる操作（投稿・削除・通報による更新）のたびに version が1つ増える。
+# epoch は保存先を作り直したときに変わる値で、(epoch, version) が同じなら投稿一覧も同じ。
+# changes_since(version) はそれ以降に追加・更新された投稿と削除された投稿IDを返す
+# （変更履歴は直近 CHANGE_LOG_SIZE 件分だけ持ち、それより古い version からは None = 全件取り直し）。
+
+CHANGE_LOG_SIZE = 1000
+
+class MemoryBoardStorage:
+    """プロセス内に保持し、変更のあったファイルだけを裏で書き出す
+
+    投稿は古い順の OrderedDict（ID → 投稿）で持ち、ID での検索と古い投稿の削除を O(1) で行う。
+    あわせて次の索引を更新し続ける:
+        posts_by_device  投稿者 → 投稿IDの集合
+        user_by_name     名前 → device_id
+        report_tally     投稿者 → {通報数: その通報数の投稿の数}
+    """
+    backend = 'memory'
+
+    def __init__(self, data_dir, lock, post_limit):
+        self.data_dir = data_dir
+        self.lock = lock              # 掲示板全体のロック（BoardModule と共有）
+        self.posts = OrderedDict()    # 投稿ID → 投稿（古い順）
+        self.users = {}
+        self.reports = {}
+        self.banned_devices = {}
+        self.next_post_id = 1
+        self.post_limit = SlidingWindowCounter(*post_limit)
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.change_log = OrderedDict()   # 投稿ID → (変更時の version, 削除されたか)（変更の古い順）
+        self.log_floor = 0                # これより後の変更はすべて change_log にある
+        self._reset_indexes()
+
+        self.writer = WriteBehindWriter({
+            'posts': (data_dir / 'posts.json', lambda: {'posts': list(self.posts.values()), 'next_post_id': self.next_post_id}),
+            'users': (data_dir / 'users.json', lambda: self.users),
+            'reports': (data_dir / 'reports.json', lambda: {str(k): v for k, v in self.reports.items()}),
+            'bans': (data_dir / 'bans.json', lambda: {device_id: ts.isoformat() for device_id, ts in self.banned_devices.items()}),
+            'rate_limits': (data_dir / 'rate_limits.json', self.post_limit.export_state)
+        }, lock)
+
+    def _reset_indexes(self):
+        self.posts_by_device = {}
+        self.user_by_name = {username: device_id for device_id, username in self.users.items()}
+        self.report_tally = {}
+        for post in self.posts.values():
+            self._index_post(post)
+
+    def _index_post(self, post):
+        self.posts_by_device.setdefault(post['device_id'], set()).add(post['id'])
+        self._tally(post['device_id'], len(self.reports.get(post['id'], ())), 1)
+
+    def _unindex_post(self, post):
+        device_posts = self.posts_by_device[post['device_id']]
+        device_posts.discard(post['id'])
+        if not device_posts:
+            del self.posts_by_device[post['device_id']]
+        self._tally(post['device_id'], len(self.reports.pop(post['id'], ())), -1)
+
+    def _tally(self, device_id, report_count, delta):
+        """投稿者ごとの「通報数 → 投稿数」を増減（通報なしの投稿は数えない）"""
+        if report_count == 0:
+            return
+        tally = self.report_tally.setdefault(device_id, {})
+        tally[report_count] = tally.get(report_count, 0) + delta
+        if tally[report_count] == 0:
+            del tally[report_count]
+            if not tally:
+                del self.report_tally[device_id]
+
+    def _log_change(self, post_id, deleted=False):
+        self.change_log.pop(post_id, None)
+        self.change_log[post_id] = (self.version, deleted)
+        while len(self.change_log) > CHANGE_LOG_SIZE:
+            _, (version, _) = self.change_log.popitem(last=False)
+            self.log_floor = version
+
+    def is_empty(self):
+        with self.lock:
+            return not self.posts and not self.users
+
+    def import_data(self, data):
+        with self.lock:
+            posts = sorted(data.get('posts', []), key=lambda post: post['timestamp'])
+            self.posts = OrderedDict((post['id'], post) for post in posts)
+            self.next_post_id = data.get('next_post_id', 1)
+            self.users = data.get('users', {})
+            self.reports = data.get('reports', {})
+            self.banned_devices = data.get('bans', {})
+            self.post_limit.load_state(data.get('rate_limits', {}))
+            self._reset_indexes()
+            self.version += 1
+            self.change_log.clear()
+            self.log_floor = self.version
+        return True
+
+    def export_data(self):
+        with self.lock:
+            return {
+                'posts': [dict(post) for post in self.posts.values()],
+                'next_post_id': self.next_post_id,
+                'users': dict(self.users),
+                'reports': {post_id: list(reporters) for post_id, reporters in self.reports.items()},
+                'bans': dict(self.banned_devices)
+            }
+
+    # ---------- 投稿 ----------
+    def get_version(self):
+        return self.epoch, self.version
+
+    def list_posts(self):
+        with self.lock:
+            return [dict(post) for post in self.posts.values()]
+
+    def own_post_ids(self, device_id):
+        with self.lock:
+            return sorted(self.posts_by_device.get(device_id, ()))
+
+    def changes_since(self, version):
+        """version より後の変更 (追加・更新された投稿, 削除された投稿ID)。履歴が足りなければ None"""
+        with self.lock:
+            if version < self.log_floor:
+                return None
+            changed, deleted = [], []
+            for post_id, (changed_at, is_deleted) in reversed(self.change_log.items()):
+                if changed_at <= version:
+                    break
+                if is_deleted:
+                    deleted.append(post_id)
+                else:
+                    changed.append(dict(self.posts[post_id]))
+            return changed, deleted
+
+    def get_post(self, post_id):
+        with self.lock:
+            post = self.posts.get(post_id)
+            return dict(post) if post else None
+
+    def add_post(self, post):
+        """ID を割り当てて保存し、保存した投稿を返す"""
+        with self.lock:
+            post = {'id': self.next_post_id, **post}
+            self.posts[post['id']] = post
+            self.next_post_id += 1
+            self._index_post(post)
+            self.version += 1
+            self._log_change(post['id'])
+            self.writer.mark_dirty('posts')
+            return dict(post)
+
+    def prune_posts(self, cutoff, max_posts):
+        """cutoff（ISO形式）より古い投稿と、新しい順で max_posts 件を超えた投稿を削除
+
+        投稿は古い順に並んでいるので、先頭から消す分だけを見る。
+        """
+        with self.lock:
+            removed = []
+            while self.posts:
+                oldest = next(iter(self.posts.values()))
+                if oldest['timestamp'] > cutoff and len(self.posts) <= max_posts:
+                    break
+                self.posts.popitem(last=False)
+                self._unindex_post(oldest)
+                removed.append(oldest['id'])
+            if removed:
+                self.version += 1
+                for post_id in removed:
+                    self._log_change(post_id, deleted=True)
+                self.writer.mark_dirty('posts', 'reports')
+            return len(removed)
+
+    # ---------- ユーザー ----------
+    def get_username(self, device_id):
+        with self.lock:
+            return self.users.get(device_id)
+
+    def add_user(self, device_id, username):
+        """名前を登録（同じデバイス・同じ名前が既にあれば False）"""
+        with self.lock:
+            if device_id in self.users or username in self.user_by_name:
+                return False
+            self.users[device_id] = username
+            self.user_by_name[username] = device_id
+            self.writer.mark_dirty('users')
+            return True
+
+    def username_taken(self, username):
+        with self.lock:
+            return username in self.user_by_name
+
+    # ---------- 通報・BAN ----------
+    def add_report(self, post_id, reporter_device_id, hide_at):
+        """通報を記録して投稿の通報数を返す（通報済みなら None）
+
+        投稿の通報数も同時に更新し、hide_at 件以上になったら非表示にする。
+        """
+        with self.lock:
+            reporters = self.reports.setdefault(post_id, [])
+            if reporter_device_id in reporters:
+                return None
+            post = self.posts.get(post_id)
+            if post:
+                self._tally(post['device_id'], len(reporters), -1)
+                self._tally(post['device_id'], len(reporters) + 1, 1)
+            reporters.append(reporter_device_id)
+            if post:
+                post['report_count'] = len(reporters)
+                post['is_hidden'] = post['is_hidden'] or len(reporters) >= hide_at
+                self.version += 1
+                self._log_change(post_id)
+                self.writer.mark_dirty('posts')
+            self.writer.mark_dirty('reports')
+            return len(reporters)
+
+    def count_reported_posts(self, device_id, min_reports):
+        """device_id の投稿のうち min_reports 件以上通報されたものの数"""
+        with self.lock:
+            tally = self.report_tally.get(device_id, {})
+            return sum(count for report_count, count in tally.items() if report_count >= min_reports)
+
+    def get_ban(self, device_id):
+        with self.lock:
+            return self.banned_devices.get(device_id)
+
+    def set_ban(self, device_id, until):
+        with self.lock:
+            self.banned_devices[device_id] = until
+            self.writer.mark_dirty('bans')
+
+    def delete_ban(self, device_id):
+        with self.lock:
+            if self.banned_devices.pop(device_id, None) is not None:
+                self.writer.mark_dirty('bans')
+
+    def count_bans(self):
+        with self.lock:
+            return len(self.banned_devices)
+
+    # ---------- 投稿回数 ----------
+    def check_post_limit(self, device_id):
+        return self.post_limit.check(device_id)
+
+    def record_post(self, device_id):
+        self.post_limit.record(device_id)
+        self.writer.mark_dirty('rate_limits')
+
+    def purge_post_limits(self):
+        if self.post_limit.purge():
+            self.writer.mark_dirty('rate_limits')
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "backend": self.backend,
+                "posts": len(self.posts),
+                "users": len(self.users),
+                "authors": len(self.posts_by_device),
+                "writer": self.writer.get_stats()
+            }
+
+
+class SQLiteBoardStorage:
+    """SQLite（WALモード）に保存し、全ワーカーで共有する"""
+    backend = 'sqlite'
+
+    def __init__(self, db_path, post_limit):
+        self.db_path = str(db_path)
+        self.post_limit = SlidingWindowCounter(*post_limit)  # 判定の計算にだけ使う（状態は post_limits テーブル）
+        self.local = threading.local()
+
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS posts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    content TEXT NOT NULL,
+                    username TEXT NOT NULL,
+                    device_id TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    parent_id INTEGER,
+                    is_suspicious INTEGER NOT NULL,
+                    is_hidden INTEGER NOT NULL,
+                    report_count INTEGER NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(posts)")]
+            if 'version' not in columns:
+                conn.execute("ALTER TABLE posts ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_version ON posts (version)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS deleted_posts (
+                    id INTEGER PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_deleted_posts_version ON deleted_posts (version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_timestamp ON posts (timestamp)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_device ON posts (device_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_posts_parent ON posts (parent_id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    device_id TEXT PRIMARY KEY,
+                    username TEXT UNIQUE NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    post_id INTEGER NOT NULL,
+                    reporter TEXT NOT NULL,
+                    PRIMARY KEY (post_id, reporter)
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS bans (
+                    device_id TEXT PRIMARY KEY,
+                    until TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS post_limits (
+                    device_id TEXT PRIMARY KEY,
+                    window INTEGER NOT NULL,
+                    previous REAL NOT NULL,
+                    current REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_post_limits_window ON post_limits (window)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS board_meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+            conn.execute("INSERT OR IGNORE INTO board_meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex[:8],))
+            conn.execute("INSERT OR IGNORE INTO board_meta (key, value) VALUES ('version', '0')")
+            # 変更履歴を持つ前から使っている保存先では、今の version より前の差分は作れない
+            conn.execute("INSERT OR IGNORE INTO board_meta (key, value) SELECT 'log_floor', value FROM board_meta WHERE key = 'version'")
+            self.epoch = conn.execute("SELECT value FROM board_meta WHERE key = 'epoch'").fetchone()[0]
+
+        print(f"[BOARD STORE] 🗄️ Shared store: {self.db_path} (pid: {os.getpid()})")
+
+    def _connect(self):
+        """スレッドごとの接続を取得"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """書き込みトランザクション（BEGIN IMMEDIATE で排他）"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _row_to_post(self, row):
+        post = dict(row)
+        del post['version']
+        post['is_suspicious'] = bool(post['is_suspicious'])
+        post['is_hidden'] = bool(post['is_hidden'])
+        return post
+
+    def _meta(self, conn, key):
+        return int(conn.execute("SELECT value FROM board_meta WHERE key = ?", (key,)).fetchone()[0])
+
+    def _bump_version(self, conn):
+        """version を1つ進めて新しい値を返す"""
+        conn.execute("UPDATE board_meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'version'")
+        return self._meta(conn, 'version')
+
+    def _is_empty(self, conn):
+        return (conn.execute("SELECT COUNT(*) FROM posts").fetchone()[0] == 0
+                and conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0)
+
+    def is_empty(self):
+        return self._is_empty(self._connect())
+
+    def import_data(self, data):
+        """空のデータベースにだけ読み込む（他のワーカーが先に読み込んでいれば何もしない）"""
+        with self._transaction() as conn:
+            if not self._is_empty(conn):
+                return False
+            conn.executemany(
+                f"INSERT INTO posts ({', '.join(POST_FIELDS)}) VALUES ({', '.join('?' * len(POST_FIELDS))})",
+                [tuple(post.get(field) for field in POST_FIELDS) for post in data.get('posts', [])]
+            )
+            # 次の投稿IDを引き継ぐ（削除済みのIDを再利用しない）
+            next_post_id = data.get('next_post_id', 1)
+            conn.execute("DELETE FROM sqlite_sequence WHERE name = 'posts'")
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('posts', ?)", (next_post_id - 1,))
+            conn.executemany("INSERT OR IGNORE INTO users (device_id, username) VALUES (?, ?)",
+                             list(data.get('users', {}).items()))
+            conn.executemany("INSERT OR IGNORE INTO reports (post_id, reporter) VALUES (?, ?)",
+                             [(post_id, reporter) for post_id, reporters in data.get('reports', {}).items()
+                              for reporter in reporters])
+            conn.executemany("INSERT INTO bans (device_id, until) VALUES (?, ?)",
+                             [(device_id, until.isoformat()) for device_id, until in data.get('bans', {}).items()])
+            conn.executemany("INSERT INTO post_limits (device_id, window, previous, current) VALUES (?, ?, ?, ?)",
+                             [(device_id, *state) for device_id, state in data.get('rate_limits', {}).items()])
+            version = self._bump_version(conn)
+            conn.execute("UPDATE board_meta SET value = ? WHERE key = 'log_floor'", (str(version),))
+        return True
+
+    def export_data(self):
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            posts = [self._row_to_post(row) for row in conn.execute("SELECT * FROM posts ORDER BY id")]
+            sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'posts'").fetchone()
+            users = {row['device_id']: row['username'] for row in conn.execute("SELECT * FROM users")}
+            reports = {}
+            for row in conn.execute("SELECT post_id, reporter FROM reports ORDER BY rowid"):
+                reports.setdefault(row['post_id'], []).append(row['reporter'])
+            bans = {row['device_id']: datetime.fromisoformat(row['until']) for row in conn.execute("SELECT * FROM bans")}
+        finally:
+            conn.execute("COMMIT")
+        return {
+            'posts': posts,
+            'next_post_id': (sequence[0] if sequence else 0) + 1,
+            'users': users,
+            'reports': reports,
+            'bans': bans
+        }
+
+    # ---------- 投稿 ----------
+    def get_version(self):
+        return self.epoch, self._meta(self._connect(), 'version')
+
+    def list_posts(self):
+        return [self._row_to_post(row) for row in self._connect().execute("SELECT * FROM posts ORDER BY id")]
+
+    def own_post_ids(self, device_id):
+        return [row[0] for row in self._connect().execute(
+            "SELECT id FROM posts WHERE device_id = ? ORDER BY id", (device_id,)
+        )]
+
+    def changes_since(self, version):
+        conn = self._connect()
+        conn.execute("BEGIN")
+        try:
+            if version < self._meta(conn, 'log_floor'):
+                return None
+            changed = [self._row_to_post(row) for row in conn.execute(
+                "SELECT * FROM posts WHERE version > ? ORDER BY version", (version,)
+            )]
+            deleted = [row[0] for row in conn.execute(
+                "SELECT id FROM deleted_posts WHERE version > ?", (version,)
+            )]
+        finally:
+            conn.execute("COMMIT")
+        return changed, deleted
+
+    def get_post(self, post_id):
+        row = self._connect().execute("SELECT * FROM posts WHERE id = ?", (post_id,)).fetchone()
+        return self._row_to_post(row) if row else None
+
+    def add_post(self, post):
+        fields = [field for field in POST_FIELDS if field != 'id']
+        with self._transaction() as conn:
+            version = self._bump_version(conn)
+            cur = conn.execute(
+                f"INSERT INTO posts ({', '.join(fields)}, version) VALUES ({', '.join('?' * len(fields))}, ?)",
+                (*(post[field] for field in fields), version)
+            )
+            return {'id': cur.lastrowid, **post}
+
+    def prune_posts(self, cutoff, max_posts):
+        with self._transaction() as conn:
+            removed = [row[0] for row in conn.execute("SELECT id FROM posts WHERE timestamp <= ?", (cutoff,))]
+            # 新しい順に max_posts 件を飛ばした残り（timestamp の索引をたどるだけで済む）
+            removed += [row[0] for row in conn.execute("""
+                SELECT id FROM posts WHERE timestamp > ? ORDER BY timestamp DESC LIMIT -1 OFFSET ?
+            """, (cutoff, max_posts))]
+            if not removed:
+                return 0
+            
+            conn.executemany("DELETE FROM posts WHERE id = ?", [(post_id,) for post_id in removed])
+            conn.execute("DELETE FROM reports WHERE post_id NOT IN (SELECT id FROM posts)")
+            version = self._bump_version(conn)
+            conn.executemany("INSERT OR REPLACE INTO deleted_posts (id, version) VALUES (?, ?)",
+                             [(post_id, version) for post_id in removed])
+            
+            # 削除の履歴は直近 CHANGE_LOG_SIZE 件だけ残す
+            row = conn.execute("SELECT version FROM deleted_posts ORDER BY version DESC LIMIT 1 OFFSET ?",
+                               (CHANGE_LOG_SIZE,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM deleted_posts WHERE version <= ?", (row[0],))
+                conn.execute("UPDATE board_meta SET value = ? WHERE key = 'log_floor'", (str(row[0]),))
+            return len(removed)
+
+    # ---------- ユーザー ----------
+    def get_username(self, device_id):
+        row = self._connect().execute("SELECT username FROM users WHERE device_id = ?", (device_id,)).fetchone()
+        return row[0] if row else None
+
+    def add_user(self, device_id, username):
+        try:
+            with self._transaction() as conn:
+                conn.execute("INSERT INTO users (device_id, username) VALUES (?, ?)", (device_id, username))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def username_taken(self, username):
+        row = self._connect().execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone()
+        return row is not None
+
+    # ---------- 通報・BAN ----------
+    def add_report(self, post_id, reporter_device_id, hide_at):
+        # 通報の追加と投稿の通報数・非表示の更新を同じトランザクションで行う（他ワーカーの通報と混ざらない）
+        with self._transaction() as conn:
+            cur = conn.execute("INSERT OR IGNORE INTO reports (post_id, reporter) VALUES (?, ?)",
+                               (post_id, reporter_device_id))
+            if cur.rowcount == 0:
+                return None
+            report_count = conn.execute("SELECT COUNT(*) FROM reports WHERE post_id = ?", (post_id,)).fetchone()[0]
+            version = self._bump_version(conn)
+            conn.execute(
+                "UPDATE posts SET report_count = ?, is_hidden = is_hidden OR ? >= ?, version = ? WHERE id = ?",
+                (report_count, report_count, hide_at, version, post_id)
+            )
+            return report_count
+
+    def count_reported_posts(self, device_id, min_reports):
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM posts WHERE device_id = ? AND report_count >= ?",
+            (device_id, min_reports)
+        ).fetchone()[0]
+
+    def get_ban(self, device_id):
+        row = self._connect().execute("SELECT until FROM bans WHERE device_id = ?", (device_id,)).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def set_ban(self, device_id, until):
+        with self._transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO bans (device_id, until) VALUES (?, ?)", (device_id, until.isoformat()))
+
+    def delete_ban(self, device_id):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM bans WHERE device_id = ?", (device_id,))
+
+    def count_bans(self):
+        return self._connect().execute("SELECT COUNT(*) FROM bans").fetchone()[0]
+
+    # ---------- 投稿回数 ----------
+    def _post_limit_state(self, conn, device_id, now):
+        row = conn.execute("SELECT window, previous, current FROM post_limits WHERE device_id = ?", (device_id,)).fetchone()
+        return self.post_limit.advance(list(row), now) if row else None
+
+    def check_post_limit(self, device_id):
+        now = time.time()
+        return self.post_limit.evaluate(self._post_limit_state(self._connect(), device_id, now), now)
+
+    def record_post(self, device_id):
+        now = time.time()
+        with self._transaction() as conn:
+            state = self._post_limit_state(conn, device_id, now) or [int(now // self.post_limit.period), 0, 0]
+            state[2] += 1
+            conn.execute("INSERT OR REPLACE INTO post_limits (device_id, window, previous, current) VALUES (?, ?, ?, ?)",
+                         (device_id, *state))
+
+    def purge_post_limits(self):
+        index = int(time.time() // self.post_limit.period)
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM post_limits WHERE window < ?", (index - 1,))
+
+    def get_stats(self):
+        return {"backend": self.backend, "db_path": self.db_path}
+
+
+def create_board_storage(data_dir, lock, post_limit):
+    """BOARD_BACKEND に応じて保存先を生成（sqlite: ワーカー間共有 / memory: プロセス内 + JSONファイル）"""
+    backend = os.environ.get('BOARD_BACKEND', 'sqlite').lower()
+    if backend == 'memory':
+        return MemoryBoardStorage(data_dir, lock, post_limit)
+
+    db_path = os.environ.get('BOARD_DB') or os.path.join(tempfile.gettempdir(), 'weather_app_board.db')
+    try:
+        return SQLiteBoardStorage(db_path, post_limit)
+    except Exception as e:
+        print(f"[BOARD STORE] ❌ Shared store unavailable ({e}), falling back to per-process storage")
+        return MemoryBoardStorage(data_dir, lock, post_limit)
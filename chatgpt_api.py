@@ -1,36 +1,140 @@
 import os
+import re
 import json
 import requests
+import threading
+import time
 import traceback
 
-def suggest_outfit(weather, options):
-    """
-    Gemini APIを使用して服装提案を行う
-    
-    2026年1月時点の最新情報:
-    - 利用可能モデル: gemini-2.5-flash, gemini-2.0-flash, gemini-2.5-pro
-    - gemini-1.5-flash は廃止済み
-    - 公式ドキュメント: https://ai.google.dev/gemini-api/docs/models
-    """
-    
-    # APIキーの取得
-    api_key = os.environ.get("GOOGLE_API_KEY")
-    
-    if not api_key:
-        print("[ERROR] GOOGLE_API_KEY is not set in environment variables!")
-        return {
-            "type": "error",
-            "suggestions": {
-                "suggestion": "❌ APIキーが設定されていません。\n\n環境変数 GOOGLE_API_KEY を設定してください。"
+from http_client import gemini_http
+from model_chain import gemini_models
+from api_keys import gemini_keys
+from context_cache import gemini_context_cache
+
+# 🔧 ローカルのテスト用サーバーに向ける場合は環境変数で上書き
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+
+# ==========================================
+# サーキットブレーカー（Gemini 障害時に即座に失敗させる）
+# ==========================================
+# 障害とみなすエラー（レート制限や入力不備は Gemini 側の障害ではない）
+OUTAGE_ERRORS = {"server_error", "timeout", "connection"}
+
+class CircuitBreaker:
+    """closed（通常）→ open（遮断）→ half_open（試行）の3状態で呼び出しを制御"""
+    def __init__(self, name, failure_threshold=5, recovery_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold  # 連続でこの回数障害が起きたら遮断
+        self.recovery_timeout = recovery_timeout    # 遮断してから試行を許すまでの秒数
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0
+        self.probing = False                        # half_open で試行中の呼び出しがあるか
+        self.probe_retry_after = 1                  # 試行中に案内する再試行までの秒数
+        self.trips = 0
+        self.short_circuited = 0
+        self.lock = threading.Lock()
+
+    def retry_after(self):
+        """試行を再開するまでの秒数"""
+        with self.lock:
+            if self.state == "half_open" and self.probing:
+                return self.probe_retry_after  # 試行中の呼び出しの結果待ち
+            if self.state != "open":
+                return 0
+            return max(0, self.opened_at + self.recovery_timeout - time.monotonic())
+
+    def is_available(self):
+        """呼び出しを受け付ける見込みがあるか（状態は変えない）"""
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open":
+                return time.monotonic() - self.opened_at >= self.recovery_timeout
+            return not self.probing
+
+    def allow(self):
+        """呼び出してよいか判定（遮断中でも時間が経てば1件だけ試行を通す）"""
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.recovery_timeout:
+                self.state = "half_open"
+                self.probing = False
+                print(f"[CIRCUIT] 🟡 {self.name}: half-open (probing)")
+            
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.probing:
+                self.probing = True
+                return True
+            
+            self.short_circuited += 1
+            return False
+
+    def cancel(self):
+        """呼び出さなかった場合に試行枠を返す（状態は変えない）"""
+        with self.lock:
+            self.probing = False
+
+    def record(self, error_kind):
+        """呼び出し結果を記録（error_kind が None なら成功）"""
+        with self.lock:
+            if error_kind not in OUTAGE_ERRORS:
+                if self.state != "closed":
+                    print(f"[CIRCUIT] 🟢 {self.name}: closed (recovered)")
+                self.state = "closed"
+                self.failures = 0
+                self.probing = False
+                return
+            
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.trips += 1
+                    print(f"[CIRCUIT] 🔴 {self.name}: open ({self.failures} failures, last: {error_kind})")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probing = False
+
+    def get_stats(self):
+        retry_after = self.retry_after()
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "short_circuited": self.short_circuited,
+                "retry_after": round(retry_after, 1)
             }
+
+gemini_breakers = {
+    model_name: CircuitBreaker(
+        model_name,
+        failure_threshold=int(os.environ.get('GEMINI_BREAKER_THRESHOLD', 5)),
+        recovery_timeout=float(os.environ.get('GEMINI_BREAKER_RECOVERY', 30))
+    )
+    for model_name in gemini_models.models
+}
+
+def circuit_open_result(model_name):
+    return {
+        "type": "error",
+        "error_kind": "circuit_open",
+        "suggestions": {
+            "suggestion": f"🔌 AIサービス（{model_name}）で障害が続いているため、一時的に利用を停止しています。\n\nしばらく待ってから再度お試しください。"
         }
-    
-    # APIキーの形式チェック
-    if not api_key.startswith("AIza"):
-        print(f"[WARNING] API key format may be incorrect. Expected to start with 'AIza', got: {api_key[:4]}...")
-    
-    print(f"[INFO] API Key loaded: {api_key[:10]}... (length: {len(api_key)})")
+    }
+
+def gemini_retry_after():
+    """全モデルが遮断中なら再開までの秒数、使えるモデルがあれば 0"""
+    if any(breaker.is_available() for breaker in gemini_breakers.values()):
+        return 0
+    return min(breaker.retry_after() for breaker in gemini_breakers.values())
+
+def get_breaker_stats():
+    return {model_name: breaker.get_stats() for model_name, breaker in gemini_breakers.items()}
 
+def build_request_info(weather, options):
+    """天気情報と基本条件（リクエストごとに変わる部分）"""
     # 天気情報の展開
     temp = weather.get("temp", "不明")
     temp_max = weather.get("temp_max", "不明")
@@ -44,11 +148,8 @@ def suggest_outfit(weather, options):
     hourly_forecast = weather.get("hourly_forecast", [])
     
     # オプション情報の展開
-    mode = options.get("mode", "simple")
     scene = options.get("scene") or "特になし"
     gender = options.get("gender", "unspecified")
-    outfit_detail = options.get("preference") or "特になし"
-    user_question = options.get("wardrobe") or "特になし"
 
     # 性別の表示文字列
     gender_map = {
@@ -58,23 +159,22 @@ def suggest_outfit(weather, options):
     }
     gender_str = gender_map.get(gender, "指定なし(ユニセックス)")
 
-    # 時系列天候情報を整形
-    hourly_info = ""
-    if hourly_forecast and len(hourly_forecast) > 0:
-        hourly_info = "\n# 今後12時間の天候推移\n"
+    # 時系列天候情報を表形式で整形（単位は見出しにまとめてトークンを節約）
+    if hourly_forecast:
+        rows = ["# 今後12時間の天候推移", "時刻|気温℃|天気|降水量mm|降水確率%"]
         for i, hour_data in enumerate(hourly_forecast[:12]):  # 最大12時間分
-            time_label = hour_data.get("time", f"{i}時間後")
-            temp_h = hour_data.get("temperature", "不明")
-            precip_h = hour_data.get("precipitation", 0)
-            precip_prob_h = hour_data.get("precipitation_probability", 0)
-            weather_h = hour_data.get("weather", "不明")
-            
-            hourly_info += f"{time_label}: 気温{temp_h}℃, {weather_h}, 降水量{precip_h}mm, 降水確率{precip_prob_h}%\n"
+            rows.append("|".join(str(value) for value in (
+                hour_data.get("time", f"{i}時間後"),
+                hour_data.get("temperature", "不明"),
+                hour_data.get("weather", "不明"),
+                hour_data.get("precipitation", 0),
+                hour_data.get("precipitation_probability", 0)
+            )))
+        hourly_info = "\n".join(rows)
     else:
-        hourly_info = "\n# 今後の天候推移\n（データなし）\n"
+        hourly_info = "# 今後の天候推移\n（データなし）"
 
-    # プロンプト構築
-    base_info = f"""
+    return f"""
 # 現在の天気情報
 - 天気: {weather_desc}
 - 気温: {temp}℃ (最高:{temp_max}℃ / 最低:{temp_min}℃)
@@ -87,7 +187,10 @@ def suggest_outfit(weather, options):
 # 基本条件
 - 利用シーン: {scene}
 - スタイル対象: {gender_str}
+"""
 
+# 安全性チェック（全リクエスト共通）
+SAFETY_CHECK = """
 # 【重要】安全性チェック（最優先で確認）
 「利用シーン」が以下に該当する場合は、必ず次の文言のみを返してください：
 「その提案・質問にはお答えできません」
@@ -103,12 +206,16 @@ def suggest_outfit(weather, options):
 上記に該当しない場合のみ、以下の指示で提案を行ってください。
 """
 
-    if mode == "detailed":
-        instruction = f"""
+def build_user_request(outfit_detail, user_question):
+    """ユーザーの要望（服装の詳細・質問）"""
+    return f"""
 # ユーザーの要望
 - **服装の詳細**: {outfit_detail}
 - **質問・要望**: {user_question}
+"""
 
+# 指示（詳細モード）
+DETAILED_INSTRUCTION = """
 # 指示（詳細モード）
 
 ## 1. 質問・要望の安全性チェック
@@ -182,8 +289,9 @@ def suggest_outfit(weather, options):
 
 すべて問題なければ、提案を出力してください。
 """
-    else:
-        instruction = f"""
+
+# 指示（おまかせモード）
+SIMPLE_INSTRUCTION = """
 # 指示（おまかせモード）
 
 ## 1. 時系列データの活用
@@ -208,13 +316,13 @@ def suggest_outfit(weather, options):
 - 天候変化がある場合は、必ずその時刻と対応策を明記
 
 ## 3. 服装の詳細が入力されている場合
-「服装の詳細」に内容がある場合（{outfit_detail}）：
+「ユーザーの要望」の「服装の詳細」に内容がある場合：
 - その服装・アイテムを考慮に入れた提案を行う
 - 現在および今後の天候に対して適切かチェック
 - 不適切であれば理由を説明し、改善案を提示
 
 ## 4. 質問・要望への対応
-「質問・要望」に内容がある場合（{user_question}）：
+「ユーザーの要望」の「質問・要望」に内容がある場合：
 - 服装提案に関連する質問であれば答える
 - 時間指定がある場合は、該当時刻の天候データを参照
 - 服装と無関係、犯罪助長、利用規約違反の内容は「その提案・質問にはお答えできません」と返す
@@ -238,7 +346,8 @@ def suggest_outfit(weather, options):
 すべて問題なければ、提案を出力してください。
 """
 
-    format_instruction = """
+# 出力形式（1件分）
+FORMAT_INSTRUCTION = """
 # 出力形式
 以下のJSON形式で出力してください:
 
@@ -254,18 +363,158 @@ def suggest_outfit(weather, options):
 - **文字数は必ず320文字以内に収めること（重要）**
 """
 
-    prompt = base_info + instruction + format_instruction
+# モードごとの固定部分（起動時に1回だけ組み立てる）
+STATIC_PROMPTS = {
+    "simple": SAFETY_CHECK + SIMPLE_INSTRUCTION + FORMAT_INSTRUCTION,
+    "detailed": SAFETY_CHECK + DETAILED_INSTRUCTION + FORMAT_INSTRUCTION
+}
 
-    # 🔧 2026年1月対応: 最新の利用可能モデルを使用
-    model_name = "gemini-2.5-flash"
-    base_url = "https://generativelanguage.googleapis.com"
-    endpoint = f"{base_url}/v1beta/models/{model_name}:generateContent"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "x-goog-api-key": api_key
-    }
-    
+def build_request_section(weather, options):
+    """1件分のリクエスト内容（天気情報・基本条件・ユーザーの要望）"""
+    outfit_detail = options.get("preference") or "特になし"
+    user_question = options.get("wardrobe") or "特になし"
+    return build_request_info(weather, options) + build_user_request(outfit_detail, user_question)
+
+def build_prompt_parts(weather, options):
+    """プロンプトを (固定部分, リクエストごとの部分) に分けて組み立てる
+
+    固定部分を先頭に置き、Gemini 側のプレフィックスキャッシュが効くようにする。
+    """
+    mode = "detailed" if options.get("mode") == "detailed" else "simple"
+    return STATIC_PROMPTS[mode], build_request_section(weather, options)
+
+def build_prompt(weather, options):
+    """天気情報とオプションからプロンプトを組み立てる"""
+    static, dynamic = build_prompt_parts(weather, options)
+    return static + dynamic
+
+# 一括リクエストの前置き
+BATCH_HEADER = """
+# 一括リクエスト
+末尾の「リクエスト一覧」は、別々のユーザーから届いた服装提案リクエストです。リクエスト同士は無関係です。
+各リクエストについて、そのリクエストの天気情報・基本条件・要望だけを使い、モード別の指示に従って提案してください。
+"""
+
+# 出力形式（一括リクエスト）
+BATCH_FORMAT_INSTRUCTION = """
+# 出力形式
+以下のJSON形式で、すべてのリクエストへの提案を出力してください:
+
+{
+  "suggestions": [
+    {"id": 1, "suggestion": "リクエスト1への提案文章（280〜320文字程度・簡潔に）"},
+    {"id": 2, "suggestion": "リクエスト2への提案文章（280〜320文字程度・簡潔に）"}
+  ]
+}
+
+# 制約
+- id はリクエスト番号。suggestions の要素数はリクエストの件数と必ず同じにする
+- 安全性チェックに該当したリクエストは、その suggestion だけを「その提案・質問にはお答えできません」にする
+- 指示の復唱はしない
+- JSON以外の余計な文字は出力しない
+- マークダウン記号（```json など）は使用しない
+- **各 suggestion の文字数は必ず320文字以内に収めること（重要）**
+"""
+
+def build_batch_prompt_parts(items):
+    """複数の (weather, options) を1つのプロンプトにまとめる（共通の指示は1回だけ）
+
+    Returns:
+        (固定部分, リクエスト一覧)
+    """
+    modes = {"detailed" if options.get("mode") == "detailed" else "simple" for _, options in items}
+    instruction = ""
+    if "detailed" in modes:
+        instruction += DETAILED_INSTRUCTION
+    if "simple" in modes:
+        instruction += SIMPLE_INSTRUCTION
+    static = BATCH_HEADER + SAFETY_CHECK + instruction + BATCH_FORMAT_INSTRUCTION
+
+    sections = [f"\n# リクエスト一覧（{len(items)}件）\n"]
+    for i, (weather, options) in enumerate(items, 1):
+        mode_label = "詳細モード" if options.get("mode") == "detailed" else "おまかせモード"
+        sections.append(f"\n## リクエスト{i}（{mode_label}）" + build_request_section(weather, options))
+    return static, "".join(sections)
+
+def build_batch_prompt(items):
+    static, dynamic = build_batch_prompt_parts(items)
+    return static + dynamic
+
+# ==========================================
+# プロンプトサイズの計測
+# ==========================================
+def estimate_tokens(text):
+    """トークン数の概算（日本語は1文字≒1トークン、英数字・記号は4文字≒1トークン）"""
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+class PromptMetrics:
+    """送信したプロンプトのサイズと、Gemini が返した実トークン数の記録"""
+    def __init__(self):
+        self.prompts = 0
+        self.total_bytes = 0
+        self.total_static_bytes = 0
+        self.total_estimated_tokens = 0
+        self.responses = 0
+        self.total_prompt_tokens = 0      # usageMetadata.promptTokenCount
+        self.total_cached_tokens = 0      # usageMetadata.cachedContentTokenCount
+        self.total_output_tokens = 0      # usageMetadata.candidatesTokenCount
+        self.last = None
+        self.lock = threading.Lock()
+
+    def record_prompt(self, kind, static, dynamic):
+        static_bytes = len(static.encode("utf-8"))
+        dynamic_bytes = len(dynamic.encode("utf-8"))
+        estimated = estimate_tokens(static) + estimate_tokens(dynamic)
+        print(f"[PROMPT] {kind}: {static_bytes + dynamic_bytes} bytes (static {static_bytes} + dynamic {dynamic_bytes}), ~{estimated} tokens")
+        with self.lock:
+            self.prompts += 1
+            self.total_bytes += static_bytes + dynamic_bytes
+            self.total_static_bytes += static_bytes
+            self.total_estimated_tokens += estimated
+            self.last = {
+                "kind": kind,
+                "bytes": static_bytes + dynamic_bytes,
+                "static_bytes": static_bytes,
+                "dynamic_bytes": dynamic_bytes,
+                "estimated_tokens": estimated
+            }
+
+    def record_usage(self, usage):
+        """応答の usageMetadata を記録"""
+        if not usage:
+            return
+        prompt_tokens = usage.get("promptTokenCount", 0)
+        cached_tokens = usage.get("cachedContentTokenCount", 0)
+        output_tokens = usage.get("candidatesTokenCount", 0)
+        print(f"[PROMPT] Usage: prompt={prompt_tokens} (cached={cached_tokens}), output={output_tokens} tokens")
+        with self.lock:
+            self.responses += 1
+            self.total_prompt_tokens += prompt_tokens
+            self.total_cached_tokens += cached_tokens
+            self.total_output_tokens += output_tokens
+
+    def get_stats(self):
+        def average(total, count):
+            return round(total / count, 1) if count else 0.0
+
+        with self.lock:
+            return {
+                "prompts": self.prompts,
+                "avg_bytes": average(self.total_bytes, self.prompts),
+                "avg_static_bytes": average(self.total_static_bytes, self.prompts),
+                "avg_estimated_tokens": average(self.total_estimated_tokens, self.prompts),
+                "responses": self.responses,
+                "avg_prompt_tokens": average(self.total_prompt_tokens, self.responses),
+                "avg_cached_tokens": average(self.total_cached_tokens, self.responses),
+                "avg_output_tokens": average(self.total_output_tokens, self.responses),
+                "last": self.last
+            }
+
+prompt_metrics = PromptMetrics()
+
+def build_payload(prompt, max_output_tokens=3072):
+    """generateContent / streamGenerateContent 共通のリクエスト本体"""
     payload = {
         "contents": [{
             "parts": [{
@@ -276,7 +525,7 @@ def suggest_outfit(weather, options):
             "temperature": 0.7,
             "topP": 0.8,
             "topK": 40,
-            "maxOutputTokens": 3072,  # 🔧 修正: 1536 → 3072
+            "maxOutputTokens": max_output_tokens,  # 🔧 修正: 1536 → 3072（一括リクエストは件数分）
             "responseMimeType": "application/json"
         },
         "safetySettings": [
@@ -298,217 +547,520 @@ def suggest_outfit(weather, options):
             }
         ]
     }
+    return payload
 
+def parse_retry_after(response):
+    """429 応答の再試行までの秒数（Retry-After ヘッダーか RetryInfo の retryDelay。なければ None）"""
+    header = response.headers.get("Retry-After")
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
     try:
-        print(f"[INFO] Sending request to Gemini API")
-        print(f"[DEBUG] Model: {model_name}")
-        print(f"[DEBUG] Hourly forecast data points: {len(hourly_forecast)}")
-        
-        response = requests.post(
-            endpoint,
-            headers=headers,
-            json=payload,
-            timeout=180  # 🔧 修正: 60秒 → 180秒
-        )
-        
-        print(f"[INFO] Response status: {response.status_code}")
-        
-        # ステータスコード別エラーハンドリング
-        if response.status_code == 400:
-            error_detail = response.text[:500]
-            print(f"[ERROR] Bad Request (400): {error_detail}")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": "❌ リクエスト内容に問題があります。\n\n入力内容を確認してください。\n（エラーコード: 400）"
-                }
+        for detail in response.json().get("error", {}).get("details", []):
+            delay = detail.get("retryDelay")
+            if isinstance(delay, str) and delay.endswith("s"):
+                return float(delay[:-1])
+    except (ValueError, AttributeError):
+        pass
+    return None
+
+def check_response_status(response, model_name):
+    """ステータスコード別エラーハンドリング（問題なければ None）"""
+    if response.status_code == 400:
+        error_detail = response.text[:500]
+        print(f"[ERROR] Bad Request (400): {error_detail}")
+        return {
+            "type": "error",
+            "error_kind": "bad_request",
+            "suggestions": {
+                "suggestion": "❌ リクエスト内容に問題があります。\n\n入力内容を確認してください。\n（エラーコード: 400）"
             }
-        
-        if response.status_code == 403:
-            print(f"[ERROR] Forbidden (403)")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": "🚫 APIキーに権限がありません。\n\nGoogle AI Studioで新しいAPIキーを作成してください。\n（エラーコード: 403）"
-                }
+        }
+    
+    if response.status_code == 403:
+        print(f"[ERROR] Forbidden (403)")
+        return {
+            "type": "error",
+            "error_kind": "forbidden",
+            "suggestions": {
+                "suggestion": "🚫 APIキーに権限がありません。\n\nGoogle AI Studioで新しいAPIキーを作成してください。\n（エラーコード: 403）"
             }
-        
-        if response.status_code == 404:
-            error_detail = response.text[:500]
-            print(f"[ERROR] Not Found (404): {error_detail}")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": f"❌ モデル '{model_name}' が見つかりません。\n\n現在のAPIキーで利用可能なモデルを確認してください。\n（エラーコード: 404）"
-                }
+        }
+    
+    if response.status_code == 404:
+        error_detail = response.text[:500]
+        print(f"[ERROR] Not Found (404): {error_detail}")
+        return {
+            "type": "error",
+            "error_kind": "not_found",
+            "suggestions": {
+                "suggestion": f"❌ モデル '{model_name}' が見つかりません。\n\n現在のAPIキーで利用可能なモデルを確認してください。\n（エラーコード: 404）"
             }
-        
-        if response.status_code == 429:
-            print(f"[ERROR] Rate Limit Exceeded (429)")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": "⏱️ レート制限に達しました。\n\n無料枠: 15リクエスト/分, 1500リクエスト/日\n\n1分ほど待ってから再度お試しください。"
-                }
+        }
+    
+    if response.status_code == 429:
+        print(f"[ERROR] Rate Limit Exceeded (429)")
+        return {
+            "type": "error",
+            "error_kind": "rate_limited",
+            "retry_after": parse_retry_after(response),
+            "suggestions": {
+                "suggestion": "⏱️ レート制限に達しました。\n\n無料枠: 15リクエスト/分, 1500リクエスト/日\n\n1分ほど待ってから再度お試しください。"
             }
-        
-        if response.status_code == 500:
-            print(f"[ERROR] Internal Server Error (500)")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": "🔧 Googleサーバーでエラーが発生しました。\n\nしばらく待ってから再度お試しください。\n（エラーコード: 500）"
-                }
+        }
+    
+    if response.status_code == 500:
+        print(f"[ERROR] Internal Server Error (500)")
+        return {
+            "type": "error",
+            "error_kind": "server_error",
+            "suggestions": {
+                "suggestion": "🔧 Googleサーバーでエラーが発生しました。\n\nしばらく待ってから再度お試しください。\n（エラーコード: 500）"
             }
-        
-        if response.status_code != 200:
-            error_text = response.text[:500]
-            print(f"[ERROR] Unexpected status code: {response.status_code}")
-            print(f"[ERROR] Response: {error_text}")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": f"❌ 予期しないエラーが発生しました。\n\nステータスコード: {response.status_code}\n\n管理者に連絡してください。"
-                }
+        }
+    
+    if response.status_code != 200:
+        error_text = response.text[:500]
+        print(f"[ERROR] Unexpected status code: {response.status_code}")
+        print(f"[ERROR] Response: {error_text}")
+        return {
+            "type": "error",
+            "error_kind": "server_error" if response.status_code >= 500 else "http_error",
+            "suggestions": {
+                "suggestion": f"❌ 予期しないエラーが発生しました。\n\nステータスコード: {response.status_code}\n\n管理者に連絡してください。"
             }
+        }
+    
+    return None
 
-        try:
-            data = response.json()
-        except json.JSONDecodeError as e:
-            print(f"[ERROR] Failed to parse JSON response: {e}")
-            print(f"[ERROR] Response text: {response.text[:500]}")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": "❌ APIからの応答が不正です。\n\nもう一度お試しください。"
-                }
+def extract_candidate(data):
+    """応答JSONから (本文テキスト, finish_reason) を取り出す。失敗時はエラー結果を返す"""
+    if 'candidates' not in data:
+        print(f"[ERROR] No 'candidates' in response")
+        print(f"[DEBUG] Full response: {json.dumps(data, indent=2, ensure_ascii=False)[:500]}")
+        return {
+            "type": "error",
+            "error_kind": "invalid_response",
+            "suggestions": {
+                "suggestion": "❌ AIから有効な応答が得られませんでした。\n\nもう一度お試しください。"
             }
+        }
+    
+    if not data['candidates'] or len(data['candidates']) == 0:
+        print(f"[ERROR] Empty candidates array")
+        return {
+            "type": "error",
+            "error_kind": "invalid_response",
+            "suggestions": {
+                "suggestion": "❌ AIから回答が得られませんでした。\n\n入力内容を見直してください。"
+            }
+        }
+
+    candidate = data['candidates'][0]
+    finish_reason = candidate.get('finishReason', 'UNKNOWN')
+    print(f"[DEBUG] Finish reason: {finish_reason}")
+    
+    if finish_reason == "SAFETY":
+        print(f"[WARNING] Content filtered by safety settings")
+        return {
+            "type": "error",
+            "error_kind": "safety",
+            "suggestions": {
+                "suggestion": "⚠️ 安全フィルターにより回答が生成されませんでした。\n\n入力内容を見直してください。"
+            }
+        }
+    
+    if 'content' not in candidate:
+        print(f"[ERROR] No 'content' in candidate")
+        return {
+            "type": "error",
+            "error_kind": "invalid_response",
+            "suggestions": {
+                "suggestion": "❌ AI応答の形式が不正です。"
+            }
+        }
+    
+    content_parts = candidate['content'].get('parts', [])
+    if not content_parts or 'text' not in content_parts[0]:
+        print(f"[ERROR] No text in parts")
+        return {
+            "type": "error",
+            "error_kind": "invalid_response",
+            "suggestions": {
+                "suggestion": "❌ AI応答にテキストが含まれていません。"
+            }
+        }
+    
+    return content_parts[0]['text'].strip(), finish_reason
+
+_SUGGESTION_START = re.compile(r'"suggestion"\s*:\s*"')
+_JSON_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+def extract_partial_suggestion(text):
+    """途中までの JSON から suggestion の文字列を取り出す
+    
+    ストリーミング中の未完成な JSON や MAX_TOKENS で切れた JSON でも、
+    デコードできたところまでを返す（エスケープ途中の文字は含めない）。
+    """
+    match = _SUGGESTION_START.search(text)
+    if not match:
+        return ""
+    
+    chars = []
+    i = match.end()
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c == '"':
+            break
+        if c != '\\':
+            chars.append(c)
+            i += 1
+            continue
         
-        print(f"[DEBUG] Response keys: {list(data.keys())}")
+        if i + 1 >= n:
+            break
+        escape = text[i + 1]
+        if escape != 'u':
+            chars.append(_JSON_ESCAPES.get(escape, escape))
+            i += 2
+            continue
         
-        if 'candidates' not in data:
-            print(f"[ERROR] No 'candidates' in response")
-            print(f"[DEBUG] Full response: {json.dumps(data, indent=2, ensure_ascii=False)[:500]}")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": "❌ AIから有効な応答が得られませんでした。\n\nもう一度お試しください。"
+        if i + 6 > n:
+            break
+        try:
+            code = int(text[i + 2:i + 6], 16)
+        except ValueError:
+            break
+        i += 6
+        if 0xD800 <= code < 0xDC00:
+            # サロゲートペアは下位側まで揃ってから結合する
+            if i + 6 > n:
+                break
+            try:
+                low = int(text[i + 2:i + 6], 16) if text[i:i + 2] == '\\u' else None
+            except ValueError:
+                low = None
+            if low is None or not 0xDC00 <= low < 0xE000:
+                break
+            code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)
+            i += 6
+        chars.append(chr(code))
+    
+    return "".join(chars)
+
+def parse_suggestion(content, finish_reason):
+    """モデルの出力テキストを提案結果に変換（MAX_TOKENS の切れた JSON も修復）"""
+    clean_json = content.replace("```json", "").replace("```", "").strip()
+    
+    if finish_reason == "MAX_TOKENS":
+        if not clean_json.endswith("}"):
+            if clean_json.count('"') % 2 != 0:
+                clean_json += '"'
+            clean_json += "\n}"
+        print(f"[WARNING] Attempting to repair truncated JSON")
+    
+    try:
+        suggestions = json.loads(clean_json)
+        print(f"[DEBUG] Parsed JSON keys: {list(suggestions.keys())}")
+    except json.JSONDecodeError as e:
+        print(f"[ERROR] JSON Parse Error: {e}")
+        print(f"[ERROR] Content: {clean_json[:300]}")
+        
+        if finish_reason == "MAX_TOKENS":
+            partial_text = extract_partial_suggestion(clean_json)
+            if partial_text:
+                print(f"[WARNING] Using partial text from truncated response: {len(partial_text)} chars")
+                return {
+                    "type": "success",
+                    "suggestions": {
+                        "suggestion": partial_text + "...\n\n（応答が途中で切れました。もう一度お試しください）"
+                    }
                 }
-            }
         
-        if not data['candidates'] or len(data['candidates']) == 0:
-            print(f"[ERROR] Empty candidates array")
-            return {
+        return {
+            "type": "error",
+            "error_kind": "invalid_response",
+            "suggestions": {
+                "suggestion": "❌ AI応答の解析に失敗しました。\n\nもう一度お試しください。"
+            }
+        }
+    
+    if "suggestion" not in suggestions:
+        for key in ["text", "advice", "outfit", "recommendation", "response"]:
+            if key in suggestions:
+                suggestions = {"suggestion": suggestions[key]}
+                print(f"[WARNING] Used alternative key: {key}")
+                break
+        else:
+            suggestions = {"suggestion": str(suggestions)}
+            print(f"[WARNING] No valid key found, using full content")
+    
+    suggestion_text = suggestions.get("suggestion", "").strip()
+    if not suggestion_text or len(suggestion_text) < 10:
+        print(f"[ERROR] Suggestion too short: {len(suggestion_text)} chars")
+        return {
+            "type": "error",
+            "error_kind": "invalid_response",
+            "suggestions": {
+                "suggestion": "❌ AIから十分な提案が得られませんでした。\n\nもう一度お試しください。"
+            }
+        }
+    
+    print(f"[SUCCESS] JSON parsed successfully")
+    print(f"[SUCCESS] Suggestion length: {len(suggestion_text)} chars")
+    
+    return {
+        "type": "success",
+        "suggestions": suggestions
+    }
+
+def parse_batch(content, finish_reason, count):
+    """一括リクエストの出力をリクエストごとの結果に分割
+    
+    成功時は {"type": "success", "batch": [結果, ...]}（リクエスト順）を返す。
+    """
+    clean_json = content.replace("```json", "").replace("```", "").strip()
+    
+    try:
+        data = json.loads(clean_json)
+        entries = data["suggestions"] if isinstance(data, dict) else data
+        texts = {int(entry["id"]): str(entry.get("suggestion", "")).strip() for entry in entries}
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError) as e:
+        print(f"[ERROR] Batch parse error ({finish_reason}): {e}")
+        print(f"[ERROR] Content: {clean_json[:300]}")
+        return {
+            "type": "error",
+            "error_kind": "invalid_response",
+            "suggestions": {
+                "suggestion": "❌ AI応答の解析に失敗しました。\n\nもう一度お試しください。"
+            }
+        }
+    
+    results = []
+    for i in range(1, count + 1):
+        suggestion_text = texts.get(i, "")
+        if len(suggestion_text) < 10:
+            results.append({
                 "type": "error",
+                "error_kind": "invalid_response",
                 "suggestions": {
-                    "suggestion": "❌ AIから回答が得られませんでした。\n\n入力内容を見直してください。"
+                    "suggestion": "❌ AIから十分な提案が得られませんでした。\n\nもう一度お試しください。"
                 }
-            }
+            })
+        else:
+            results.append({
+                "type": "success",
+                "suggestions": {"suggestion": suggestion_text}
+            })
+    
+    succeeded = sum(1 for result in results if result["type"] == "success")
+    print(f"[SUCCESS] Batch parsed: {succeeded}/{count} suggestions")
+    if succeeded == 0:
+        return results[0]
+    return {"type": "success", "batch": results}
 
-        candidate = data['candidates'][0]
-        finish_reason = candidate.get('finishReason', 'UNKNOWN')
+def stream_generate(base_url, model_name, headers, payload, on_partial, cancelled=None):
+    """streamGenerateContent（SSE）で生成し、suggestion の途中経過を on_partial に渡す
+
+    cancelled がセットされたら受信をやめて接続を閉じる。
+    """
+    endpoint = f"{base_url}/v1beta/models/{model_name}:streamGenerateContent?alt=sse"
+    
+    with gemini_http.post(endpoint, headers=headers, json=payload, timeout=180, stream=True) as response:
+        print(f"[INFO] Stream response status: {response.status_code}")
+        
+        error = check_response_status(response, model_name)
+        if error:
+            return error
+        
+        text_parts = []
+        finish_reason = 'UNKNOWN'
+        last_partial = ""
+        usage = None
+        
+        for raw_line in response.iter_lines():
+            if cancelled is not None and cancelled.is_set():
+                print(f"[INFO] Stream cancelled: {model_name} (another model answered)")
+                return cancelled_result()
+            
+            # SSE は charset 指定がないことがあるため自前で UTF-8 デコード
+            line = raw_line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            
+            chunk = json.loads(line[5:].strip())
+            usage = chunk.get('usageMetadata') or usage
+            candidates = chunk.get('candidates') or []
+            if not candidates:
+                continue
+            
+            candidate = candidates[0]
+            for part in candidate.get('content', {}).get('parts', []):
+                text_parts.append(part.get('text', ''))
+            finish_reason = candidate.get('finishReason', finish_reason)
+            
+            partial = extract_partial_suggestion("".join(text_parts))
+            if partial != last_partial:
+                last_partial = partial
+                on_partial(partial)
+        
         print(f"[DEBUG] Finish reason: {finish_reason}")
+        prompt_metrics.record_usage(usage)
         
         if finish_reason == "SAFETY":
             print(f"[WARNING] Content filtered by safety settings")
             return {
                 "type": "error",
+                "error_kind": "safety",
                 "suggestions": {
                     "suggestion": "⚠️ 安全フィルターにより回答が生成されませんでした。\n\n入力内容を見直してください。"
                 }
             }
         
-        if 'content' not in candidate:
-            print(f"[ERROR] No 'content' in candidate")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": "❌ AI応答の形式が不正です。"
-                }
-            }
-        
-        content_parts = candidate['content'].get('parts', [])
-        if not content_parts or 'text' not in content_parts[0]:
-            print(f"[ERROR] No text in parts")
+        content = "".join(text_parts).strip()
+        if not content:
+            print(f"[ERROR] No text in stream")
             return {
                 "type": "error",
+                "error_kind": "invalid_response",
                 "suggestions": {
                     "suggestion": "❌ AI応答にテキストが含まれていません。"
                 }
             }
         
-        content = content_parts[0]['text'].strip()
-        print(f"[SUCCESS] Got response from Gemini API")
+        print(f"[SUCCESS] Got streamed response from Gemini API")
         print(f"[DEBUG] Response length: {len(content)} chars")
+        return parse_suggestion(content, finish_reason)
+
+def keys_exhausted_result(wait):
+    """使えるキーがなく、呼び出しを送らなかった結果（remaining_time は使えるキーができるまでの秒数）"""
+    return {
+        "type": "error",
+        "error_kind": "keys_exhausted",
+        "remaining_time": wait,
+        "suggestions": {
+            "suggestion": "⏱️ すべてのAPIキーが利用枠の上限に達しています。\n\n1分ほど待ってから再度お試しください。"
+        }
+    }
+
+def cancelled_result():
+    """他のモデルの回答が先に決まり、呼び出しをやめた結果"""
+    return {
+        "type": "error",
+        "error_kind": "cancelled",
+        "suggestions": {
+            "suggestion": "別のモデルの回答を使用しました。"
+        }
+    }
+
+def call_model(model_name, static, dynamic, on_partial=None, parse=parse_suggestion, max_output_tokens=3072, cancelled=None):
+    """サーキットブレーカーを通し、空いている APIキーで1つのモデルを呼び出す
+    
+    コンテキストキャッシュが使える場合は固定部分 static をキャッシュから参照し、
+    dynamic だけを送る。
+    cancelled（Event）がセットされたら送信前ならやめ、ストリーミング中なら接続を閉じる。
+    """
+    if cancelled is not None and cancelled.is_set():
+        return cancelled_result()
+    
+    breaker = gemini_breakers[model_name]
+    if not breaker.allow():
+        print(f"[CIRCUIT] ⛔ {model_name}: short-circuited")
+        return circuit_open_result(model_name)
+    
+    key = gemini_keys.acquire()
+    if key is None:
+        print(f"[API KEYS] ⛔ No key available for {model_name}")
+        breaker.cancel()
+        return keys_exhausted_result(gemini_keys.retry_after())
+    
+    headers = {
+        "Content-Type": "application/json",
+        "x-goog-api-key": key.value
+    }
+    print(f"[INFO] Using API key: {key.label}")
+    
+    cache_name = gemini_context_cache.get(
+        GEMINI_BASE_URL, key.value, model_name, static, estimate_tokens(static)
+    )
+    if cache_name:
+        payload = build_payload(dynamic, max_output_tokens)
+        payload["cachedContent"] = cache_name
+        result = request_model(model_name, headers, payload, on_partial, parse, cancelled)
+        if result.get("error_kind") in ("not_found", "bad_request"):
+            # キャッシュが Gemini 側で消えていた可能性があるので、全文で送り直す
+            gemini_context_cache.invalidate(key.value, model_name, static)
+            cache_name = None
+    if not cache_name:
+        payload = build_payload(static + dynamic, max_output_tokens)
+        result = request_model(model_name, headers, payload, on_partial, parse, cancelled)
+    if result.get("error_kind") == "cancelled":
+        # 途中でやめた呼び出しはキー・モデルの成否に数えない
+        gemini_keys.release(key, None)
+        breaker.cancel()
+        return result
+    gemini_keys.release(key, result.get("error_kind"), result.get("retry_after"))
+    breaker.record(result.get("error_kind"))
+    return result
 
-        clean_json = content.replace("```json", "").replace("```", "").strip()
+def request_model(model_name, headers, payload, on_partial=None, parse=parse_suggestion, cancelled=None):
+    """1つのモデルで生成（通信エラーなどの例外もエラー結果に変換して返す）"""
+    base_url = GEMINI_BASE_URL
+    endpoint = f"{base_url}/v1beta/models/{model_name}:generateContent"
+    
+    try:
+        print(f"[DEBUG] Model: {model_name}")
         
-        if finish_reason == "MAX_TOKENS":
-            if not clean_json.endswith("}"):
-                if clean_json.count('"') % 2 != 0:
-                    clean_json += '"'
-                clean_json += "\n}"
-            print(f"[WARNING] Attempting to repair truncated JSON")
+        if on_partial is not None:
+            return stream_generate(base_url, model_name, headers, payload, on_partial, cancelled)
         
+        response = gemini_http.post(
+            endpoint,
+            headers=headers,
+            json=payload,
+            timeout=180  # 🔧 修正: 60秒 → 180秒
+        )
+        
+        print(f"[INFO] Response status: {response.status_code}")
+        
+        error = check_response_status(response, model_name)
+        if error:
+            return error
+
         try:
-            suggestions = json.loads(clean_json)
-            print(f"[DEBUG] Parsed JSON keys: {list(suggestions.keys())}")
+            data = response.json()
         except json.JSONDecodeError as e:
-            print(f"[ERROR] JSON Parse Error: {e}")
-            print(f"[ERROR] Content: {clean_json[:300]}")
-            
-            if finish_reason == "MAX_TOKENS":
-                import re
-                match = re.search(r'"suggestion"\s*:\s*"([^"]*)', clean_json)
-                if match:
-                    partial_text = match.group(1)
-                    print(f"[WARNING] Using partial text from truncated response: {len(partial_text)} chars")
-                    return {
-                        "type": "success",
-                        "suggestions": {
-                            "suggestion": partial_text + "...\n\n（応答が途中で切れました。もう一度お試しください）"
-                        }
-                    }
-            
+            print(f"[ERROR] Failed to parse JSON response: {e}")
+            print(f"[ERROR] Response text: {response.text[:500]}")
             return {
                 "type": "error",
+                "error_kind": "invalid_response",
                 "suggestions": {
-                    "suggestion": "❌ AI応答の解析に失敗しました。\n\nもう一度お試しください。"
+                    "suggestion": "❌ APIからの応答が不正です。\n\nもう一度お試しください。"
                 }
             }
         
-        if "suggestion" not in suggestions:
-            for key in ["text", "advice", "outfit", "recommendation", "response"]:
-                if key in suggestions:
-                    suggestions = {"suggestion": suggestions[key]}
-                    print(f"[WARNING] Used alternative key: {key}")
-                    break
-            else:
-                suggestions = {"suggestion": str(suggestions)}
-                print(f"[WARNING] No valid key found, using full content")
+        print(f"[DEBUG] Response keys: {list(data.keys())}")
+        prompt_metrics.record_usage(data.get("usageMetadata"))
         
-        suggestion_text = suggestions.get("suggestion", "").strip()
-        if not suggestion_text or len(suggestion_text) < 10:
-            print(f"[ERROR] Suggestion too short: {len(suggestion_text)} chars")
-            return {
-                "type": "error",
-                "suggestions": {
-                    "suggestion": "❌ AIから十分な提案が得られませんでした。\n\nもう一度お試しください。"
-                }
-            }
+        extracted = extract_candidate(data)
+        if isinstance(extracted, dict):
+            return extracted
+        content, finish_reason = extracted
         
-        print(f"[SUCCESS] JSON parsed successfully")
-        print(f"[SUCCESS] Suggestion length: {len(suggestion_text)} chars")
+        print(f"[SUCCESS] Got response from Gemini API")
+        print(f"[DEBUG] Response length: {len(content)} chars")
         
-        return {
-            "type": "success",
-            "suggestions": suggestions
-        }
+        return parse(content, finish_reason)
 
     except requests.exceptions.Timeout:
         print("[ERROR] Request timeout (180s)")
         return {
             "type": "error",
+            "error_kind": "timeout",
             "suggestions": {
                 "suggestion": "⏱️ 処理がタイムアウトしました。\n\nネットワーク接続を確認して、もう一度お試しください。"
             }
@@ -518,6 +1070,7 @@ def suggest_outfit(weather, options):
         print(f"[ERROR] Connection error: {e}")
         return {
             "type": "error",
+            "error_kind": "connection",
             "suggestions": {
                 "suggestion": "🌐 ネットワーク接続エラーが発生しました。\n\nインターネット接続を確認してください。"
             }
@@ -528,6 +1081,7 @@ def suggest_outfit(weather, options):
         traceback.print_exc()
         return {
             "type": "error",
+            "error_kind": "connection",
             "suggestions": {
                 "suggestion": "❌ 通信エラーが発生しました。\n\nしばらく待ってから再度お試しください。"
             }
@@ -538,7 +1092,103 @@ def suggest_outfit(weather, options):
         traceback.print_exc()
         return {
             "type": "error",
+            "error_kind": "internal",
             "suggestions": {
                 "suggestion": f"❌ システムエラーが発生しました。\n\nエラー: {str(e)[:100]}"
             }
         }
+
+def prepare_models():
+    """今回使えるモデルの一覧を取得
+    
+    Returns:
+        (モデル名のリスト, エラー結果)  ※使えない場合はエラー結果のみ
+    """
+    # APIキーの確認（キーは呼び出しごとに gemini_keys から選ぶ）
+    if not gemini_keys.keys:
+        print("[ERROR] GOOGLE_API_KEY is not set in environment variables!")
+        return None, {
+            "type": "error",
+            "error_kind": "config",
+            "suggestions": {
+                "suggestion": "❌ APIキーが設定されていません。\n\n環境変数 GOOGLE_API_KEY を設定してください。"
+            }
+        }
+
+    # 遮断中のモデルは使わない（全モデル遮断中なら Gemini を呼ばずに即失敗）
+    models = [name for name in gemini_models.models if gemini_breakers[name].is_available()]
+    if not models:
+        print(f"[CIRCUIT] ⛔ All models short-circuited")
+        return None, circuit_open_result(", ".join(gemini_models.models))
+    
+    return models, None
+
+def suggest_outfit(weather, options, on_partial=None, reserve_call=None):
+    """
+    Gemini APIを使用して服装提案を行う
+    
+    2026年1月時点の最新情報:
+    - 利用可能モデル: gemini-2.5-flash, gemini-2.0-flash, gemini-2.5-pro
+    - gemini-1.5-flash は廃止済み
+    - 公式ドキュメント: https://ai.google.dev/gemini-api/docs/models
+    
+    on_partial を渡すと streamGenerateContent を使い、
+    生成途中の提案文を on_partial(text) で逐次通知する。
+    
+    エラー時の結果には原因の分類 error_kind（rate_limited, server_error,
+    timeout など）が入る。
+    
+    モデルは GEMINI_MODELS の順に使い、第1モデルが遅い・失敗した場合は
+    次のモデルにもリクエストを送る（model_chain.py）。追加で送る前に
+    reserve_call() を呼び、False ならそれ以上送らない。
+    """
+    
+    models, error = prepare_models()
+    if error:
+        return error
+    
+    static, dynamic = build_prompt_parts(weather, options)
+    prompt_metrics.record_prompt(options.get("mode") or "simple", static, dynamic)
+    hourly_forecast = weather.get("hourly_forecast", [])
+    
+    print(f"[INFO] Sending request to Gemini API")
+    print(f"[DEBUG] Hourly forecast data points: {len(hourly_forecast)}")
+    
+    return gemini_models.run(
+        lambda model_name, partial, cancelled: call_model(model_name, static, dynamic, partial, cancelled=cancelled),
+        on_partial=on_partial,
+        reserve_call=reserve_call,
+        models=models
+    )
+
+def suggest_outfits(items, reserve_call=None):
+    """
+    複数の (weather, options) をまとめて1回の Gemini 呼び出しで提案する
+    
+    共通の指示はプロンプトに1回だけ入れ、提案は JSON 配列で受け取って分割する。
+    結果は items と同じ順のリスト（呼び出し自体の失敗時は全件同じエラー結果）。
+    """
+    models, error = prepare_models()
+    if error:
+        return [error] * len(items)
+    
+    count = len(items)
+    static, dynamic = build_batch_prompt_parts(items)
+    prompt_metrics.record_prompt(f"batch({count})", static, dynamic)
+    
+    print(f"[INFO] Sending batch of {count} requests to Gemini API")
+    
+    result = gemini_models.run(
+        lambda model_name, partial, cancelled: call_model(
+            model_name, static, dynamic,
+            cancelled=cancelled,
+            parse=lambda content, finish_reason: parse_batch(content, finish_reason, count),
+            max_output_tokens=min(3072 * count, 16384)
+        ),
+        reserve_call=reserve_call,
+        models=models
+    )
+    
+    if result.get("type") != "success":
+        return [result] * count
+    return result["batch"]
@@ -0,0 +1,168 @@
+"""
+Gemini コンテキストキャッシュ（cachedContents）の管理
+プロンプトの固定部分を一度だけアップロードし、各 generateContent からは名前で参照する
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+from http_client import gemini_http
+
+
+class CacheEntry:
+    def __init__(self, name, expires_at):
+        self.name = name              # "cachedContents/xxx"
+        self.expires_at = expires_at  # 有効期限（time.time() 基準）
+        self.refreshing = False
+
+
+class ContextCacheManager:
+    """APIキー × モデル × 固定部分 ごとにキャッシュを作成し、期限切れ前に延長する
+
+    キャッシュはAPIキー（プロジェクト）とモデルごとに別物なので、それぞれ作成する。
+    作成に失敗した組み合わせはしばらく作成を試みない（毎回の呼び出しを遅くしないため）。
+    """
+    def __init__(self, enabled=False, ttl_seconds=3600, refresh_margin=300,
+                 min_tokens=1024, retry_after_failure=300):
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds                  # キャッシュの有効期間（秒）
+        self.refresh_margin = refresh_margin            # 期限のこの秒数前になったら延長
+        self.min_tokens = min_tokens                    # これより短い固定部分はキャッシュしない（API の下限）
+        self.retry_after_failure = retry_after_failure  # 作成失敗後に再作成を控える秒数
+        self.entries = {}                               # (APIキー, モデル, 固定部分のハッシュ) -> CacheEntry
+        self.failed_until = {}                          # 同上 -> 再作成を試みてよい時刻
+        self.create_locks = {}
+        self.created = 0
+        self.refreshed = 0
+        self.hits = 0
+        self.failures = 0
+        self.invalidated = 0
+        self.lock = threading.Lock()
+
+        print(f"[CONTEXT CACHE] Initialized: enabled={self.enabled}, TTL={self.ttl_seconds}s, refresh margin={self.refresh_margin}s")
+
+    def _cache_key(self, api_key, model_name, static):
+        digest = hashlib.sha256(static.encode("utf-8")).hexdigest()[:16]
+        return api_key, model_name, digest
+
+    def get(self, base_url, api_key, model_name, static, estimated_tokens):
+        """固定部分のキャッシュ名を取得（なければ作成）。使えなければ None"""
+        if not self.enabled or estimated_tokens < self.min_tokens:
+            return None
+
+        cache_key = self._cache_key(api_key, model_name, static)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry.expires_at - now > self.refresh_margin:
+                self.hits += 1
+                return entry.name
+            if entry is not None and entry.expires_at > now:
+                # 期限が近い: 今回は現在のキャッシュを使い、延長は裏で行う
+                self.hits += 1
+                if not entry.refreshing:
+                    entry.refreshing = True
+                    threading.Thread(
+                        target=self._refresh, args=(base_url, api_key, cache_key, entry), daemon=True
+                    ).start()
+                return entry.name
+            if self.failed_until.get(cache_key, 0) > now:
+                return None
+            create_lock = self.create_locks.setdefault(cache_key, threading.Lock())
+
+        # 同じキャッシュを複数スレッドで同時に作らない
+        with create_lock:
+            with self.lock:
+                entry = self.entries.get(cache_key)
+                if entry is not None and entry.expires_at > time.time():
+                    self.hits += 1
+                    return entry.name
+            return self._create(base_url, api_key, model_name, static, cache_key)
+
+    def _create(self, base_url, api_key, model_name, static, cache_key):
+        body = {
+            "model": f"models/{model_name}",
+            "contents": [{
+                "role": "user",
+                "parts": [{"text": static}]
+            }],
+            "ttl": f"{self.ttl_seconds}s"
+        }
+        started = time.time()
+        try:
+            response = gemini_http.post(
+                f"{base_url}/v1beta/cachedContents",
+                headers={"Content-Type": "application/json", "x-goog-api-key": api_key},
+                json=body,
+                timeout=30
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"status {response.status_code}: {response.text[:200]}")
+            name = response.json()["name"]
+        except Exception as e:
+            print(f"[CONTEXT CACHE] ❌ Create failed for {model_name}: {e}")
+            with self.lock:
+                self.failures += 1
+                self.failed_until[cache_key] = time.time() + self.retry_after_failure
+            return None
+
+        with self.lock:
+            self.entries[cache_key] = CacheEntry(name, started + self.ttl_seconds)
+            self.failed_until.pop(cache_key, None)
+            self.created += 1
+        print(f"[CONTEXT CACHE] ✅ Created {name} for {model_name}")
+        return name
+
+    def _refresh(self, base_url, api_key, cache_key, entry):
+        """有効期限を延長（失敗したらエントリを捨てて次回作り直す）"""
+        started = time.time()
+        try:
+            response = gemini_http.patch(
+                f"{base_url}/v1beta/{entry.name}",
+                params={"updateMask": "ttl"},
+                headers={"Content-Type": "application/json", "x-goog-api-key": api_key},
+                json={"ttl": f"{self.ttl_seconds}s"},
+                timeout=30
+            )
+            if response.status_code != 200:
+                raise RuntimeError(f"status {response.status_code}: {response.text[:200]}")
+        except Exception as e:
+            print(f"[CONTEXT CACHE] ⚠️ Refresh failed for {entry.name}: {e}")
+            with self.lock:
+                if self.entries.get(cache_key) is entry:
+                    del self.entries[cache_key]
+            return
+
+        with self.lock:
+            entry.expires_at = started + self.ttl_seconds
+            entry.refreshing = False
+            self.refreshed += 1
+        print(f"[CONTEXT CACHE] 🔄 Refreshed {entry.name}")
+
+    def invalidate(self, api_key, model_name, static):
+        """参照に失敗したキャッシュを捨てる（Gemini 側で消えていた場合など）"""
+        cache_key = self._cache_key(api_key, model_name, static)
+        with self.lock:
+            if self.entries.pop(cache_key, None) is not None:
+                self.invalidated += 1
+                print(f"[CONTEXT CACHE] 🗑️ Invalidated cache for {model_name}")
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "hits": self.hits,
+                "failures": self.failures,
+                "invalidated": self.invalidated
+            }
+
+
+gemini_context_cache = ContextCacheManager(
+    enabled=os.environ.get('GEMINI_CONTEXT_CACHE', '0') == '1',
+    ttl_seconds=int(os.environ.get('GEMINI_CONTEXT_CACHE_TTL', 3600))
+)
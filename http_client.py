@@ -0,0 +1,114 @@
+"""
+HTTPクライアント - 接続プール + Keep-Alive
+Gemini / GitHub への呼び出しで TCP・TLS ハンドシェイクを使い回す
+"""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+def _counting_pool_classes(on_connect):
+    """ソケット接続（= TCP/TLS ハンドシェイク）のたびに on_connect を呼ぶプールクラス"""
+    class CountingHTTPConnection(HTTPConnection):
+        def connect(self):
+            on_connect()
+            super().connect()
+
+    class CountingHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            on_connect()
+            super().connect()
+
+    class CountingHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = CountingHTTPConnection
+
+    class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = CountingHTTPSConnection
+
+    return {'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool}
+
+
+class PooledHTTPClient:
+    """スレッド間で接続プールを共有する HTTP クライアント
+
+    requests.Session はスレッドごとに持ち、接続プール（HTTPAdapter）だけを共有する。
+    """
+    def __init__(self, name, pool_connections=2, pool_maxsize=10):
+        self.name = name
+        self.pool_connections = pool_connections  # プールを保持する接続先ホスト数
+        self.pool_maxsize = pool_maxsize          # 1ホストあたりの最大保持接続数
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=False
+        )
+        self.adapter.poolmanager.pool_classes_by_scheme = _counting_pool_classes(self._on_connect)
+        self.local = threading.local()
+        self.request_count = 0
+        self.connect_count = 0
+        self.lock = threading.Lock()
+
+        print(f"[HTTP] {self.name}: pool_connections={self.pool_connections}, pool_maxsize={self.pool_maxsize}")
+
+    def _session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self.adapter)
+            session.mount('http://', self.adapter)
+            self.local.session = session
+        return session
+
+    def _on_connect(self):
+        with self.lock:
+            self.connect_count += 1
+
+    def request(self, method, url, **kwargs):
+        with self.lock:
+            self.request_count += 1
+        return self._session().request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def get_stats(self):
+        """接続の再利用状況（new_connections = TCP/TLS ハンドシェイク回数）"""
+        with self.lock:
+            request_count = self.request_count
+            connect_count = self.connect_count
+
+        reused = max(0, request_count - connect_count)
+        return {
+            "requests": request_count,
+            "new_connections": connect_count,
+            "reused_connections": reused,
+            "reuse_rate": round(reused / request_count, 3) if request_count else 0.0,
+            "pool_maxsize": self.pool_maxsize
+        }
+
+
+# Gemini: AIキューの同時処理数ぶん接続を保持できるようにする
+gemini_http = PooledHTTPClient(
+    'gemini',
+    pool_maxsize=int(os.environ.get('GEMINI_HTTP_POOL_SIZE', 10))
+)
+
+# GitHub: バックアップは逐次実行なので少数で十分
+github_http = PooledHTTPClient(
+    'github',
+    pool_maxsize=int(os.environ.get('GITHUB_HTTP_POOL_SIZE', 4))
+)
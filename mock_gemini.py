@@ -0,0 +1,283 @@
+"""
+Gemini API のローカル代替サーバー（負荷試験・動作確認用）
+generateContent / streamGenerateContent / cachedContents を模倣し、遅延・エラー・途中切れを注入できる
+
+使い方:
+    python mock_gemini.py --port 8089 --latency lognormal:1.0,0.5 --error-429 0.05
+    GEMINI_BASE_URL=http://127.0.0.1:8089 GOOGLE_API_KEY=AIzaDummy python app.py
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_SUGGESTION = (
+    "朝晩は冷え込むので、厚手のニットに風を通さないアウターを重ねるのがおすすめです。"
+    "日中は気温が上がるため、前を開けられるジャケットやカーディガンで調整しましょう。"
+    "夕方から雨の予報なので、撥水素材のアウターと折りたたみ傘を持って出かけると安心です。"
+    "足元は滑りにくい靴を選び、首元はストールで温度調整すると快適に過ごせます。"
+)
+
+BATCH_COUNT = re.compile(r"# リクエスト一覧（(\d+)件）")
+
+
+class LatencyModel:
+    """応答遅延の分布（秒）
+
+    指定形式:
+        fixed:1.5             常に1.5秒
+        uniform:0.5,3.0       0.5〜3.0秒の一様分布
+        lognormal:1.0,0.5     中央値1.0秒、対数の標準偏差0.5（裾の重い分布）
+        exp:2.0               平均2.0秒の指数分布
+    """
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, args = spec.partition(":")
+        self.kind = kind
+        self.args = [float(value) for value in args.split(",") if value]
+        if kind not in ("fixed", "uniform", "lognormal", "exp"):
+            raise ValueError(f"unknown latency distribution: {spec}")
+
+    def sample(self):
+        if self.kind == "fixed":
+            return self.args[0]
+        if self.kind == "uniform":
+            return random.uniform(self.args[0], self.args[1])
+        if self.kind == "lognormal":
+            return random.lognormvariate(math.log(self.args[0]), self.args[1])
+        return random.expovariate(1 / self.args[0])
+
+
+class MockGeminiConfig:
+    def __init__(self, latency="lognormal:1.0,0.4", model_latency=None,
+                 error_429=0.0, error_500=0.0, truncate=0.0, stream_chunks=8):
+        self.latency = LatencyModel(latency)      # 全モデル共通の遅延
+        self.model_latency = {                    # モデル別の遅延（指定があれば優先）
+            name: LatencyModel(spec) for name, spec in (model_latency or {}).items()
+        }
+        self.error_429 = error_429                # 429 を返す確率
+        self.error_500 = error_500                # 500 を返す確率
+        self.truncate = truncate                  # MAX_TOKENS で途中切れにする確率
+        self.stream_chunks = stream_chunks        # ストリーミング時の分割数
+
+    def latency_for(self, model_name):
+        return self.model_latency.get(model_name, self.latency).sample()
+
+
+class MockGeminiServer:
+    def __init__(self, config, host="127.0.0.1", port=0):
+        self.config = config
+        self.caches = {}   # name -> 固定部分のテキスト
+        self.stats = {
+            "requests": 0, "streams": 0, "batches": 0,
+            "rate_limited": 0, "server_errors": 0, "truncated": 0,
+            "cache_created": 0, "cache_refreshed": 0, "cancelled": 0
+        }
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        print(f"[MOCK GEMINI] Listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def build_text(self, prompt, truncated):
+        """プロンプトに合わせた応答本文（一括リクエストなら件数分の配列）"""
+        match = BATCH_COUNT.search(prompt)
+        if match:
+            count = int(match.group(1))
+            text = json.dumps({
+                "suggestions": [{"id": i, "suggestion": SAMPLE_SUGGESTION} for i in range(1, count + 1)]
+            }, ensure_ascii=False)
+        else:
+            text = json.dumps({"suggestion": SAMPLE_SUGGESTION}, ensure_ascii=False)
+        if truncated:
+            text = text[:len(text) // 2]
+        return text
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _read_json(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _send_json(self, status, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/stats":
+                    self._send_json(200, server.get_stats())
+                else:
+                    self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+
+            def do_PATCH(self):
+                self._read_json()
+                name = self.path.split("?")[0][len("/v1beta/"):]
+                if name not in server.caches:
+                    self._send_json(404, {"error": {"code": 404, "message": f"{name} not found"}})
+                    return
+                server.count("cache_refreshed")
+                self._send_json(200, {"name": name})
+
+            def do_POST(self):
+                body = self._read_json()
+                path = self.path.split("?")[0]
+
+                if path == "/v1beta/cachedContents":
+                    name = f"cachedContents/mock-{len(server.caches) + 1}"
+                    server.caches[name] = body["contents"][0]["parts"][0]["text"]
+                    server.count("cache_created")
+                    self._send_json(200, {"name": name, "model": body.get("model")})
+                    return
+
+                match = re.match(r"^/v1beta/models/([^:]+):(generateContent|streamGenerateContent)$", path)
+                if not match:
+                    self._send_json(404, {"error": {"code": 404, "message": "not found"}})
+                    return
+                model_name, method = match.groups()
+                server.count("requests")
+
+                cache_name = body.get("cachedContent")
+                if cache_name and cache_name not in server.caches:
+                    self._send_json(404, {"error": {"code": 404, "message": f"{cache_name} not found"}})
+                    return
+
+                time.sleep(server.config.latency_for(model_name))
+
+                roll = random.random()
+                if roll < server.config.error_429:
+                    server.count("rate_limited")
+                    self._send_json(429, {"error": {"code": 429, "message": "Resource has been exhausted"}})
+                    return
+                if roll < server.config.error_429 + server.config.error_500:
+                    server.count("server_errors")
+                    self._send_json(500, {"error": {"code": 500, "message": "Internal error"}})
+                    return
+
+                prompt = "".join(part.get("text", "") for content in body.get("contents", [])
+                                 for part in content.get("parts", []))
+                cached_prompt = server.caches.get(cache_name, "")
+                if BATCH_COUNT.search(prompt):
+                    server.count("batches")
+                truncated = random.random() < server.config.truncate
+                if truncated:
+                    server.count("truncated")
+                text = server.build_text(prompt, truncated)
+                finish_reason = "MAX_TOKENS" if truncated else "STOP"
+                usage = {
+                    "promptTokenCount": len(cached_prompt) + len(prompt),
+                    "cachedContentTokenCount": len(cached_prompt),
+                    "candidatesTokenCount": len(text)
+                }
+
+                if method == "generateContent":
+                    self._send_json(200, {
+                        "candidates": [{
+                            "content": {"parts": [{"text": text}], "role": "model"},
+                            "finishReason": finish_reason
+                        }],
+                        "usageMetadata": usage
+                    })
+                    return
+
+                # streamGenerateContent（SSE）: 長さ不明なので送信後に接続を閉じる
+                server.count("streams")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                chunks = server.config.stream_chunks
+                step = max(1, math.ceil(len(text) / chunks))
+                for start in range(0, len(text), step):
+                    candidate = {"content": {"parts": [{"text": text[start:start + step]}], "role": "model"}}
+                    chunk = {"candidates": [candidate]}
+                    if start + step >= len(text):
+                        candidate["finishReason"] = finish_reason
+                        chunk["usageMetadata"] = usage
+                    try:
+                        self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+                        self.wfile.flush()
+                    except (BrokenPipeError, ConnectionResetError):
+                        server.count("cancelled")  # 他のモデルの回答が先に決まり、途中で切られた
+                        return
+                    time.sleep(0.01)
+
+        return Handler
+
+
+def parse_model_latency(values):
+    """["gemini-2.0-flash=fixed:0.5", ...] -> {モデル名: 分布}"""
+    result = {}
+    for value in values or []:
+        name, _, spec = value.partition("=")
+        result[name] = spec
+    return result
+
+
+def add_config_arguments(parser):
+    parser.add_argument("--latency", default="lognormal:1.0,0.4", help="応答遅延の分布（例: fixed:1, uniform:0.5,3, lognormal:1,0.5, exp:2）")
+    parser.add_argument("--model-latency", action="append", metavar="MODEL=SPEC", help="モデル別の遅延分布")
+    parser.add_argument("--error-429", type=float, default=0.0, help="429 を返す確率")
+    parser.add_argument("--error-500", type=float, default=0.0, help="500 を返す確率")
+    parser.add_argument("--truncate", type=float, default=0.0, help="MAX_TOKENS で途中切れにする確率")
+
+
+def config_from_args(args):
+    return MockGeminiConfig(
+        latency=args.latency,
+        model_latency=parse_model_latency(args.model_latency),
+        error_429=args.error_429,
+        error_500=args.error_500,
+        truncate=args.truncate
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gemini API のローカル代替サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockGeminiServer(config_from_args(args), host=args.host, port=args.port).start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,235 @@
+"""
+Gemini モデルチェーン - ヘッジリクエスト + フォールバック
+第1モデルの応答が遅いときは次のモデルにも同じリクエストを送り、先に返った有効な回答を使う
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 別モデルで再試行する価値があるエラー（安全フィルターや入力不備はモデルを変えても同じ）
+# keys_exhausted（使えるAPIキーがない）はどのモデルでも同じキーを使うので含めない
+RETRYABLE_ERRORS = {
+    "rate_limited", "server_error", "timeout", "connection",
+    "invalid_response", "not_found", "http_error", "circuit_open"
+}
+
+
+class ModelStats:
+    """モデルごとの応答時間と成否の記録（直近 window 件）"""
+    def __init__(self, name, window=100):
+        self.name = name
+        self.latencies = deque(maxlen=window)  # 成功した呼び出しの応答時間（秒）
+        self.outcomes = deque(maxlen=window)   # 成否（True/False）
+        self.calls = 0
+        self.successes = 0
+        self.wins = 0                          # 採用された回答の数
+
+    def record(self, latency, result):
+        if result.get("error_kind") in ("circuit_open", "keys_exhausted", "cancelled"):
+            return  # 呼び出していない・途中でやめたので統計に入れない
+        self.calls += 1
+        if result.get("type") == "success":
+            self.successes += 1
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+        elif result.get("error_kind") in RETRYABLE_ERRORS:
+            self.outcomes.append(False)
+
+    def percentile(self, q):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+    def success_rate(self):
+        if not self.outcomes:
+            return None
+        return sum(self.outcomes) / len(self.outcomes)
+
+
+class ModelChain:
+    def __init__(self, models, hedge_percentile=0.95, default_hedge_delay=30,
+                 min_hedge_delay=2, min_samples=20, min_success_rate=0.5, max_workers=40):
+        self.models = models                          # 優先順のモデル名
+        self.hedge_percentile = hedge_percentile      # この分位点の応答時間を過ぎたらヘッジ
+        self.default_hedge_delay = default_hedge_delay  # 統計が貯まるまでのヘッジ待ち時間（秒）
+        self.min_hedge_delay = min_hedge_delay        # ヘッジ待ち時間の下限（秒）
+        self.min_samples = min_samples                # 統計を使うのに必要な件数
+        self.min_success_rate = min_success_rate      # これを下回るモデルは即ヘッジ
+        # 呼び出しはスレッドを使い回す（HTTP セッション・SQLite 接続はスレッドごとに作られるため）
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-chain")
+        self.stats = {name: ModelStats(name) for name in models}
+        self.hedges = 0
+        self.fallbacks = 0
+        self.lock = threading.Lock()
+
+        print(f"[MODEL CHAIN] Initialized: {' -> '.join(self.models)} (hedge at p{int(hedge_percentile * 100)})")
+
+    def hedge_delay(self, model_name):
+        """このモデルの応答を待ってから次のモデルにヘッジするまでの秒数"""
+        with self.lock:
+            stats = self.stats[model_name]
+            if len(stats.outcomes) >= self.min_samples and stats.success_rate() < self.min_success_rate:
+                return 0
+            if len(stats.latencies) < self.min_samples:
+                return self.default_hedge_delay
+            return max(self.min_hedge_delay, stats.percentile(self.hedge_percentile))
+
+    def run(self, call, on_partial=None, reserve_call=None, models=None):
+        """モデルチェーンで生成（最初の成功結果を返す）
+
+        Args:
+            call: call(model_name, on_partial, cancelled) -> 結果 dict
+                  （cancelled は回答が決まったらセットされる Event。見たら途中でやめてよい）
+            on_partial: 途中経過の通知先（最初に書き始めたモデルの分だけ流す）
+            reserve_call: 追加の呼び出し（ヘッジ・フォールバック）前に呼ぶ。False なら送らない
+            models: 今回使うモデル（省略時はチェーン全体）
+        """
+        models = models or self.models
+        results = queue.Queue()
+        partial_state = {"owner": None, "finished": False}
+        partial_lock = threading.Lock()
+        cancelled = threading.Event()
+
+        def forward(index):
+            def emit(text):
+                with partial_lock:
+                    if partial_state["finished"]:
+                        return
+                    if partial_state["owner"] is None:
+                        partial_state["owner"] = index
+                    if partial_state["owner"] != index:
+                        return
+                on_partial(text)
+            return emit
+
+        def start(index):
+            model_name = models[index]
+
+            def worker():
+                if cancelled.is_set():
+                    return  # 待っている間に回答が決まった
+                started = time.monotonic()
+                try:
+                    result = call(model_name, forward(index) if on_partial else None, cancelled)
+                except Exception as e:
+                    print(f"[MODEL CHAIN] ❌ {model_name} raised {type(e).__name__}: {e}")
+                    result = {
+                        "type": "error",
+                        "error_kind": "internal",
+                        "suggestions": {
+                            "suggestion": f"❌ システムエラーが発生しました。\n\nエラー: {str(e)[:100]}"
+                        }
+                    }
+                with self.lock:
+                    self.stats[model_name].record(time.monotonic() - started, result)
+                results.put((index, result))
+
+            self.executor.submit(worker)
+
+        def reserve():
+            return reserve_call is None or reserve_call()
+
+        start(0)
+        next_index = 1
+        pending = 1
+        hedge_at = time.monotonic() + self.hedge_delay(models[0])
+        errors = {}
+
+        while pending:
+            can_hedge = next_index < len(models) and hedge_at is not None
+            timeout = max(0, hedge_at - time.monotonic()) if can_hedge else None
+            try:
+                index, result = results.get(timeout=timeout)
+            except queue.Empty:
+                if not reserve():
+                    print(f"[MODEL CHAIN] ⏸️ Hedge skipped (no quota)")
+                    hedge_at = None
+                    continue
+                print(f"[MODEL CHAIN] 🔀 Hedging {models[next_index]} (waiting on {models[next_index - 1]})")
+                with self.lock:
+                    self.hedges += 1
+                start(next_index)
+                hedge_at = time.monotonic() + self.hedge_delay(models[next_index])
+                next_index += 1
+                pending += 1
+                continue
+
+            pending -= 1
+            model_name = models[index]
+            if result.get("type") == "success":
+                with partial_lock:
+                    partial_state["finished"] = True
+                cancelled.set()  # 残りの呼び出しを止める
+                with self.lock:
+                    self.stats[model_name].wins += 1
+                print(f"[MODEL CHAIN] ✅ Answer from {model_name}")
+                return result
+
+            errors[index] = result
+            with partial_lock:
+                if partial_state["owner"] == index:
+                    partial_state["owner"] = None
+
+            if pending == 0 and next_index < len(models) and result.get("error_kind") in RETRYABLE_ERRORS:
+                if not reserve():
+                    print(f"[MODEL CHAIN] ⏸️ Fallback skipped (no quota)")
+                    break
+                print(f"[MODEL CHAIN] ↪️ Falling back to {models[next_index]} ({model_name}: {result.get('error_kind')})")
+                with self.lock:
+                    self.fallbacks += 1
+                start(next_index)
+                hedge_at = time.monotonic() + self.hedge_delay(models[next_index])
+                next_index += 1
+                pending += 1
+
+        with partial_lock:
+            partial_state["finished"] = True
+        cancelled.set()
+        # 全モデル失敗時は優先度の高いモデルのエラーを返す
+        return errors[min(errors)]
+
+    def get_stats(self):
+        with self.lock:
+            models = {}
+            for name, stats in self.stats.items():
+                p50 = stats.percentile(0.5)
+                p95 = stats.percentile(0.95)
+                success_rate = stats.success_rate()
+                models[name] = {
+                    "calls": stats.calls,
+                    "successes": stats.successes,
+                    "wins": stats.wins,
+                    "success_rate": round(success_rate, 3) if success_rate is not None else None,
+                    "p50_seconds": round(p50, 2) if p50 is not None else None,
+                    "p95_seconds": round(p95, 2) if p95 is not None else None
+                }
+            hedges = self.hedges
+            fallbacks = self.fallbacks
+
+        for name in self.models:
+            models[name]["hedge_delay_seconds"] = round(self.hedge_delay(name), 2)
+        return {
+            "chain": self.models,
+            "hedges": hedges,
+            "fallbacks": fallbacks,
+            "models": models
+        }
+
+
+def _models_from_env():
+    names = os.environ.get('GEMINI_MODELS', 'gemini-2.5-flash,gemini-2.0-flash')
+    return [name.strip() for name in names.split(',') if name.strip()]
+
+
+gemini_models = ModelChain(
+    _models_from_env(),
+    hedge_percentile=float(os.environ.get('GEMINI_HEDGE_PERCENTILE', 0.95)),
+    default_hedge_delay=float(os.environ.get('GEMINI_HEDGE_DELAY', 30)),
+    max_workers=int(os.environ.get('GEMINI_CHAIN_WORKERS', 40))
+)
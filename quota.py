@@ -0,0 +1,140 @@
+"""
+Gemini 利用枠の管理 - トークンバケツ
+無料枠（15リクエスト/分, 1500リクエスト/日）を超える呼び出しを送る前に止める
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """capacity 個まで貯まり、period_seconds 秒で capacity 個補充されるバケツ"""
+    def __init__(self, name, capacity, period_seconds):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / period_seconds  # 1秒あたりの補充数
+
+    def refill(self, tokens, updated_at, now):
+        return min(self.capacity, tokens + max(0, now - updated_at) * self.rate)
+
+    def wait_time(self, tokens, needed):
+        """needed 個貯まるまでの秒数"""
+        if tokens >= needed:
+            return 0
+        return (needed - tokens) / self.rate
+
+
+class LocalQuotaState:
+    """プロセス内のバケツ状態（共有ストアを使わない場合）"""
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get_values(self, defaults):
+        with self.lock:
+            return {key: self.values.get(key, default) for key, default in defaults.items()}
+
+    def update_values(self, defaults, fn):
+        with self.lock:
+            current = {key: self.values.get(key, default) for key, default in defaults.items()}
+            updated = fn(current)
+            self.values.update(updated)
+            return updated
+
+
+class QuotaGovernor:
+    """複数のトークンバケツ（分・日）をまとめて管理
+
+    state は get_values / update_values を持つ状態置き場
+    （LocalQuotaState か、ワーカー間で共有する SQLiteQueueStore）。
+    同じ state に複数の枠を置く場合は prefix で分ける。
+    """
+    def __init__(self, buckets, state, prefix="quota"):
+        self.buckets = buckets
+        self.state = state
+        self.prefix = prefix
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+        limits = ", ".join(f"{b.name}={b.capacity}" for b in self.buckets)
+        print(f"[QUOTA] Initialized: {limits}")
+
+    def _defaults(self):
+        now = time.time()
+        defaults = {}
+        for bucket in self.buckets:
+            defaults[f"{self.prefix}:{bucket.name}:tokens"] = float(bucket.capacity)
+            defaults[f"{self.prefix}:{bucket.name}:updated_at"] = now
+        return defaults
+
+    def _refilled(self, values, now):
+        return {
+            bucket.name: bucket.refill(
+                values[f"{self.prefix}:{bucket.name}:tokens"],
+                values[f"{self.prefix}:{bucket.name}:updated_at"],
+                now
+            )
+            for bucket in self.buckets
+        }
+
+    def eta(self, needed=1):
+        """needed 回ぶんの枠が空くまでの秒数（0 なら今すぐ可能）"""
+        now = time.time()
+        tokens = self._refilled(self.state.get_values(self._defaults()), now)
+        return max(bucket.wait_time(tokens[bucket.name], needed) for bucket in self.buckets)
+
+    def try_acquire(self):
+        """枠を1つ消費。足りなければ消費せずに待ち時間を返す
+
+        Returns:
+            (取得できたか, 待ち時間（秒）)
+        """
+        outcome = {}
+
+        def consume(values):
+            now = time.time()
+            tokens = self._refilled(values, now)
+            wait = max(bucket.wait_time(tokens[bucket.name], 1) for bucket in self.buckets)
+            if wait == 0:
+                tokens = {name: count - 1 for name, count in tokens.items()}
+            outcome['wait'] = wait
+
+            updated = {}
+            for bucket in self.buckets:
+                updated[f"{self.prefix}:{bucket.name}:tokens"] = tokens[bucket.name]
+                updated[f"{self.prefix}:{bucket.name}:updated_at"] = now
+            return updated
+
+        self.state.update_values(self._defaults(), consume)
+        if outcome['wait'] > 0:
+            with self.lock:
+                self.rejected += 1
+        return outcome['wait'] == 0, outcome['wait']
+
+    def refund(self, count=1):
+        """確保したが使わなかった枠を返す"""
+        if count <= 0:
+            return
+
+        def give_back(values):
+            now = time.time()
+            tokens = self._refilled(values, now)
+            updated = {}
+            for bucket in self.buckets:
+                updated[f"{self.prefix}:{bucket.name}:tokens"] = min(bucket.capacity, tokens[bucket.name] + count)
+                updated[f"{self.prefix}:{bucket.name}:updated_at"] = now
+            return updated
+
+        self.state.update_values(self._defaults(), give_back)
+
+    def get_stats(self):
+        now = time.time()
+        tokens = self._refilled(self.state.get_values(self._defaults()), now)
+        with self.lock:
+            stats = {"rejected": self.rejected}
+        for bucket in self.buckets:
+            stats[bucket.name] = {
+                "available": round(tokens[bucket.name], 2),
+                "capacity": bucket.capacity
+            }
+        return stats
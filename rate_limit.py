@@ -0,0 +1,207 @@
+"""
+回数制限 - スライディングウィンドウカウンター
+「period_seconds 秒あたり limit 回まで」をキーごとに定数サイズの状態で判定する
+（リクエストごとのタイムスタンプを保持しない）
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+
+
+class SlidingWindowCounter:
+    """直前のウィンドウと現在のウィンドウの回数から、直近 period_seconds 秒の回数を見積もる
+
+    キーごとの状態は [現在のウィンドウ番号, 直前のウィンドウの回数, 現在のウィンドウの回数] のみ。
+    直前のウィンドウの回数は、経過割合に応じて残っている分だけ数える。
+    """
+    def __init__(self, limit, period_seconds):
+        self.limit = limit
+        self.period = period_seconds
+        self.windows = {}   # key -> [ウィンドウ番号, 直前の回数, 現在の回数]
+        self.lock = threading.Lock()
+
+    def _current(self, key, now):
+        """key の状態を now 時点のウィンドウに進めたもの（未記録なら None）"""
+        state = self.windows.get(key)
+        if state is None:
+            return None
+        return self.advance(state, now)
+
+    def advance(self, state, now):
+        """状態を now 時点のウィンドウに進める（状態を別の場所に保存する場合にも使う）"""
+        index = int(now // self.period)
+        if state[0] == index:
+            return state
+        if state[0] == index - 1:
+            return [index, state[2], 0]
+        return [index, 0, 0]
+
+    def _estimate(self, state, now):
+        elapsed = (now % self.period) / self.period
+        return state[1] * (1 - elapsed) + state[2]
+
+    def _retry_after(self, state, now):
+        """見積もりが limit を下回るまでの秒数"""
+        offset = now % self.period
+        previous, current = state[1], state[2]
+        if current < self.limit:
+            # 直前のウィンドウの回数が減っていくのを待つ
+            fraction = 1 - (self.limit - current) / previous
+            return max(0.0, fraction * self.period - offset)
+        # 次のウィンドウで現在の回数が直前の回数になり、それが減るのを待つ
+        fraction = 1 - self.limit / current
+        return (self.period - offset) + fraction * self.period
+
+    def evaluate(self, state, now):
+        """now 時点に進めた状態で判定
+
+        Returns:
+            (許可されるか, 待ち時間（秒）, 直近 period_seconds 秒の見積もり回数)
+        """
+        if state is None:
+            return True, 0, 0
+        count = self._estimate(state, now)
+        if count < self.limit:
+            return True, 0, count
+        return False, self._retry_after(state, now), count
+
+    def check(self, key, now=None):
+        """記録せずに判定（戻り値は evaluate と同じ）"""
+        now = time.time() if now is None else now
+        with self.lock:
+            return self.evaluate(self._current(key, now), now)
+
+    def record(self, key, now=None):
+        """1回分を記録"""
+        now = time.time() if now is None else now
+        with self.lock:
+            state = self._current(key, now) or [int(now // self.period), 0, 0]
+            state[2] += 1
+            self.windows[key] = state
+
+    def count(self, key, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            state = self._current(key, now)
+            return self._estimate(state, now) if state else 0
+
+    def forget(self, key):
+        with self.lock:
+            self.windows.pop(key, None)
+
+    def purge(self, now=None):
+        """直近 period_seconds 秒に記録のないキーを削除"""
+        now = time.time() if now is None else now
+        index = int(now // self.period)
+        with self.lock:
+            stale = [key for key, state in self.windows.items() if state[0] < index - 1]
+            for key in stale:
+                del self.windows[key]
+            return len(stale)
+
+    def export_state(self):
+        with self.lock:
+            return {key: list(state) for key, state in self.windows.items()}
+
+    def load_state(self, data, now=None):
+        """export_state の内容を読み込む（期限切れのキーは捨て、手元にもあるキーは多い方を残す）"""
+        now = time.time() if now is None else now
+        index = int(now // self.period)
+        with self.lock:
+            for key, state in data.items():
+                loaded = [int(state[0]), state[1], state[2]]
+                if loaded[0] < index - 1:
+                    continue
+                current = self.windows.get(key)
+                if current is None or loaded[0] > current[0]:
+                    self.windows[key] = loaded
+                elif loaded[0] == current[0]:
+                    self.windows[key] = [current[0], max(current[1], loaded[1]), max(current[2], loaded[2])]
+
+    def __len__(self):
+        return len(self.windows)
+
+
+class StateSnapshotter:
+    """制限の状態を定期的にファイルへ書き出し、起動時に読み戻す
+
+    target は export_state() / load_state(data) を持つもの。
+    書き出しは裏のスレッドだけで行い、判定の処理ではディスクに触れない。
+    書き出す前にファイルの内容を読み込んで合わせるため、
+    同じファイルを使う他ワーカーの記録も引き継がれる。
+    """
+    def __init__(self, name, target, path, interval=30):
+        self.name = name
+        self.target = target
+        self.path = path
+        self.interval = interval  # 書き出し間隔（秒）
+        self.saves = 0
+        self.failures = 0
+        self.restored = False
+        self.last_saved_at = None
+        self.lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def restore(self):
+        """起動時の読み込み（壊れたファイルは無視して空の状態で始める）"""
+        try:
+            data = self._read()
+            if data is not None:
+                self.target.load_state(data)
+                self.restored = True
+                print(f"[{self.name}] 📂 Restored state from {self.path}")
+        except Exception as e:
+            print(f"[{self.name}] ⚠️ Could not restore state from {self.path}: {e}")
+
+    def save(self):
+        """一時ファイルに書いてから置き換える（途中で落ちても前回の内容が残る）"""
+        with self.lock:
+            try:
+                try:
+                    data = self._read()
+                    if data is not None:
+                        self.target.load_state(data)
+                except ValueError:
+                    pass  # 壊れたファイルは上書きする
+                state = self.target.export_state()
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp_path, self.path)
+                self.saves += 1
+                self.last_saved_at = time.time()
+            except Exception as e:
+                self.failures += 1
+                print(f"[{self.name}] ❌ Could not save state to {self.path}: {e}")
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.save()
+
+    def start(self):
+        self.restore()
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.save)  # 正常終了（デプロイ時の停止など）でも書き出す
+        print(f"[{self.name}] Snapshot: {self.path} every {self.interval}s")
+        return self
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "path": self.path,
+                "interval_seconds": self.interval,
+                "saves": self.saves,
+                "failures": self.failures,
+                "restored": self.restored,
+                "last_saved_age": round(time.time() - self.last_saved_at, 1) if self.last_saved_at else None
+            }
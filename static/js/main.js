@@ -702,7 +702,8 @@ const AIModule = {
     countdownTimer: null,
     countdownInterval: null,
     errorCountdownInterval: null,
-    queuePollingInterval: null,
+    queueStream: null,
+    resultPollWait: 20,  // 結果取得のロングポーリング待機（秒）
 
     getDummyData: () => {
         return {
@@ -719,39 +720,84 @@ const AIModule = {
         return `${secs}秒`;
     },
 
-    startQueuePolling: () => {
-        if (AIModule.queuePollingInterval) {
-            clearInterval(AIModule.queuePollingInterval);
+    // ジョブの進捗を SSE で受け取り、完了時の結果を Response として返す
+    waitForJob: (deviceId, job) => {
+        AIModule.updateQueueDisplay(job.queue_status, job.position);
+
+        if (!window.EventSource) {
+            return AIModule.pollJobResult(deviceId, job.job_id);
         }
 
-        AIModule.queuePollingInterval = setInterval(async () => {
-            try {
-                const response = await fetch("/api/ai_queue_status");
-                if (!response.ok) return;
+        return new Promise((resolve) => {
+            AIModule.closeQueueStream();
+
+            const params = new URLSearchParams({ device_id: deviceId, job_id: job.job_id });
+            const source = new EventSource(`/api/suggest_outfit/stream?${params}`);
+            AIModule.queueStream = source;
 
-                const status = await response.json();
-                AIModule.updateQueueDisplay(status);
-            } catch (error) {
-                console.error("Queue polling error:", error);
+            source.addEventListener('status', (event) => {
+                const status = JSON.parse(event.data);
+                AIModule.updateQueueDisplay(status.queue_status, status.position);
+            });
+
+            source.addEventListener('partial', (event) => {
+                AIModule.renderPartial(JSON.parse(event.data).text);
+            });
+
+            source.addEventListener('result', (event) => {
+                const data = JSON.parse(event.data);
+                AIModule.closeQueueStream();
+                resolve(new Response(JSON.stringify(data.body), { status: data.status_code }));
+            });
+
+            source.onerror = () => {
+                // 接続が切れた場合はロングポーリングで結果を取りに行く
+                if (AIModule.queueStream !== source) return;
+                AIModule.closeQueueStream();
+                resolve(AIModule.pollJobResult(deviceId, job.job_id));
+            };
+        });
+    },
+
+    pollJobResult: async (deviceId, jobId) => {
+        let response;
+        do {
+            response = await fetch("/api/suggest_outfit/result", {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({
+                    device_id: deviceId,
+                    job_id: jobId,
+                    wait: AIModule.resultPollWait
+                })
+            });
+
+            if (response.status === 202) {
+                const job = await response.clone().json();
+                AIModule.updateQueueDisplay(job.queue_status, job.position);
             }
-        }, 10000);
+        } while (response.status === 202);
+
+        return response;
     },
 
-    stopQueuePolling: () => {
-        if (AIModule.queuePollingInterval) {
-            clearInterval(AIModule.queuePollingInterval);
-            AIModule.queuePollingInterval = null;
+    closeQueueStream: () => {
+        if (AIModule.queueStream) {
+            AIModule.queueStream.close();
+            AIModule.queueStream = null;
         }
     },
 
-    updateQueueDisplay: (status) => {
+    updateQueueDisplay: (status, position = 0) => {
         const btn = document.getElementById('ai-suggest-btn');
         if (!btn || !btn.disabled) return;
 
         const { active, queue } = status;
         
         if (btn.innerHTML.includes('処理中') || btn.innerHTML.includes('待機中')) {
-            if (queue > 0) {
+            if (position > 0) {
+                btn.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> 待機中 ${position}番目（処理中 ${active}人）`;
+            } else if (queue > 0) {
                 btn.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> 処理中 ${active}人、待機中 ${queue}人`;
             } else if (active > 0) {
                 btn.innerHTML = `<i class="fa-solid fa-spinner fa-spin"></i> 処理中 ${active}人`;
@@ -793,10 +839,9 @@ const AIModule = {
         btn.innerHTML = '<i class="fa-solid fa-spinner fa-spin"></i> 処理中...';
         ThemeModule.triggerButtonAnim(btn);
 
-        AIModule.startQueuePolling();
-
         try {
-            const response = await fetch("/api/suggest_outfit", {
+            // ジョブを登録し、結果は SSE（非対応ならロングポーリング）で受け取る
+            let response = await fetch("/api/suggest_outfit/submit", {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
                 body: JSON.stringify({
@@ -806,10 +851,16 @@ const AIModule = {
                     scene: finalScene,
                     gender: gender,
                     preference: preference,
-                    wardrobe: wardrobe
+                    wardrobe: wardrobe,
+                    stream: !!window.EventSource  // 生成途中の提案文を受け取る
                 })
             });
 
+            if (response.status === 202) {
+                const job = await response.json();
+                response = await AIModule.waitForJob(deviceId, job);
+            }
+
             if (response.status === 503) {
                 const errorData = await response.json();
                 alert(`⚠️ 混雑中\n\n${errorData.message}`);
@@ -818,7 +869,7 @@ const AIModule = {
                 btn.innerHTML = '<i class="fa-solid fa-robot"></i> AI服装提案を取得';
                 btn.disabled = false;
                 
-                AIModule.stopQueuePolling();
+                AIModule.closeQueueStream();
                 return;
             }
 
@@ -836,7 +887,7 @@ const AIModule = {
                 if (resetBtn) resetBtn.classList.remove('hidden');
                 
                 AIModule.startCountdown(remainingTime, btn);
-                AIModule.stopQueuePolling();
+                AIModule.closeQueueStream();
                 return;
             }
 
@@ -865,7 +916,7 @@ const AIModule = {
 
         } finally {
             btn.disabled = false;
-            AIModule.stopQueuePolling();
+            AIModule.closeQueueStream();
         }
     },
 
@@ -1003,6 +1054,26 @@ const AIModule = {
         AIModule.errorCountdownInterval = setInterval(updateDisplay, 1000);
     },
 
+    // ストリーミング中の提案文を表示（完了時に renderResult で置き換える）
+    renderPartial: (text) => {
+        const resultArea = document.getElementById('ai-result-area');
+        let textElement = document.getElementById('ai-partial-text');
+
+        if (!textElement) {
+            resultArea.innerHTML = `
+                <div class="bg-white dark:bg-slate-700 border border-purple-200 dark:border-slate-600 rounded-lg p-6 shadow-sm fade-in-up">
+                    <h4 class="font-bold text-purple-600 dark:text-purple-400 mb-3 border-b border-purple-100 dark:border-slate-600 pb-2 flex items-center gap-2">
+                        <i class="fa-solid fa-spinner fa-spin"></i> 提案を生成中...
+                    </h4>
+                    <p id="ai-partial-text" class="text-gray-700 dark:text-slate-200 text-sm md:text-base leading-relaxed whitespace-pre-wrap"></p>
+                </div>
+            `;
+            textElement = document.getElementById('ai-partial-text');
+        }
+
+        textElement.textContent = text;
+    },
+
     renderResult: (data) => {
         if (AIModule.errorCountdownInterval) {
             clearInterval(AIModule.errorCountdownInterval);
@@ -1093,7 +1164,7 @@ const AIModule = {
         if (resetBtn) resetBtn.classList.add('hidden');
         
         AIModule.stopCountdown();
-        AIModule.stopQueuePolling();
+        AIModule.closeQueueStream();
         
         if (AIModule.errorCountdownInterval) {
             clearInterval(AIModule.errorCountdownInterval);
@@ -1227,6 +1298,8 @@ const BoardModule = {
     currentUsername: null,
     replyToPostId: null,
     autoRefreshInterval: null,
+    postsCursor: null,    // 前回取得した位置（送ると差分だけが返り、変わっていなければ 304 が返る）
+    postsById: new Map(), // 取得済みの投稿（差分をここに反映する）
     
     init: () => {
         BoardModule.setupEventListeners();
@@ -1525,17 +1598,44 @@ const BoardModule = {
             const response = await fetch('/api/board/get_posts', {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ device_id: deviceId })
+                body: JSON.stringify({ device_id: deviceId, since: BoardModule.postsCursor })
             });
+            
+            // 🆕 前回から変更なし → 表示はそのまま
+            if (response.status === 304) {
+                if (!silent) {
+                    console.log('[BOARD] Posts not modified');
+                }
+                return;
+            }
+            
             const data = await response.json();
+            BoardModule.postsCursor = data.cursor || null;
+            
+            // 🆕 差分なら追加・更新・削除だけを反映、そうでなければ全件を入れ替える
+            const postsById = BoardModule.postsById;
+            if (!data.delta) {
+                postsById.clear();
+            }
+            data.posts.forEach(post => postsById.set(post.id, post));
+            (data.deleted_ids || []).forEach(id => postsById.delete(id));
+            
+            // 🆕 自分の投稿は ID のリストで返ってくる
+            const ownPostIds = new Set(data.own_post_ids || []);
+            const posts = Array.from(postsById.values());
+            posts.forEach(post => {
+                post.is_own = ownPostIds.has(post.id);
+            });
+            posts.sort((a, b) => (a.timestamp < b.timestamp ? 1 : a.timestamp > b.timestamp ? -1 : 0));
             
-            BoardModule.renderPosts(data.posts);
+            BoardModule.renderPosts(posts);
             
             if (!silent) {
-                console.log('[BOARD] Posts loaded:', data.posts.length);
+                console.log(`[BOARD] Posts ${data.delta ? 'updated' : 'loaded'}:`, data.posts.length);
             }
         } catch (error) {
             console.error('[BOARD] Failed to load posts:', error);
+            BoardModule.postsCursor = null;  // 次回は必ず一覧を取り直す
             
             if (!silent) {
                 const container = document.getElementById('board-posts-container');
@@ -0,0 +1,82 @@
+"""
+服装提案の一括リクエスト（マイクロバッチ）
+短い時間内に届いたリクエストをまとめ、1回の Gemini 呼び出しで複数人分の提案を生成する
+"""
+
+import threading
+
+
+class Batch:
+    """まとめて送るリクエストの集まり"""
+    def __init__(self):
+        self.items = []                 # (weather, options) のリスト
+        self.results = None
+        self.full = threading.Event()   # 上限件数に達したら先頭の人がすぐ送信する
+        self.done = threading.Event()
+
+
+class SuggestionBatcher:
+    def __init__(self, send, max_size=5, window_seconds=0.5):
+        self.send = send                      # send(items) -> items と同じ順の結果リスト
+        self.max_size = max_size              # 1回にまとめる最大件数
+        self.window_seconds = window_seconds  # 最初の1件が後続を待つ時間（秒）
+        self.current = None                   # 受付中のバッチ
+        self.batches = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+        print(f"[AI BATCH] Initialized: Max size={self.max_size}, Window={self.window_seconds}s")
+
+    def submit(self, weather, options):
+        """リクエストをバッチに加え、自分の分の結果を返す
+
+        受付中のバッチがなければ自分が先頭になり、window_seconds 待つか
+        max_size 件集まった時点でまとめて送信する。
+        """
+        with self.lock:
+            batch = self.current
+            leader = batch is None
+            if leader:
+                batch = self.current = Batch()
+            index = len(batch.items)
+            batch.items.append((weather, options))
+            if len(batch.items) >= self.max_size:
+                self.current = None
+                batch.full.set()
+
+        if not leader:
+            batch.done.wait()
+            return batch.results[index]
+
+        batch.full.wait(self.window_seconds)
+        with self.lock:
+            if self.current is batch:
+                self.current = None
+            self.batches += 1
+            self.requests += len(batch.items)
+
+        print(f"[AI BATCH] 📦 Sending {len(batch.items)} request(s) in one call")
+        try:
+            batch.results = self.send(batch.items)
+        except Exception as e:
+            print(f"[AI BATCH] ❌ Batch failed: {e}")
+            batch.results = [{
+                "type": "error",
+                "suggestions": {
+                    "suggestion": f"❌ システムエラーが発生しました。\n\nエラー: {str(e)[:100]}"
+                }
+            }] * len(batch.items)
+        finally:
+            batch.done.set()
+        return batch.results[index]
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "enabled": True,
+                "max_size": self.max_size,
+                "window_seconds": self.window_seconds,
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0
+            }
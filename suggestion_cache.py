@@ -0,0 +1,176 @@
+"""
+服装提案キャッシュ - TTL + LRU
+同じ地点・時間帯で同じ条件のリクエストは Gemini を呼ばずに前回の提案を返す
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+def _normalize_value(value):
+    """数値は小数1桁に丸め、文字列は前後の空白を除去"""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return round(float(value), 1)
+    if isinstance(value, str):
+        text = value.strip()
+        try:
+            return round(float(text), 1)
+        except ValueError:
+            return text
+    return value
+
+
+def _text_or_default(value):
+    """プロンプトで「特になし」に置き換えられる空値を揃える"""
+    text = (value or "").strip()
+    return text or "特になし"
+
+
+def make_cache_key(weather, options):
+    """プロンプトに実際に使われる項目だけから正規化したキーを作る"""
+    hourly = []
+    for hour_data in (weather.get("hourly_forecast") or [])[:12]:
+        hourly.append([
+            _normalize_value(hour_data.get("time")),
+            _normalize_value(hour_data.get("temperature")),
+            _normalize_value(hour_data.get("precipitation", 0)),
+            _normalize_value(hour_data.get("precipitation_probability", 0)),
+            _normalize_value(hour_data.get("weather")),
+        ])
+
+    gender = options.get("gender", "unspecified")
+    canonical = {
+        "weather": _normalize_value(weather.get("weather")),
+        "temp": _normalize_value(weather.get("temp")),
+        "temp_max": _normalize_value(weather.get("temp_max")),
+        "temp_min": _normalize_value(weather.get("temp_min")),
+        "humidity": _normalize_value(weather.get("humidity")),
+        "precipitation": _normalize_value(weather.get("precipitation", 0)),
+        "pressure": _normalize_value(weather.get("pressure")),
+        "hourly": hourly,
+        "mode": "detailed" if options.get("mode") == "detailed" else "simple",
+        "scene": _text_or_default(options.get("scene")),
+        "gender": gender if gender in ("mens", "ladies") else "unspecified",
+        "preference": _text_or_default(options.get("preference")),
+        "wardrobe": _text_or_default(options.get("wardrobe")),
+    }
+    encoded = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class SuggestionCache:
+    def __init__(self, max_entries=256, ttl_seconds=600):
+        self.max_entries = max_entries  # 最大保持件数（超えたら古い順に破棄）
+        self.ttl_seconds = ttl_seconds  # 有効期限（秒）
+        self.entries = OrderedDict()    # key -> (保存時刻, 結果)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        print(f"[AI CACHE] Initialized: Max entries={self.max_entries}, TTL={self.ttl_seconds}s")
+
+    def get(self, weather, options):
+        """キャッシュ済みの提案を取得（なければ None）"""
+        key = make_cache_key(weather, options)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl_seconds:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, weather, options, result):
+        """成功した提案を保存"""
+        if result.get("type") != "success":
+            return
+        key = make_cache_key(weather, options)
+        with self.lock:
+            self.entries[key] = (time.time(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+class Flight:
+    """実行中の Gemini 呼び出し（同一内容のリクエストで共有）"""
+    def __init__(self, key):
+        self.key = key
+        self.followers = 0
+        self.result = None
+        self.status_code = None
+        self.done = threading.Event()
+
+
+class SingleFlight:
+    """同一内容の同時リクエストを1回の Gemini 呼び出しにまとめる"""
+    def __init__(self, wait_timeout=330):
+        self.wait_timeout = wait_timeout  # 後続が先行リクエストを待つ上限（秒）
+        self.flights = {}                 # key -> Flight
+        self.leaders = 0
+        self.coalesced = 0
+        self.lock = threading.Lock()
+
+    def begin(self, weather, options):
+        """実行中の同一リクエストがあれば相乗りし、なければ先行者として登録
+
+        Returns:
+            (Flight, 先行者か)
+        """
+        key = make_cache_key(weather, options)
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.coalesced += 1
+                return flight, False
+
+            flight = Flight(key)
+            self.flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def finish(self, flight, result, status_code):
+        """先行者の結果を後続に配る"""
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+        flight.result = result
+        flight.status_code = status_code
+        flight.done.set()
+
+    def wait(self, flight):
+        """先行者の結果を待つ（タイムアウトで False）"""
+        return flight.done.wait(self.wait_timeout)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "in_flight": len(self.flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced
+            }